@@ -0,0 +1,325 @@
+""" Asyncio wrappers for the labchat drivers
+
+The drivers in labchat are blocking: a `Scope.get_data` call can hold the
+calling thread for minutes and `_set_with_check` sleeps between attempts.
+The classes in this module wrap a driver instance so that it can be used
+from an asyncio event loop without blocking it.  Each wrapper owns a
+dedicated single-thread executor in which all of the instrument I/O is run,
+so that commands to one instrument are serialized while many instruments are
+driven concurrently from the same loop.
+
+The pauses of `_set_with_check` (and so of the AFG2225 setters) and of
+`Scope.get_data` are taken with `asyncio.sleep` so that they do not occupy
+the executor.  The setters run the driver's own generator of steps (see
+`VisaUsbInstrument._set_with_check_steps`) one step at a time in the
+executor, so their logic and the driver's state stay in the driver.
+
+Any other method of the wrapped driver is run in the executor as a whole, so
+e.g. `await scope.measure(1, 'FREQ')` works as expected.
+
+Example::
+
+    async def main():
+        async with AsyncScope(Scope(0)) as scope, \\
+                AsyncAFG2225(AFG2225(1)) as afg:
+            await afg.set_wave(1, 'SIN', frequency=1e3, amplitude=1.0)
+            times, data = await scope.get_data(1)
+
+Note that each wrapper should be driven by one task at a time; two tasks
+issuing composite operations to the same instrument can interleave their
+commands.
+"""
+
+import asyncio
+import functools
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from labchat.visausb import VisaUsbInstrument
+from labchat.gwinstek import AFG2225
+from labchat.tekscope import Scope
+
+__email__ = "chrisark7@gmail.com"
+__status__ = "Development"
+
+logger = logging.getLogger(__name__)
+
+
+###############################################################################
+# Generic Wrapper
+###############################################################################
+class AsyncInstrument(object):
+    """ Wraps a driver instance so that its methods can be awaited
+
+    Every method of the wrapped instrument is available as a coroutine
+    function which runs the method in the wrapper's executor.
+    """
+    def __init__(self, instrument, executor=None):
+        """ The constructor for the AsyncInstrument class
+
+        :param instrument: The driver instance to wrap
+        :param executor: The executor used for the blocking calls; by default a new single-thread executor is created
+        :type executor: concurrent.futures.Executor
+        """
+        self.instrument = instrument
+        self._owns_executor = executor is None
+        if executor is None:
+            executor = ThreadPoolExecutor(
+                max_workers=1,
+                thread_name_prefix='labchat-{0}'.format(type(instrument).__name__))
+        self.executor = executor
+
+    def __repr__(self):
+        return '{0}({1!r})'.format(type(self).__name__, self.instrument)
+
+    async def run(self, func, *args, **kwargs):
+        """ Runs a blocking callable in the instrument's executor
+
+        :param func: The callable to run
+        :return: The return value of `func`
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.executor, functools.partial(func, *args, **kwargs))
+
+    def __getattr__(self, attr):
+        value = getattr(self.instrument, attr)
+        if not callable(value):
+            return value
+
+        @functools.wraps(value)
+        async def method(*args, **kwargs):
+            return await self.run(value, *args, **kwargs)
+        return method
+
+    async def open(self):
+        """ Opens the connection to the instrument
+        """
+        return await self.run(self.instrument.open)
+
+    async def close(self):
+        """ Closes the connection to the instrument
+        """
+        return await self.run(self.instrument.close)
+
+    def shutdown(self, wait=True):
+        """ Shuts down the executor if it was created by this wrapper
+        """
+        if self._owns_executor:
+            self.executor.shutdown(wait=wait)
+
+    async def __aenter__(self):
+        if not getattr(self.instrument, 'is_open', False):
+            await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        try:
+            if getattr(self.instrument, 'is_open', False):
+                await self.close()
+        finally:
+            self.shutdown(wait=False)
+
+    ###########################################################################
+    # Communication Methods
+    ###########################################################################
+    async def write(self, command):
+        """ Writes a command to the instrument
+
+        :param command: A valid command to the instrument
+        :type command: str
+        :return: the output of the write command
+        """
+        return await self.run(self.instrument.write, command)
+
+    async def read(self, *args, **kwargs):
+        """ Reads the most recent output from the instrument
+
+        :return: The output of the read command
+        :rtype: str
+        """
+        return await self.run(self.instrument.read, *args, **kwargs)
+
+    async def query(self, command):
+        """ Queries a value from the instrument
+
+        The write and read are issued as one job in the executor, so that they
+        cannot be separated by other commands to the instrument.
+
+        :param command: A valid command to the instrument
+        :type command: str
+        :return: the output of the query command
+        :rtype: str
+        """
+        return await self.run(self.instrument.query, command)
+
+
+class AsyncVisaUsbInstrument(AsyncInstrument):
+    """ Asyncio wrapper for subclasses of VisaUsbInstrument
+    """
+    async def _run_steps(self, steps):
+        """ Runs a driver's generator of steps with `asyncio.sleep` pauses
+
+        This is the asynchronous equivalent of `VisaUsbInstrument._run_steps`:
+        each step of the generator (and so all of its I/O and any changes to
+        the driver's state) runs in the executor, and the pauses it yields
+        are taken on the event loop.
+
+        :param steps: A generator such as `_set_with_check_steps`
+        :type steps: generator
+        :return: The return value of the generator
+        """
+        while True:
+            done, value = await self.run(_next_step, steps)
+            if done:
+                return value
+            await asyncio.sleep(value)
+
+    async def _set_with_check(self, command, query, result, transform=None,
+                              timeout=5):
+        """ Asynchronous equivalent of `VisaUsbInstrument._set_with_check`
+        """
+        return await self._run_steps(self.instrument._set_with_check_steps(
+            command, query, result, transform, timeout))
+
+
+def _next_step(steps):
+    """ Runs the next step of a generator, returning (done, pause or result)
+    """
+    try:
+        return False, next(steps)
+    except StopIteration as e:
+        return True, e.value
+
+
+###############################################################################
+# Driver Specific Wrappers
+###############################################################################
+class AsyncAFG2225(AsyncVisaUsbInstrument):
+    """ Asyncio wrapper for the GW Instek AFG2225
+
+    The setters run the driver's own steps (range checks, verification,
+    retries and shadow state updates) in the executor and take their pauses
+    with `asyncio.sleep`; see the AFG2225 class for the meaning of the
+    arguments.  The composite methods, e.g. `set_output`, `set_wave` and
+    `set_waves`, run whole in the executor.
+    """
+    async def _set_numeric(self, channel, name, value):
+        """ Asynchronous equivalent of `AFG2225._set_numeric`
+        """
+        channel = AFG2225._check_channel(channel)
+        return await self._run_steps(
+            self.instrument._set_numeric_steps(channel, name, value))
+
+    async def _set_from_commands(self, channel, name, commands, *args):
+        """ Sets a setting with the (command, query, result) built by `commands`
+
+        :param channel: The channel of the setting (1 or 2)
+        :param name: The name of the setting, e.g. "wavetype"
+        :param commands: One of the driver's `_*_commands` methods
+        :return: True if set, False if not
+        :rtype: bool
+        """
+        channel = AFG2225._check_channel(channel)
+        command, query, result = await self.run(commands, channel, *args)
+        return await self._run_steps(self.instrument._set_setting_steps(
+            channel, name, command, query, result))
+
+    async def set_wavetype(self, channel, wavetype):
+        """ Asynchronous equivalent of `AFG2225.set_wavetype`
+        """
+        assert type(wavetype) is str
+        return await self._set_from_commands(
+            channel, "wavetype", self.instrument._wavetype_commands, wavetype)
+
+    async def set_frequency(self, channel, frequency):
+        """ Asynchronous equivalent of `AFG2225.set_frequency`
+        """
+        return await self._set_numeric(channel, "frequency", frequency)
+
+    async def set_amplitude(self, channel, amplitude):
+        """ Asynchronous equivalent of `AFG2225.set_amplitude`
+        """
+        return await self._set_numeric(channel, "amplitude", amplitude)
+
+    async def set_offset(self, channel, offset):
+        """ Asynchronous equivalent of `AFG2225.set_offset`
+        """
+        return await self._set_numeric(channel, "offset", offset)
+
+    async def set_square_duty(self, channel, duty):
+        """ Asynchronous equivalent of `AFG2225.set_square_duty`
+        """
+        return await self._set_numeric(channel, "square_duty", duty)
+
+    async def set_ramp_symmetry(self, channel, symmetry):
+        """ Asynchronous equivalent of `AFG2225.set_ramp_symmetry`
+        """
+        return await self._set_numeric(channel, "ramp_symmetry", symmetry)
+
+    async def set_phase(self, channel, phase):
+        """ Asynchronous equivalent of `AFG2225.set_phase`
+        """
+        return await self._set_numeric(channel, "phase", phase)
+
+    async def set_output_onoff(self, channel, on_off):
+        """ Asynchronous equivalent of `AFG2225.set_output_onoff`
+        """
+        return await self._set_from_commands(
+            channel, "output_onoff", self.instrument._output_onoff_commands, on_off)
+
+    async def set_output_load(self, channel, load):
+        """ Asynchronous equivalent of `AFG2225.set_output_load`
+        """
+        return await self._set_from_commands(
+            channel, "output_load", self.instrument._output_load_commands, load)
+
+    async def set_voltageunits(self, channel, unit='VPP'):
+        """ Asynchronous equivalent of `AFG2225.set_voltageunits`
+        """
+        return await self._set_from_commands(
+            channel, "voltageunits", self.instrument._voltageunits_commands, unit)
+
+
+class AsyncScope(AsyncInstrument):
+    """ Asyncio wrapper for the Tektronix oscilloscopes
+    """
+    async def get_data(self, channel=1, data_width=1, data_units='volts'):
+        """ Retrieves the current data for the given channel
+
+        This is the asynchronous equivalent of `Scope.get_data`.  The curve
+        transfer, which can take minutes, runs in the executor and the pause
+        before reading the waveform preamble is taken with `asyncio.sleep`.
+
+        :param channel: An integer which is a valid channel number or the channel name
+        :param data_width: Sets the bit depth of the returned data (1=8 bit, 2=16bit)
+        :param data_units: 'volts' or 'bytes'
+        :type channel: int or str
+        :type data_width: int
+        :type data_units: str
+        :return: The times and data as numpy arrays
+        :rtype: np.ndarray, np.ndarray
+        """
+        data_raw = await self.run(self.instrument._request_curve, channel,
+                                  data_width)
+        await asyncio.sleep(2)
+        return await self.run(self.instrument._convert_curve, data_raw,
+                              data_units)
+
+
+_WRAPPERS = [(AFG2225, AsyncAFG2225),
+             (Scope, AsyncScope),
+             (VisaUsbInstrument, AsyncVisaUsbInstrument)]
+
+
+def wrap(instrument, executor=None):
+    """ Returns the most specific asyncio wrapper for a driver instance
+
+    :param instrument: The driver instance to wrap
+    :param executor: Passed to the wrapper's constructor
+    :return: The wrapped instrument
+    :rtype: AsyncInstrument
+    """
+    for driver_class, wrapper_class in _WRAPPERS:
+        if isinstance(instrument, driver_class):
+            return wrapper_class(instrument, executor=executor)
+    return AsyncInstrument(instrument, executor=executor)
@@ -0,0 +1,426 @@
+""" Benchmarks of the high-level driver methods
+
+This module runs the public high-level methods of the drivers against the
+simulated instruments of `labchat.simulator` (or against sessions recorded
+with `labchat.session`) and reports, for each operation:
+
+  - the number of writes and round trips made to the instrument
+  - the number of bytes written and read
+  - the time spent in `sleep` calls inside the drivers
+  - the CPU time and wall time of the call
+
+Results are saved as JSON so that they can be compared across versions::
+
+    python -m labchat.benchmark -o new.json
+    python -m labchat.benchmark -o new.json --compare old.json
+
+To benchmark against recorded sessions, first write one session per
+benchmark with `--record DIR` and then run with `--replay DIR`.  Note that
+the CPU time includes the time spent in the simulated instrument models.
+"""
+
+import argparse
+import importlib
+import json
+import logging
+import os
+import platform
+import shutil
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from labchat import simulator, session
+
+__email__ = "chrisark7@gmail.com"
+__status__ = "Development"
+
+logger = logging.getLogger(__name__)
+
+# Modules whose `sleep` calls are timed.  Patching `labchat.tracing` covers
+# the callers of `tracing.sleep` (e.g. the `Pacer` waits in `labchat.pacing`),
+# the others imported the function under their own name.
+DRIVER_MODULES = ('labchat.tracing', 'labchat.visausb', 'labchat.tekscope',
+                  'labchat.bkprecision', 'labchat.ncdrelay', 'labchat.edgetech',
+                  'labchat.gwinstek')
+
+
+###############################################################################
+# Measurement
+###############################################################################
+@contextmanager
+def count_sleeps(modules=DRIVER_MODULES):
+    """ Context manager which totals the time slept by the driver modules
+
+    The `sleep` function imported by each of the modules is temporarily
+    replaced with a version which still sleeps but also accumulates the
+    requested time.  The yielded dictionary holds the running total under
+    'sleep_time' and the number of calls under 'sleep_calls'.
+
+    :param modules: Names of the modules to instrument
+    :type modules: tuple of str
+    """
+    totals = {'sleep_time': 0.0, 'sleep_calls': 0}
+    originals = {}
+
+    def timed_sleep(seconds, _sleep=time.sleep):
+        totals['sleep_time'] += seconds
+        totals['sleep_calls'] += 1
+        _sleep(seconds)
+
+    for name in modules:
+        module = importlib.import_module(name)
+        if hasattr(module, 'sleep'):
+            originals[module] = module.sleep
+            module.sleep = timed_sleep
+    try:
+        yield totals
+    finally:
+        for module, original in originals.items():
+            module.sleep = original
+
+
+def measure(operation, device):
+    """ Runs `operation` once and measures its cost
+
+    :param operation: A callable taking no arguments
+    :param device: The transport whose `stats` are used to count traffic
+    :type operation: callable
+    :return: dictionary of measured values
+    :rtype: dict
+    """
+    before = dict(device.stats.as_dict())
+    with count_sleeps() as sleeps:
+        cpu0, wall0 = time.process_time(), time.perf_counter()
+        operation()
+        cpu1, wall1 = time.process_time(), time.perf_counter()
+    after = device.stats.as_dict()
+    result = {key: after[key] - before[key] for key in after}
+    result.update(sleeps)
+    result['cpu_time'] = cpu1 - cpu0
+    result['wall_time'] = wall1 - wall0
+    return result
+
+
+###############################################################################
+# Benchmark Definitions
+###############################################################################
+def _scope(backend):
+    from labchat.tekscope import Scope
+    rm = backend.resource_manager()
+    scope = Scope(device_id=backend.find('Scope'), resource_manager=rm)
+    scope.open()
+    return scope
+
+
+def _afg(backend):
+    from labchat.gwinstek import AFG2225
+    afg = AFG2225(device_id=backend.find('AFG2225'),
+                  resource_manager=backend.resource_manager())
+    afg.open()
+    return afg
+
+
+def _bk(backend):
+    from labchat.bkprecision import BKFunGen
+    bk = BKFunGen(device_id=backend.find('BKFunGen'),
+                  resource_manager=backend.resource_manager())
+    bk.open()
+    return bk
+
+
+def _relay(backend):
+    from labchat.ncdrelay import Relay
+    relay = Relay(backend.find('Relay'),
+                  resource_manager=backend.resource_manager())
+    relay.open()
+    return relay
+
+
+def _dewmaster(backend):
+    from labchat.edgetech import DewMaster
+    return DewMaster('COM1', device=backend.serial())
+
+
+def _log_data(dew):
+    directory = tempfile.mkdtemp()
+    try:
+        dew.log_data(os.path.join(directory, 'log'), interval=1, total=3)
+    finally:
+        shutil.rmtree(directory)
+
+
+def _autoscale(scope):
+    # Start zoomed in so that a few iterations are needed
+    scope.write('CH1:SCALE 0.1')
+    scope.write('CH1:POSITION 0')
+    return lambda: scope.autoscale_y(1)
+
+
+# Each benchmark is (name, instrument factory, operation factory) where the
+# operation factory takes the open instrument and returns the callable to
+# time, so that any preparation is excluded from the measurement.
+BENCHMARKS = [
+    ('Scope.get_data', _scope, lambda s: lambda: s.get_data(1)),
+    ('Scope.get_state', _scope, lambda s: lambda: s.get_state(1)),
+    ('Scope.autoscale_y', _scope, _autoscale),
+    ('Scope.measure', _scope, lambda s: lambda: s.measure(1, 'FREQUENCY')),
+    ('Scope.measure_many', _scope,
+     lambda s: lambda: s.measure_many(1, 'PWIDTH', 16)),
+    ('AFG2225.set_wave', _afg,
+     lambda a: lambda: a.set_wave(1, 'SQUARE', 1e4, 2.0, 0.1, duty=30,
+                                  phase=45)),
+    ('AFG2225.set_output', _afg,
+     lambda a: lambda: a.set_output(1, on_off='ON', load='HZ')),
+    ('AFG2225.get_frequency', _afg, lambda a: lambda: a.get_frequency(1)),
+    ('BKFunGen.set_wave', _bk,
+     lambda b: lambda: b.set_wave(1, 'SINE', 1e3, 2.0, 0.1)),
+    ('BKFunGen.get_wave', _bk, lambda b: lambda: b.get_wave(1)),
+    ('DewMaster.get_data_immediate', _dewmaster,
+     lambda d: d.get_data_immediate),
+    ('DewMaster.log_data', _dewmaster, lambda d: lambda: _log_data(d)),
+    ('Relay.turn_on', _relay, lambda r: r.turn_on),
+    ('Relay.get_state', _relay, lambda r: r.get_state),
+]
+
+
+###############################################################################
+# Backends
+###############################################################################
+class SimBackend(object):
+    """ Creates fresh simulated instruments for each benchmark
+    """
+    name = 'sim'
+
+    def __init__(self, latency=0, bandwidth=None, serial_bandwidth=960):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.serial_bandwidth = serial_bandwidth
+        self._rm = None
+
+    def start(self, benchmark):
+        self._rm = simulator.SimResourceManager(latency=self.latency,
+                                                bandwidth=self.bandwidth)
+
+    def resource_manager(self):
+        return self._rm
+
+    def find(self, model):
+        return self._rm.find(model)
+
+    def serial(self):
+        return simulator.SimSerial(latency=self.latency,
+                                   bandwidth=self.serial_bandwidth)
+
+    def stop(self):
+        self._rm = None
+
+
+class RecordBackend(SimBackend):
+    """ Records the simulated traffic of each benchmark to a session file
+    """
+    name = 'record'
+
+    def __init__(self, directory, **kwargs):
+        super(RecordBackend, self).__init__(**kwargs)
+        self.directory = directory
+        self._writer = None
+
+    def start(self, benchmark):
+        super(RecordBackend, self).start(benchmark)
+        filename = os.path.join(self.directory, benchmark + '.lcs')
+        self._recording = session.RecordingResourceManager(self._rm, filename)
+        self._writer = self._recording.writer
+
+    def resource_manager(self):
+        return self._recording
+
+    def serial(self):
+        port = super(RecordBackend, self).serial()
+        return session.RecordingSerial(port, self._writer, name='COM1')
+
+    def stop(self):
+        self._writer.close()
+        super(RecordBackend, self).stop()
+
+
+class ReplayBackend(object):
+    """ Replays the session file recorded for each benchmark
+    """
+    name = 'replay'
+
+    def __init__(self, directory, pacing='fast'):
+        self.directory = directory
+        self.pacing = pacing
+        self._rm = None
+        self._filename = None
+
+    def start(self, benchmark):
+        self._filename = os.path.join(self.directory, benchmark + '.lcs')
+        self._rm = session.ReplayResourceManager(self._filename,
+                                                 pacing=self.pacing)
+
+    def resource_manager(self):
+        return self._rm
+
+    def find(self, model):
+        sim_names = simulator.SimResourceManager()
+        name = sim_names.find(model)
+        if name not in self._rm.list_resources():
+            raise LookupError('{0} was not recorded in {1}'.format(
+                model, self._filename))
+        return name
+
+    def serial(self):
+        return session.ReplaySerial(self._rm.session, pacing=self.pacing)
+
+    def stop(self):
+        self._rm = None
+
+
+###############################################################################
+# Running and Reporting
+###############################################################################
+def run(backend=None, names=None):
+    """ Runs the benchmarks and returns the results
+
+    :param backend: A SimBackend, RecordBackend or ReplayBackend instance
+    :param names: Names of the benchmarks to run (all if None)
+    :type names: list of str
+    :return: results keyed by benchmark name
+    :rtype: dict
+    """
+    if backend is None:
+        backend = SimBackend()
+    results = {}
+    for name, factory, operation in BENCHMARKS:
+        if names and name not in names:
+            continue
+        logger.info('Running benchmark {0}'.format(name))
+        backend.start(name)
+        try:
+            instrument = factory(backend)
+            results[name] = measure(operation(instrument), instrument.device)
+        except Exception as e:
+            logger.error('Benchmark {0} failed: {1!r}'.format(name, e))
+        finally:
+            backend.stop()
+    return results
+
+
+def save(results, filename, backend=None):
+    """ Saves benchmark results to a JSON file with some run metadata
+
+    :param results: The output of `run`
+    :param filename: The path of the JSON file
+    :param backend: The backend the results were obtained with
+    :type results: dict
+    :type filename: str
+    """
+    out = {'created': datetime.now().isoformat(),
+           'python': platform.python_version(),
+           'platform': platform.platform(),
+           'backend': getattr(backend, 'name', None),
+           'latency': getattr(backend, 'latency', None),
+           'bandwidth': getattr(backend, 'bandwidth', None),
+           'results': results}
+    with open(filename, 'w') as f:
+        json.dump(out, f, indent=2, sort_keys=True)
+
+
+def compare(baseline, results, tolerance=0.1):
+    """ Compares results against a baseline
+
+    Returns a dictionary of benchmark name to a dictionary of the ratio
+    new/old for each measured quantity.  Ratios above 1 + `tolerance` for
+    the wall time, round trips or bytes transferred are logged as
+    regressions.
+
+    :param baseline: Baseline results or the filename of a saved run
+    :param results: New results or the filename of a saved run
+    :param tolerance: Fractional increase tolerated before warning
+    :type tolerance: float
+    :return: ratios keyed by benchmark name
+    :rtype: dict
+    """
+    def load(x):
+        if isinstance(x, str):
+            with open(x) as f:
+                x = json.load(f)
+        return x.get('results', x)
+    baseline, results = load(baseline), load(results)
+    ratios = {}
+    for name in sorted(set(baseline) & set(results)):
+        ratios[name] = {}
+        for key, new in results[name].items():
+            old = baseline[name].get(key)
+            if old is None:
+                continue
+            ratio = new / old if old else (1.0 if not new else float('inf'))
+            ratios[name][key] = ratio
+            if key in ('wall_time', 'round_trips', 'bytes_written',
+                       'bytes_read') and ratio > 1 + tolerance:
+                logger.warning('{0}: {1} regressed by a factor of '
+                               '{2:.2f}'.format(name, key, ratio))
+    return ratios
+
+
+def format_table(results):
+    """ Formats results as a text table
+    """
+    columns = ('round_trips', 'bytes_written', 'bytes_read', 'sleep_time',
+               'cpu_time', 'wall_time')
+    lines = ['{0:32s}'.format('benchmark') +
+             ''.join('{0:>14s}'.format(c) for c in columns)]
+    for name in sorted(results):
+        row = results[name]
+        lines.append('{0:32s}'.format(name) + ''.join(
+            '{0:>14.4g}'.format(row[c]) for c in columns))
+    return '\n'.join(lines)
+
+
+def main(args=None):
+    """ Command line entry point
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('-o', '--output', help='JSON file for the results')
+    parser.add_argument('-b', '--benchmark', action='append',
+                        help='benchmark to run (may be repeated)')
+    parser.add_argument('--latency', type=float, default=0,
+                        help='simulated per-command latency in seconds')
+    parser.add_argument('--bandwidth', type=float, default=None,
+                        help='simulated bandwidth in bytes per second')
+    parser.add_argument('--record', metavar='DIR',
+                        help='record a session per benchmark into DIR')
+    parser.add_argument('--replay', metavar='DIR',
+                        help='replay the sessions recorded in DIR')
+    parser.add_argument('--realtime', action='store_true',
+                        help='replay with the recorded timing')
+    parser.add_argument('--compare', metavar='JSON',
+                        help='baseline results to compare against')
+    args = parser.parse_args(args)
+    logging.basicConfig(level=logging.WARNING)
+    if args.replay:
+        backend = ReplayBackend(args.replay,
+                                pacing='realtime' if args.realtime else 'fast')
+    elif args.record:
+        if not os.path.isdir(args.record):
+            os.makedirs(args.record)
+        backend = RecordBackend(args.record, latency=args.latency,
+                                bandwidth=args.bandwidth)
+    else:
+        backend = SimBackend(latency=args.latency, bandwidth=args.bandwidth)
+    results = run(backend, names=args.benchmark)
+    print(format_table(results))
+    if args.output:
+        save(results, args.output, backend=backend)
+    if args.compare:
+        ratios = compare(args.compare, results)
+        print('\nRatio of wall time to baseline:')
+        for name in sorted(ratios):
+            print('{0:32s}{1:>10.3f}'.format(
+                name, ratios[name].get('wall_time', float('nan'))))
+
+
+if __name__ == '__main__':
+    main()
@@ -5,14 +5,91 @@ communication with the function generators.
 """
 
 import logging
-from time import sleep
+import re
+from collections import namedtuple
+from time import time
 import visa
+from labchat import tracing
+from labchat import waveform
+from labchat.pacing import Pacer
 
 __email__ = "chrisark7@gmail.com"
 __status__ = "Development"
 
 logger = logging.getLogger(__name__)
 
+# The basic wave settings of a channel; settings not reported are None
+BasicWave = namedtuple('BasicWave', ['wavetype', 'frequency', 'period', 'amplitude', 'offset',
+                                     'high_level', 'low_level', 'phase', 'symmetry', 'duty',
+                                     'variance', 'mean', 'delay'])
+BasicWave.__new__.__defaults__ = (None,) * len(BasicWave._fields)
+# The output settings of a channel
+OutputState = namedtuple('OutputState', ['on', 'load', 'polarity'])
+OutputState.__new__.__defaults__ = (None,) * len(OutputState._fields)
+
+# Reply fields of BASIC_WAVE? and the BasicWave attributes they fill
+_WAVE_FIELDS = {'WVTP': 'wavetype', 'FRQ': 'frequency', 'PERI': 'period', 'AMP': 'amplitude',
+                'OFST': 'offset', 'HLEV': 'high_level', 'LLEV': 'low_level', 'PHSE': 'phase',
+                'SYM': 'symmetry', 'DUTY': 'duty', 'VAR': 'variance', 'MEAN': 'mean',
+                'DLY': 'delay'}
+# Long and short headers of the queries which return records
+_HEADERS = {'BASIC_WAVE': 'BASIC_WAVE', 'BSWV': 'BASIC_WAVE',
+            'OUTPUT': 'OUTPUT', 'OUTP': 'OUTPUT'}
+# One reply, e.g. 'C1:BASIC_WAVE WVTP,SINE,FRQ,1000HZ'; several may share a line
+_REPLY = re.compile(r'C([12]):(\w+)\s+(.*?)\s*(?=;?\s*C[12]:|$)')
+# A number followed by an optional unit, e.g. '1000HZ' or '-2.5E-3V'
+_NUMBER = re.compile(r'([-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)\s*[A-Za-z%]*$')
+
+
+def _parse_number(text):
+    match = _NUMBER.match(text.strip())
+    if match is None:
+        raise ValueError('unable to interpret {0!r} as a number'.format(text))
+    return float(match.group(1))
+
+
+def _parse_wave(text):
+    fields = [f.strip() for f in text.split(',')]
+    values = {}
+    for key, value in zip(fields[::2], fields[1::2]):
+        name = _WAVE_FIELDS.get(key.upper())
+        if name == 'wavetype':
+            values[name] = value.upper()
+        elif name is not None:
+            values[name] = _parse_number(value)
+    return BasicWave(**values)
+
+
+def _parse_output(text):
+    fields = [f.strip().upper() for f in text.split(',')]
+    options = dict(zip(fields[1::2], fields[2::2]))
+    load = options.get('LOAD')
+    if load is not None and load != 'HZ':
+        load = int(_parse_number(load))
+    return OutputState(on=fields[0] == 'ON', load=load, polarity=options.get('PLRT'))
+
+
+def parse_replies(reply):
+    """ Parses the replies to BASIC_WAVE? and OUTPUT? queries
+
+    The reply may contain the answers to several queries, with long or short
+    headers, e.g. ``'C1:BSWV WVTP,SINE,FRQ,1000HZ;C2:OUTP OFF,LOAD,HZ'``.
+
+    :param reply: The reply read from the function generator
+    :type reply: str
+    :return: dictionary of {(channel, 'BASIC_WAVE' or 'OUTPUT'): BasicWave or OutputState}
+    :rtype: dict
+    """
+    out = {}
+    for match in _REPLY.finditer(reply.strip()):
+        channel, header, text = int(match.group(1)), match.group(2).upper(), match.group(3)
+        name = _HEADERS.get(header)
+        if name == 'BASIC_WAVE':
+            out[(channel, name)] = _parse_wave(text)
+        elif name == 'OUTPUT':
+            out[(channel, name)] = _parse_output(text)
+    return out
+
 
 class BKFunGen(object):
     """ A class for communicating with the BK Precision function generators
@@ -23,7 +100,12 @@ class BKFunGen(object):
     Commands for the function generator can be found in the 'programmer's manual' for the specific
     model.
     """
-    def __init__(self, device_id=0, timeout=0.5):
+    # Length and code range of the user-defined arbitrary waveforms
+    _ARB_LENGTH = 16384
+    _ARB_FULL_SCALE = 32767
+
+    def __init__(self, device_id=0, timeout=0.5, resource_manager=None, min_gap=0.1,
+                 shadow_ttl=0):
         """ The constructor for the BKFuncGen class
 
         This function searches the devices connected to the computer and initializes the Scope
@@ -32,15 +114,39 @@ class BKFunGen(object):
 
         The list of devices connected to the computer will be printed to the log.
 
+        The `resource_manager` argument can be used to supply an object other than
+        `visa.ResourceManager()` to find and open the device, such as the `SimResourceManager` in
+        the `labchat.simulator` module.
+
+        The function generator misses commands which follow the previous
+        transfer too closely, so consecutive transfers are spaced by at least
+        `min_gap` seconds (see `labchat.pacing.Pacer`).  The gap can be
+        measured for a particular unit with `calibrate_pacing`.
+
+        The records returned by `get_wave` and `get_output` are kept, and
+        updated by `set_wave` and `set_output`.  `shadow_ttl` sets how long a
+        kept record may be returned instead of querying the function
+        generator: 0 (the default) always queries, and `float('inf')` keeps
+        records until they are invalidated.
+
         :param device_id: Integer or string which describes the device to connect to
         :param timeout: The default timeout value to use when interacting with the scope in seconds
+        :param resource_manager: The resource manager used to open the device
+        :param min_gap: The minimum time between transfers in seconds
+        :param shadow_ttl: The maximum age in seconds of records returned without a query
         :type device_id: int or str
         :type timeout: int or float
+        :type resource_manager: visa.ResourceManager
+        :type min_gap: float
+        :type shadow_ttl: float
         :return: An instance of the BKFuncGen class
         :rtype: BKFunGen
         """
         # Get list of devices connected to the computer
-        rm = visa.ResourceManager()
+        if resource_manager is None:
+            rm = visa.ResourceManager()
+        else:
+            rm = resource_manager
         devices = rm.list_resources()
         # Check device list
         if not devices:
@@ -76,6 +182,10 @@ class BKFunGen(object):
         self.resource_manager = rm
         self.is_open = False
         self.device = None
+        self.pacer = Pacer(min_gap)
+        self.shadow_ttl = shadow_ttl
+        self._shadow = {}
+        self._arb_uploaded = {}
 
     ###############################################################################################
     # Low level commands
@@ -111,6 +221,7 @@ class BKFunGen(object):
         self.device.flush(mask=64)
         self.device.flush(mask=128)
 
+    @tracing.traced('write')
     def write(self, command):
         """ Writes a command to the function generator
 
@@ -121,35 +232,57 @@ class BKFunGen(object):
         """
         if not self.is_open:
             raise IOError('Communication to function generator is closed')
+        self.pacer.wait()
         try:
-            sleep(0.1)
             out = self.device.write(command)
         except visa.VisaIOError:
             raise ValueError('Command timed out; most likely it is not a valid command')
+        finally:
+            self.pacer.mark()
+        return out
+
+    @tracing.traced('write')
+    def write_raw(self, message):
+        """ Writes raw bytes, such as a command with binary data, to the function generator
+
+        No termination is added to the message.
+
+        :param message: The bytes to send
+        :type message: bytes
+        :return: the output of the write command
+        :rtype: int
+        """
+        if not self.is_open:
+            raise IOError('Communication to function generator is closed')
+        self.pacer.wait()
+        try:
+            out = self.device.write_raw(message)
+        except visa.VisaIOError:
+            raise ValueError('Write timed out; most likely it is not a valid command')
+        finally:
+            self.pacer.mark()
         return out
 
+    @tracing.traced('read')
     def read(self):
         """ Reads the most recent output from the function generator
 
-        :param timeout: The timeout length in seconds
-        :type timeout: float
+        The read returns as soon as the terminator arrives and waits for it
+        for up to 0.5 seconds longer than the timeout.
+
         :return: The output of the read command
         :rtype: str
         """
+        read_grace = 0.5
         if not self.is_open:
             raise IOError('Communication to function generator is closed')
-        try:
-            out = self.device.read()
-        except visa.VisaIOError:
-            logger.debug('Device did not return anything, sleeping for 0.5 seconds and trying again')
-            sleep(0.5)
-            try:
-                out = self.device.read()
-            except visa.VisaIOError:
-                out = ''
-                logger.warn('Device did not return anything when trying to read')
+        out = self.pacer.read(self.device, self.timeout*1e-3 + read_grace)
+        if out is None:
+            out = ''
+            logger.warning('Device did not return anything when trying to read')
         return out.rstrip()
 
+    @tracing.traced('query')
     def query(self, command):
         """ Queries a value from the function generator
 
@@ -165,6 +298,85 @@ class BKFunGen(object):
         out = self.read()
         return out
 
+    def calibrate_pacing(self, trials=3, margin=1.5):
+        """ Measures the shortest reliable gap between transfers and uses it
+
+        The probe switches the header format and queries the identification
+        string back to back; see `labchat.pacing.Pacer.calibrate`.
+
+        :param trials: The number of probes at each gap
+        :param margin: The factor applied to the gap found
+        :type trials: int
+        :type margin: float
+        :return: The new minimum gap in seconds
+        :rtype: float
+        """
+        def probe():
+            self.write('COMM_HEADER LONG')
+            if self.query('*IDN?'):
+                return True
+            self.flush()
+            return False
+        return self.pacer.calibrate(probe, trials=trials, margin=margin)
+
+    ###############################################################################################
+    #  Shadow State
+    ###############################################################################################
+    def _query_records(self, keys):
+        """ Returns the records for (channel, header) keys, querying only the stale ones
+
+        All of the stale records are fetched with one compound query.  If the reply does not
+        contain all of them, the missing records are queried one at a time.
+
+        :param keys: list of (channel, 'BASIC_WAVE' or 'OUTPUT')
+        :type keys: list of tuple
+        :return: dictionary of {key: BasicWave or OutputState}
+        :rtype: dict
+        """
+        now = time()
+        out = {}
+        stale = []
+        for key in keys:
+            record = self._shadow.get(key)
+            if record is not None and now - record[1] < self.shadow_ttl:
+                out[key] = record[0]
+            else:
+                stale.append(key)
+        if stale:
+            command = ';'.join('C{0:0.0f}:{1}?'.format(*key) for key in stale)
+            replies = parse_replies(self.query(command))
+            for key in stale:
+                if key not in replies:
+                    logger.debug('No reply to {0}; querying it separately'.format(key))
+                    replies.update(parse_replies(self.query('C{0:0.0f}:{1}?'.format(*key))))
+            now = time()
+            for key in stale:
+                if key not in replies:
+                    raise IOError('Unable to read C{0}:{1} from the function generator'.format(*key))
+                self._shadow[key] = (replies[key], now)
+                out[key] = replies[key]
+        return out
+
+    def _update_shadow(self, key, **values):
+        """ Applies the values just set to the record kept for `key`, if there is one
+        """
+        record = self._shadow.get(key)
+        if record is not None:
+            self._shadow[key] = (record[0]._replace(**values), time())
+
+    def invalidate(self, channel=None):
+        """ Discards the kept records so that the next get queries the function generator
+
+        Call this when the function generator may have been changed behind the driver's back,
+        e.g. from the front panel.
+
+        :param channel: The channel to invalidate; None for both
+        :type channel: int
+        """
+        for key in list(self._shadow):
+            if channel is None or key[0] == channel:
+                del self._shadow[key]
+
     ###############################################################################################
     #  Composite Commands
     ###############################################################################################
@@ -209,24 +421,38 @@ class BKFunGen(object):
         # Send command
         logger.debug('Command: {0}'.format(command))
         self.write(command)
+        values = {}
+        if on_off is not None:
+            values['on'] = on_off.upper() == 'ON'
+        if load is not None:
+            values['load'] = 'HZ' if str(load).upper() == 'HZ' else int(load)
+        self._update_shadow((channel, 'OUTPUT'), **values)
 
     def get_output(self, channel=1):
-        """ Returns the output settings of the function generator as a string.
+        """ Returns the output settings of the function generator
 
-        This method simply queries the function generator with the ``'C1:OUTPUT?'`` command (or
-        'C2' for channel 2) and returns the resulting string.
+        The function generator is queried with the ``'C1:OUTPUT?'`` command (or 'C2' for channel
+        2) unless a record younger than `shadow_ttl` is kept.
 
-        :return: Output settings as string
-        :rtype: str
+        :param channel: 1 or 2
+        :type channel: int
+        :return: The output settings
+        :rtype: OutputState
         """
         # Type checking
         if channel not in [1, 2]:
             raise ValueError('channel paramter should be 1 or 2')
-        # Build command
-        command = 'C{0:0.0f}:OUTPUT?'.format(channel)
-        # Query and return
-        out = self.query(command)
-        return out
+        key = (channel, 'OUTPUT')
+        return self._query_records([key])[key]
+
+    def get_outputs(self):
+        """ Returns the output settings of both channels with one query
+
+        :return: dictionary of {channel: OutputState}
+        :rtype: dict
+        """
+        records = self._query_records([(1, 'OUTPUT'), (2, 'OUTPUT')])
+        return {channel: record for (channel, name), record in records.items()}
 
     def set_wave(self, channel=1, wavetype=None, frequency=None, amplitude=None, offset=None,
                  symmetry=None, duty=None, phase=None, variance=None, mean=None, delay=None):
@@ -285,24 +511,113 @@ class BKFunGen(object):
         # Send command
         logger.debug('Command: {0}'.format(command))
         self.write(command)
+        key = (channel, 'BASIC_WAVE')
+        if wavetype is not None:
+            # The function generator may adjust the other settings to suit the new wavetype
+            self._shadow.pop(key, None)
+        elif key in self._shadow:
+            values = {_WAVE_FIELDS[name]: float(value) for name, value in command_dict.items()
+                      if value is not None}
+            record = self._shadow[key][0]._replace(**values)
+            if frequency is not None:
+                values['period'] = 1 / record.frequency
+            if record.amplitude is not None and record.offset is not None:
+                values['high_level'] = record.offset + record.amplitude / 2
+                values['low_level'] = record.offset - record.amplitude / 2
+            self._update_shadow(key, **values)
 
     def get_wave(self, channel=1):
-        """ Returns the basic wave settings of the function generator as a string.
+        """ Returns the basic wave settings of the function generator
 
-        This method simply queries the function generator with the ``'C1:BASIC_WAVE?'`` command (or
-        'C2' for channel 2) and returns the resulting string.
+        The function generator is queried with the ``'C1:BASIC_WAVE?'`` command (or 'C2' for
+        channel 2) unless a record younger than `shadow_ttl` is kept.  Settings which the
+        function generator does not report for the current wavetype are None.
 
-        :return: Output settings as string
-        :rtype: str
+        :param channel: 1 or 2
+        :type channel: int
+        :return: The basic wave settings
+        :rtype: BasicWave
         """
         # Type checking
         if channel not in [1, 2]:
             raise ValueError('channel paramter should be 1 or 2')
-        # Build command
-        command = 'C{0:0.0f}:BASIC_WAVE?'.format(channel)
-        # Query and return
-        out = self.query(command)
-        return out
+        key = (channel, 'BASIC_WAVE')
+        return self._query_records([key])[key]
 
+    def get_waves(self):
+        """ Returns the basic wave settings of both channels with one query
 
+        :return: dictionary of {channel: BasicWave}
+        :rtype: dict
+        """
+        records = self._query_records([(1, 'BASIC_WAVE'), (2, 'BASIC_WAVE')])
+        return {channel: record for (channel, name), record in records.items()}
+
+    def upload_arb(self, data, name=None, channel=1, scale=True):
+        """ Stores waveform data as a named user-defined arbitrary waveform
+
+        The data is quantized to signed 16-bit codes with `waveform.quantize` and
+        sent as binary data with the ``WVDT`` command.  If no name is given, one
+        is derived from the content hash of the codes.  The driver remembers
+        what it has stored under each name, so uploading identical data under
+        the same name again does nothing.
+
+        :param data: The waveform samples, 2 to 16384 of them
+        :param name: The name under which to store the waveform
+        :param channel: The channel used to issue the upload (1 or 2)
+        :param scale: Whether to scale the data to the full DAC range; if False it should be between -1 and 1
+        :type data: np.ndarray
+        :type name: str
+        :type channel: int
+        :type scale: bool
+        :return: The name of the waveform
+        :rtype: str
+        """
+        if channel not in [1, 2]:
+            raise ValueError('channel parameter should be 1 or 2')
+        codes = waveform.quantize(data, self._ARB_FULL_SCALE, '<i2',
+                                  max_length=self._ARB_LENGTH, scale=scale)
+        key = waveform.digest(codes)
+        if name is None:
+            name = 'LC' + key[:8].upper()
+        elif not name.isalnum():
+            raise ValueError('name parameter should only contain letters and digits')
+        if self._arb_uploaded.get(name) == key:
+            logger.debug('Waveform {0} is already stored'.format(name))
+            return name
+        command = 'C{0:0.0f}:WVDT WVNM,{1},WAVEDATA,'.format(channel, name)
+        # The samples run to the end of the message, so no termination is sent
+        self.write_raw(command.encode('ascii') + codes.tobytes())
+        self._arb_uploaded[name] = key
+        return name
+
+    def set_arb(self, channel=1, data=None, name=None, scale=True):
+        """ Outputs an arbitrary waveform on the channel
+
+        The waveform is stored with `upload_arb` (unless it is already stored
+        under the same name) and selected with the ``ARWV`` command, which
+        switches the channel to the ARB wavetype.  If `data` is None, the
+        waveform previously stored under `name` is selected.
 
+        :param channel: 1 or 2
+        :param data: The waveform samples, 2 to 16384 of them
+        :param name: The name under which to store or find the waveform
+        :param scale: Whether to scale the data to the full DAC range; if False it should be between -1 and 1
+        :type channel: int
+        :type data: np.ndarray
+        :type name: str
+        :type scale: bool
+        :return: The name of the waveform
+        :rtype: str
+        """
+        if channel not in [1, 2]:
+            raise ValueError('channel parameter should be 1 or 2')
+        if data is not None:
+            name = self.upload_arb(data, name=name, channel=channel, scale=scale)
+        elif name is None:
+            raise ValueError('No waveform was specified.  Nothing to set')
+        command = 'C{0:0.0f}:ARWV NAME,{1}'.format(channel, name)
+        logger.debug('Command: {0}'.format(command))
+        self.write(command)
+        self._shadow.pop((channel, 'BASIC_WAVE'), None)
+        return name
@@ -14,25 +14,826 @@ then be sent with the second and third (or more) letters and the endline charact
 import warnings
 import re
 import os
-from datetime import datetime
-from time import time, sleep
-import copy
+import queue
+import threading
+from collections import Counter, namedtuple
+from datetime import datetime, timedelta
+from time import time
 import serial
 import numpy as np
+from labchat import tracing
+from labchat.tracing import sleep
 
 __email__ = "chrisark7@gmail.com"
 __status__ = "Development"
 
+# A line received by a `LineReader`: the receive time in seconds since the epoch, the text of the
+# line and, for data lines, its `RECORD_DTYPE` record and the data point in the format returned by
+# `DewMaster._parse_data`, which keeps the measurement names and status as sent (None for other
+# lines)
+Record = namedtuple('Record', ['received', 'line', 'data', 'point'])
 
+# A whole data line: the optional time stamp (6 groups), up to three measurement fields (2 groups
+# each, the first required) with optional units (e.g. 'C', '%', '%RH' or 'ppmv'), and the status
+_FIELD = (r"[ \t]*([A-Z]+)[ \t]+=[ \t]+([-\d.]+)"
+          r"(?:[ \t]+(?:[CF]|%\S*|[a-z]\S*)(?=[ \t]|\r?$))?")
+_DATA_LINE = re.compile(r"^[ \t]*(?:(\d\d)/(\d\d)/(\d\d)[ \t]+(\d\d):(\d\d):(\d\d))?" +
+                        _FIELD + "(?:{0})?(?:{0})?".format(_FIELD) +
+                        r"[ \t]*([A-Z]+(?: [A-Z]+)*)?[ \t]*\r?$", re.MULTILINE)
+# Any line with a measurement field, and any line which is not blank
+_FIELD_LINE = re.compile(r"^.*[A-Z][ \t]+=[ \t]+.*$", re.MULTILINE)
+_NONBLANK_LINE = re.compile(r"^.*\S.*$", re.MULTILINE)
+
+# The measurement types and states stored in the logs as their index in these tuples; anything
+# else is stored as 0
+MEASUREMENT_TYPES = ('UNKNOWN', 'DP', 'FP', 'RH', 'TA', 'PPM')
+STATUSES = ('UNKNOWN', 'SERVOLOCK', 'HOLD')
+
+# One data point of a log: the time stamp in nanoseconds since the epoch, the three measurement
+# values, their type codes and the status code
+RECORD_DTYPE = np.dtype([('time', '<i8'), ('values', '<f8', (3,)), ('types', 'u1', (3,)),
+                         ('status', 'u1')])
+
+
+###################################################################################################
+# Background Reading
+###################################################################################################
+class LineAssembler:
+    """ Assembles terminated lines from the chunks of bytes read from a serial port
+
+    Bytes are fed in as they arrive, and only complete lines are returned; a partial line is held
+    until the rest of it arrives.  Each byte is scanned for the terminator only once no matter how
+    the stream is split into chunks.
+    """
+    def __init__(self, terminator=b'\r\n'):
+        """ The constructor for the LineAssembler class
+
+        :param terminator: The line terminator
+        :type terminator: bytes
+        """
+        self.terminator = terminator
+        self._buffer = bytearray()
+        self._scanned = 0
+
+    def feed(self, data):
+        """ Adds bytes to the buffer and returns the lines which are now complete
+
+        :param data: The bytes read from the port
+        :type data: bytes
+        :return: The complete lines without their terminators
+        :rtype: list of bytes
+        """
+        self._buffer += data
+        lines = []
+        start = 0
+        # A terminator may straddle the end of the bytes already scanned
+        search = max(self._scanned - len(self.terminator) + 1, 0)
+        while True:
+            end = self._buffer.find(self.terminator, search)
+            if end < 0:
+                break
+            lines.append(bytes(self._buffer[start:end]))
+            start = search = end + len(self.terminator)
+        del self._buffer[:start]
+        self._scanned = len(self._buffer)
+        return lines
+
+    @property
+    def partial(self):
+        """ The bytes of the line which has not been completed yet
+        """
+        return bytes(self._buffer)
+
+    def reset(self):
+        """ Discards the partial line
+        """
+        self._buffer.clear()
+        self._scanned = 0
+
+
+class LineReader:
+    """ Drains a serial port on a background thread and queues the lines it receives
+
+    The thread reads whatever the port has waiting (or blocks for up to the port timeout for the
+    next byte), assembles complete lines with a `LineAssembler` and puts each line on `records` as
+    a `Record` stamped with the time at which its terminator was received.  Data lines are parsed
+    with `parser`, whose `counts` keep track of the lines which were skipped, had no time stamp or
+    were not locked.  The queue holds at most `maxsize` records; when it is full the oldest record
+    is discarded and counted in `dropped`.
+
+    Nothing else may read from the port while the reader is running.
+    """
+    def __init__(self, device, parser=None, maxsize=10000, name='labchat-dewmaster-reader'):
+        """ The constructor for the LineReader class
+
+        :param device: The serial port to read from
+        :param parser: The parser for the data lines (a new one by default)
+        :param maxsize: The maximum number of records to hold, or 0 for no limit
+        :param name: The name of the reader thread
+        :type device: serial.Serial
+        :type parser: RecordParser
+        :type maxsize: int
+        :type name: str
+        """
+        self.device = device
+        self.parser = RecordParser() if parser is None else parser
+        self.name = name
+        self.records = queue.Queue(maxsize)
+        self.assembler = LineAssembler()
+        self.dropped = 0
+        self.last_received = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        """ True while the reader thread is alive
+        """
+        return self._thread is not None and self._thread.is_alive()
+
+    @property
+    def counts(self):
+        """ The counts of the parser (see `RecordParser`)
+        """
+        return self.parser.counts
+
+    def start(self):
+        """ Starts the reader thread
+        """
+        if self.running:
+            raise RuntimeError('the reader is already running')
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """ Stops the reader thread
+
+        The thread notices the request after its current read, i.e. within the port timeout.
+
+        :param timeout: The longest time in seconds to wait for the thread to finish
+        :type timeout: float
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                chunk = self.device.read(max(self.device.inWaiting(), 1))
+            except (serial.SerialException, OSError) as e:
+                warnings.warn('Reading from the DewMaster failed: {0}'.format(e))
+                break
+            if not chunk:
+                continue
+            received = self.last_received = time()
+            for line in self.assembler.feed(chunk):
+                self._push(line, received)
+
+    def _push(self, line, received):
+        """ Parses a line and puts its record on the queue
+        """
+        text = line.decode(encoding='utf-8', errors='replace').strip()
+        records, points = self.parser.parse_points(text, received)
+        if len(records):
+            record = Record(received, text, records[0], points[0])
+        else:
+            record = Record(received, text, None, None)
+        while True:
+            try:
+                self.records.put_nowait(record)
+                return
+            except queue.Full:
+                try:
+                    self.records.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+    def get(self, timeout=None, data_only=False):
+        """ Returns the next record, waiting for it until a deadline
+
+        :param timeout: The longest time in seconds to wait, or None to wait forever
+        :param data_only: If True, then records of lines which are not data are skipped
+        :type timeout: float
+        :type data_only: bool
+        :return: The next record, or None if none arrived in time
+        :rtype: Record
+        """
+        t_stop = None if timeout is None else time() + timeout
+        while True:
+            remaining = None if t_stop is None else max(t_stop - time(), 0)
+            try:
+                record = self.records.get(timeout=remaining)
+            except queue.Empty:
+                return None
+            if not data_only or record.data is not None:
+                return record
+
+    def drain(self):
+        """ Removes and returns all of the records which are waiting
+
+        :return: The waiting records in the order they were received
+        :rtype: list of Record
+        """
+        out = []
+        while True:
+            try:
+                out.append(self.records.get_nowait())
+            except queue.Empty:
+                return out
+
+
+###################################################################################################
+# Parsing
+###################################################################################################
+class RecordParser:
+    """ Parses DewMaster data lines straight into log records
+
+    `parse` takes one line or a whole block of text (e.g. the contents of a raw capture) and finds
+    every data line with a single scan of a precompiled pattern; `parse_csv` does the same for the
+    rows of the csv files written by `DewMaster.log_data`, and `parse_points` also returns the data
+    points with their measurement names and status as sent.  The time stamps, values, type
+    codes and status codes of all the lines are then converted together with array operations.
+    Rather than issuing a warning per line, the parser counts the notable lines in `counts`:
+      - 'records': data lines parsed
+      - 'skipped': lines with a measurement field (or csv rows) which are not valid
+      - 'no_timestamp': data lines without a time stamp, which are given the receive time
+      - 'not_locked': points whose status is not SERVOLOCK
+      - 'unknown_type' and 'unknown_status': fields stored with code 0
+    """
+    def __init__(self):
+        """ The constructor for the RecordParser class
+        """
+        self.counts = Counter()
+        self._offsets = {}
+        self._csv_rows = {}
+
+    def _utc_offsets(self, naive):
+        """ Returns the offset of local time from UTC in seconds at each naive local time
+
+        The offset is looked up once per hour of data, so that the time stamps are converted as
+        `datetime.timestamp` would convert them, including daylight saving time.
+
+        :param naive: Local times as seconds since 1970-01-01 00:00
+        :type naive: np.ndarray of int
+        :return: The offsets in seconds
+        :rtype: np.ndarray of int
+        """
+        hours, index = np.unique(naive // 3600, return_inverse=True)
+        offsets = np.empty(len(hours), dtype=np.int64)
+        for i, hour in enumerate(hours.tolist()):
+            if hour not in self._offsets:
+                local = datetime(1970, 1, 1) + timedelta(hours=hour)
+                self._offsets[hour] = int(round(hour * 3600 - local.timestamp()))
+            offsets[i] = self._offsets[hour]
+        return offsets[index.reshape(-1)]
+
+    def _codes(self, names, table, counter):
+        """ Converts an array of names to their indices in `table`, counting unknown names
+        """
+        unique, index = np.unique(names, return_inverse=True)
+        lookup = np.array([table.index(u) if u in table else 0 for u in unique], dtype=np.uint8)
+        unknown = np.array([u != '' and u not in table for u in unique])
+        self.counts[counter] += int(np.count_nonzero(unknown[index]))
+        return lookup[index.reshape(-1)]
+
+    def parse(self, text, received=None):
+        """ Parses every data line in `text`
+
+        :param text: One line or a block of lines
+        :param received: The time in seconds since the epoch given to lines without a time stamp (now by default)
+        :type text: str or bytes
+        :type received: float
+        :return: The records of the data lines in the order they appear
+        :rtype: np.ndarray of RECORD_DTYPE
+        """
+        return self._parse(text, received)[0]
+
+    def parse_points(self, text, received=None):
+        """ Parses every data line in `text` into records and data points
+
+        The data points are in the format returned by `DewMaster._parse_data` and keep the
+        measurement names and the status as they were sent, including those which have no code in
+        `MEASUREMENT_TYPES` or `STATUSES`.
+
+        :param text: One line or a block of lines
+        :param received: The time in seconds since the epoch given to lines without a time stamp (now by default)
+        :type text: str or bytes
+        :type received: float
+        :return: The records and the data points of the data lines in the order they appear
+        :rtype: (np.ndarray of RECORD_DTYPE, list of tuple)
+        """
+        records, columns = self._parse(text, received)
+        points = []
+        for record, row in zip(records, columns.tolist()):
+            measurements = [name for name in row[6:12:2] if name]
+            points.append((datetime.fromtimestamp(int(record['time']) / 1e9), measurements,
+                           record['values'][:len(measurements)].tolist(), row[12] or 'UNKNOWN'))
+        return records, points
+
+    def _parse(self, text, received):
+        """ Parses every data line in `text`, returning the records and the matched columns
+        """
+        if isinstance(text, (bytes, bytearray)):
+            text = text.decode(encoding='latin_1')
+        rows = _DATA_LINE.findall(text)
+        self.counts['skipped'] += len(_FIELD_LINE.findall(text)) - len(rows)
+        records = np.zeros(len(rows), dtype=RECORD_DTYPE)
+        if not rows:
+            return records, np.zeros((0, 13), dtype=str)
+        columns = np.array(rows, dtype=str)
+        # Time stamps; strptime's %y puts 00-68 in the 2000s
+        stamped = columns[:, 0] != ''
+        fields = np.where(stamped[:, None], columns[:, :6], '0').astype(np.int64)
+        fields[:, 2] += np.where(fields[:, 2] < 69, 2000, 1900)
+        seconds = self._seconds(fields)
+        if not stamped.all():
+            self.counts['no_timestamp'] += int(np.count_nonzero(~stamped))
+            seconds[~stamped] = int(time() if received is None else received)
+        records['time'] = seconds * 10**9
+        # Measurements
+        for j in range(3):
+            names = columns[:, 6 + 2 * j]
+            records['types'][:, j] = self._codes(names, MEASUREMENT_TYPES, 'unknown_type')
+            records['values'][:, j] = self._values(columns[:, 7 + 2 * j], names != '')
+        return self._finish(records, columns[:, 12]), columns
+
+    def parse_csv(self, text, measurements):
+        """ Parses the data rows of a csv file written by `DewMaster.log_data`
+
+        :param text: One row or a block of rows, without the header
+        :param measurements: The measurement names from the header of the file
+        :type text: str or bytes
+        :type measurements: list of str
+        :return: The records of the rows in the order they appear
+        :rtype: np.ndarray of RECORD_DTYPE
+        """
+        if isinstance(text, (bytes, bytearray)):
+            text = text.decode(encoding='latin_1')
+        n = len(measurements)
+        if n not in self._csv_rows:
+            self._csv_rows[n] = re.compile(
+                r"^[ \t]*(\d\d)/(\d\d)/(\d{4})[ \t]+(\d\d):(\d\d):(\d\d)[ \t]*" +
+                r",[ \t]*([^,\r\n]*?)[ \t]*" * (n + 1) + r"\r?$", re.MULTILINE)
+        rows = self._csv_rows[n].findall(text)
+        self.counts['skipped'] += len(_NONBLANK_LINE.findall(text)) - len(rows)
+        records = np.zeros(len(rows), dtype=RECORD_DTYPE)
+        if not rows:
+            return records
+        columns = np.array(rows, dtype=str)
+        records['time'] = self._seconds(columns[:, :6].astype(np.int64)) * 10**9
+        for j, name in enumerate(measurements[:3]):
+            if name in MEASUREMENT_TYPES:
+                records['types'][:, j] = MEASUREMENT_TYPES.index(name)
+            else:
+                self.counts['unknown_type'] += len(records)
+            records['values'][:, j] = self._values(columns[:, 6 + j], True)
+        return self._finish(records, columns[:, -1])
+
+    def _seconds(self, fields):
+        """ Converts local date and time fields to seconds since the epoch
+
+        :param fields: N x 6 array of month, day, four digit year, hour, minute and second
+        :type fields: np.ndarray of int
+        :return: The times in seconds since the epoch
+        :rtype: np.ndarray of int
+        """
+        month, day, year, hour, minute, second = fields.T
+        days = ((year - 1970).astype('datetime64[Y]') + (month - 1).astype('timedelta64[M]')
+                ).astype('datetime64[D]').astype(np.int64) + day - 1
+        naive = days * 86400 + hour * 3600 + minute * 60 + second
+        return naive - self._utc_offsets(naive)
+
+    @staticmethod
+    def _values(values, present):
+        """ Converts a column of numbers to floats, with NaN where the field is not present
+        """
+        try:
+            return np.where(present, values, 'nan').astype(float)
+        except ValueError:
+            # A malformed number such as '-' or '1.2.3'
+            present = np.broadcast_to(present, values.shape)
+            return [_to_float(v) if p else np.nan for v, p in zip(values.tolist(),
+                                                                   present.tolist())]
+
+    def _finish(self, records, statuses):
+        """ Sets the status codes of the records and updates the counts
+        """
+        records['status'] = self._codes(statuses, STATUSES, 'unknown_status')
+        self.counts['not_locked'] += int(np.count_nonzero(records['status'] != 1))
+        self.counts['records'] += len(records)
+        return records
+
+
+def _to_float(text):
+    """ Converts text to a float, returning NaN if it is not a number
+    """
+    try:
+        return float(text)
+    except ValueError:
+        return np.nan
+
+
+###################################################################################################
+# Log Storage
+###################################################################################################
+def encode_records(data):
+    """ Converts parsed data points to an array of log records
+
+    :param data: Data points in the format returned by `DewMaster._parse_data`
+    :type data: list of tuple
+    :return: The records
+    :rtype: np.ndarray of RECORD_DTYPE
+    """
+    records = np.zeros(len(data), dtype=RECORD_DTYPE)
+    records['values'] = np.nan
+    for i, (dt, measurements, values, status) in enumerate(data):
+        records['time'][i] = int(round(dt.timestamp() * 1e6)) * 1000
+        n = min(len(values), 3)
+        records['values'][i, :n] = values[:n]
+        records['types'][i, :n] = [MEASUREMENT_TYPES.index(m) if m in MEASUREMENT_TYPES else 0
+                                   for m in measurements[:n]]
+        records['status'][i] = STATUSES.index(status) if status in STATUSES else 0
+    return records
+
+
+def _csv_lines(points):
+    """ Formats data points as the data rows of the csv files written by `DewMaster.log_data`
+    """
+    lines = []
+    for dt, _, values, status in points:
+        lines.append(dt.strftime('%m/%d/%Y %H:%M:%S') + ', ' +
+                     ''.join('{0:g}, '.format(v) for v in values) + status + '\n')
+    return ''.join(lines)
+
+
+def upgrade_log(filename, new_filename=None):
+    """ Converts a log written by older versions of `DewMaster.log_data` to the record format
+
+    Older logs are object arrays of (datetime, list of str, list of float, str) rows, which can
+    only be loaded with pickle.  The upgraded log is an array of `RECORD_DTYPE` records.  If
+    `new_filename` is None, then the upgraded log replaces the original, which is kept with the
+    extension '.old.npy'.
+
+    :param filename: The path of the old log
+    :param new_filename: The path of the upgraded log
+    :type filename: str
+    :type new_filename: str
+    :return: The path of the upgraded log
+    :rtype: str
+    """
+    old = np.load(filename, allow_pickle=True)
+    if old.dtype == RECORD_DTYPE:
+        warnings.warn('{0} is already in the record format'.format(filename))
+        return filename
+    records = encode_records([tuple(row) for row in old])
+    if new_filename is None:
+        new_filename = filename
+        os.replace(filename, os.path.splitext(filename)[0] + '.old.npy')
+    np.save(new_filename, records)
+    return new_filename
+
+
+class DewMasterLogWriter:
+    """ Appends data points to a log file as fixed-size binary records
+
+    The log is a standard .npy file holding a one dimensional array of `RECORD_DTYPE`, so it can
+    be read with `np.load`.  New records are only ever appended to the end of the file, so the
+    cost of each write is proportional to the number of new records and nothing is kept in memory.
+    The header, which holds the number of records, is padded to a fixed size and rewritten in
+    place at most every `header_interval` seconds and when the log is closed.  A reader of a log
+    which is still being written may therefore see slightly fewer records than the file holds.
+
+    The `sync` policy sets the durability of the appended records:
+      - 'none': the records are left in Python's file buffer
+      - 'flush': the buffer is flushed to the operating system after each append
+      - 'fsync': each append is also forced to disk with `os.fsync`
+    """
+    # Space reserved for the number of records in the header
+    _COUNT_DIGITS = 20
+
+    def __init__(self, filename, sync='flush', header_interval=60):
+        """ The constructor for the DewMasterLogWriter class
+
+        :param filename: The path of the log file to create
+        :param sync: The durability policy, 'none', 'flush' or 'fsync'
+        :param header_interval: The longest time in seconds between header updates
+        :type filename: str
+        :type sync: str
+        :type header_interval: float
+        """
+        if sync not in ('none', 'flush', 'fsync'):
+            raise ValueError("sync should be 'none', 'flush' or 'fsync'")
+        self.filename = filename
+        self.sync = sync
+        self.header_interval = header_interval
+        self.count = 0
+        self._header_count = None
+        self._header_time = 0
+        # The magic string, version and length take 10 bytes, and the header ends with a newline
+        longest = len(self._fields(10**self._COUNT_DIGITS - 1)) + 11
+        self._header_size = -(-longest // 64) * 64
+        self._file = open(filename, 'w+b')
+        self._write_header()
+
+    @staticmethod
+    def _fields(count):
+        """ Returns the dictionary of the .npy header for a log of `count` records
+        """
+        return "{{'descr': {0!r}, 'fortran_order': False, 'shape': ({1},), }}".format(
+            np.lib.format.dtype_to_descr(RECORD_DTYPE), count)
+
+    def _header(self, count):
+        """ Returns the .npy header for a log of `count` records padded to the reserved size
+        """
+        text = self._fields(count).ljust(self._header_size - 11) + '\n'
+        return b'\x93NUMPY\x01\x00' + len(text).to_bytes(2, 'little') + text.encode('latin1')
+
+    def _write_header(self):
+        """ Rewrites the header with the current number of records
+        """
+        self._file.seek(0)
+        self._file.write(self._header(self.count))
+        self._file.seek(0, os.SEEK_END)
+        self._header_count = self.count
+        self._header_time = time()
+
+    def append(self, data):
+        """ Appends data points to the log
+
+        :param data: Data points in the format returned by `DewMaster._parse_data`, or records
+        :type data: list of tuple or np.ndarray
+        """
+        if self._file.closed:
+            raise IOError('the log is closed')
+        records = data if isinstance(data, np.ndarray) else encode_records(data)
+        records = np.ascontiguousarray(records, dtype=RECORD_DTYPE)
+        if not len(records):
+            return
+        self._file.write(records.tobytes())
+        self.count += len(records)
+        if time() - self._header_time >= self.header_interval:
+            self._write_header()
+        self._sync()
+
+    def _sync(self):
+        """ Applies the sync policy to the data written so far
+        """
+        if self.sync != 'none':
+            self._file.flush()
+        if self.sync == 'fsync':
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        """ Updates the header and closes the log
+        """
+        if self._file.closed:
+            return
+        if self._header_count != self.count:
+            self._write_header()
+        self._file.flush()
+        if self.sync == 'fsync':
+            os.fsync(self._file.fileno())
+        self._file.close()
+
+
+def _merge_records(sources, chunk_size=65536):
+    """ Merges time-sorted record arrays, yielding the merged records in chunks
+
+    At each step up to `chunk_size` records are taken from the front of every source, and all of
+    them up to the earliest of the last time stamps taken are merged, so the memory used is
+    bounded by the number of sources times `chunk_size` whatever the length of the sources.  Of
+    the records with the same time stamp only the first, in the order of `sources`, is kept.
+
+    :param sources: The record arrays, each sorted by time
+    :param chunk_size: The number of records taken from each source at a time
+    :type sources: list of np.ndarray
+    :type chunk_size: int
+    :return: A generator of the merged records
+    :rtype: generator of np.ndarray
+    """
+    sources = [source for source in sources if len(source)]
+    positions = [0] * len(sources)
+    last = None
+    while True:
+        active = [i for i, source in enumerate(sources) if positions[i] < len(source)]
+        if not active:
+            return
+        windows = {i: sources[i][positions[i]:positions[i] + chunk_size] for i in active}
+        bound = min(window['time'][-1] for window in windows.values())
+        pieces = []
+        for i, window in windows.items():
+            n = np.searchsorted(window['time'], bound, side='right')
+            pieces.append(window[:n])
+            positions[i] += n
+        chunk = np.concatenate(pieces)
+        chunk = chunk[np.argsort(chunk['time'], kind='stable')]
+        times = chunk['time']
+        keep = np.ones(len(chunk), dtype=bool)
+        keep[1:] = times[1:] != times[:-1]
+        if last is not None:
+            keep[0] = times[0] != last
+        chunk = chunk[keep]
+        if len(chunk):
+            last = chunk['time'][-1]
+            yield chunk
+
+
+def merge_logs(filenames, new_filename, chunk_size=65536, sync='flush'):
+    """ Merges several logs into a new log sorted by time
+
+    The logs are memory-mapped and merged a chunk at a time (see `DewMasterData.from_files`), so
+    logs much larger than the memory can be merged.  Points with the same time stamp are only
+    written once.
+
+    :param filenames: The paths of the logs
+    :param new_filename: The path of the merged log
+    :param chunk_size: The number of records read from each log at a time
+    :param sync: The durability policy of the new log (see `DewMasterLogWriter`)
+    :type filenames: list of str
+    :type new_filename: str
+    :type chunk_size: int
+    :type sync: str
+    :return: The number of records written
+    :rtype: int
+    """
+    sources = [DewMasterData(filename) for filename in filenames]
+    log = DewMasterLogWriter(new_filename, sync=sync)
+    try:
+        for chunk in _merge_records([source.sorted_records() for source in sources], chunk_size):
+            log.append(chunk)
+    finally:
+        log.close()
+    return log.count
+
+
+def import_capture(filename, new_filename, chunk_size=1 << 22, sync='flush'):
+    """ Parses the data lines of a raw text capture of the DewMaster output into a new log
+
+    The capture is read `chunk_size` bytes at a time and each block of complete lines is parsed
+    with a `RecordParser` and appended to the log, so captures of any size are converted with
+    bounded memory.  Lines without a time stamp are given the modification time of the capture.
+
+    :param filename: The path of the capture
+    :param new_filename: The path of the new log
+    :param chunk_size: The number of bytes read at a time
+    :param sync: The durability policy of the new log (see `DewMasterLogWriter`)
+    :type filename: str
+    :type new_filename: str
+    :type chunk_size: int
+    :type sync: str
+    :return: The counts of the parser (see `RecordParser`)
+    :rtype: collections.Counter
+    """
+    parser = RecordParser()
+    received = os.path.getmtime(filename)
+    log = DewMasterLogWriter(new_filename, sync=sync)
+    try:
+        with open(filename, 'rb') as f:
+            for block in _line_blocks(f, chunk_size):
+                log.append(parser.parse(block, received))
+    finally:
+        log.close()
+    return parser.counts
+
+
+def _line_blocks(f, chunk_size):
+    """ Reads a file in blocks of about `chunk_size` bytes which end at line breaks
+
+    :param f: The file, opened in binary mode
+    :param chunk_size: The number of bytes read at a time
+    :type f: io.BufferedReader
+    :type chunk_size: int
+    :return: A generator of the blocks
+    :rtype: generator of bytes
+    """
+    rest = b''
+    while True:
+        chunk = f.read(chunk_size)
+        if not chunk:
+            break
+        block = rest + chunk
+        end = block.rfind(b'\n') + 1
+        yield block[:end]
+        rest = block[end:]
+    yield rest
+
+
+def _csv_records(filename, chunk_size, parser):
+    """ Parses a csv log written by `DewMaster.log_data` a block of rows at a time
+
+    :param filename: The path of the csv file
+    :param chunk_size: The number of bytes read at a time
+    :param parser: The parser to use
+    :type filename: str
+    :type chunk_size: int
+    :type parser: RecordParser
+    :return: A generator of the records of each block
+    :rtype: generator of np.ndarray
+    """
+    with open(filename, 'rb') as f:
+        header = [name.strip() for name in f.readline().decode(encoding='latin_1').split(',')]
+        if len(header) < 3 or header[0] != 'Time' or header[-1] != 'Status':
+            raise ValueError('{0} is not a DewMaster csv log'.format(filename))
+        for block in _line_blocks(f, chunk_size):
+            yield parser.parse_csv(block, header[1:-1])
+
+
+def import_csv(filename, new_filename=None, chunk_size=1 << 22, sync='flush', overwrite=False):
+    """ Converts a csv log written by `DewMaster.log_data` to the binary log format
+
+    The csv file is read `chunk_size` bytes at a time, and the rows of each block are parsed
+    together by `RecordParser.parse_csv` and appended to the new log, so files of any size are
+    converted with bounded memory.  By default the new log is written next to the csv file with
+    the extension .npy, where `DewMasterData` looks for it.
+
+    :param filename: The path of the csv file
+    :param new_filename: The path of the new log
+    :param chunk_size: The number of bytes read at a time
+    :param sync: The durability policy of the new log (see `DewMasterLogWriter`)
+    :param overwrite: If True, then an existing file at `new_filename` is replaced
+    :type filename: str
+    :type new_filename: str
+    :type chunk_size: int
+    :type sync: str
+    :type overwrite: bool
+    :return: The counts of the parser (see `RecordParser`)
+    :rtype: collections.Counter
+    """
+    if new_filename is None:
+        new_filename = os.path.splitext(filename)[0] + '.npy'
+    if os.path.exists(new_filename) and not overwrite:
+        raise FileExistsError('{0} already exists'.format(new_filename))
+    parser = RecordParser()
+    records = _csv_records(filename, chunk_size, parser)
+    # Check the header before creating the log
+    first = next(records)
+    log = DewMasterLogWriter(new_filename, sync=sync)
+    try:
+        log.append(first)
+        for chunk in records:
+            log.append(chunk)
+    finally:
+        log.close()
+    return parser.counts
+
+
+def import_csv_directory(directory, overwrite=False, **kwargs):
+    """ Converts every csv log in a directory to the binary log format
+
+    Each file is converted with `import_csv` to a log with the same name and the extension .npy.
+    Files whose log already exists are skipped unless `overwrite` is True, and files which are
+    not DewMaster csv logs are skipped with a warning.
+
+    :param directory: The directory holding the csv files
+    :param overwrite: If True, then existing logs are replaced
+    :param kwargs: Passed to `import_csv`
+    :type directory: str
+    :type overwrite: bool
+    :return: The counts of the parser for each file converted
+    :rtype: dict of str: collections.Counter
+    """
+    out = {}
+    for name in sorted(os.listdir(directory)):
+        filename = os.path.join(directory, name)
+        if os.path.splitext(name)[1].lower() != '.csv' or not os.path.isfile(filename):
+            continue
+        if os.path.exists(os.path.splitext(filename)[0] + '.npy') and not overwrite:
+            continue
+        try:
+            out[filename] = import_csv(filename, overwrite=overwrite, **kwargs)
+        except ValueError as e:
+            warnings.warn(str(e))
+    return out
+
+
+###################################################################################################
+# DewMaster
+###################################################################################################
 class DewMaster:
     """ A class for communicating with the Edgetech Instruments DewMaster
     """
-    def __init__(self, port, timeout=2):
+    def __init__(self, port, timeout=2, device=None, char_pacing=False):
         """
+         If `device` is given, it is used in place of opening a `serial.Serial` instance on
+         `port`.  It can be any object with the same interface, such as the `SimSerial` class in the
+         `labchat.simulator` module.
+
+         Commands are sent in a single transfer unless `char_pacing` is True, in which case each
+         character is sent separately and its echo is awaited before the next one, as a person
+         typing at a terminal would.  `char_pacing` is switched on automatically if the DewMaster
+         drops characters of a command.
+
          :param port: The COM port to which the DewMaster is connected (i.e. 'COM2' or simply 2)
          :param timeout: The length of time in seconds to wait before timing out when communicating
+         :param device: An already constructed serial port object to use instead of `port`
+         :param char_pacing: If True, then commands are typed one character at a time
          :type port: int or str
          :type timeout: int
+         :type device: serial.Serial
+         :type char_pacing: bool
         """
         # Parse port
         if type(port) not in [str, int]:
@@ -43,13 +844,19 @@ class DewMaster:
         if type(port) is int:
             port = 'COM{0}'.format(port)
         # Try to connect to the port
-        try:
-            self.device = serial.Serial(port, baudrate=9600, bytesize=serial.EIGHTBITS,
-                                        stopbits=serial.STOPBITS_ONE, parity=serial.PARITY_NONE,
-                                        timeout=timeout)
-        except serial.SerialException as e:
-            print('Unable to connect to port ' + port + '. Error message: ' + e.__str__())
-            raise
+        if device is not None:
+            self.device = device
+        else:
+            try:
+                self.device = serial.Serial(port, baudrate=9600, bytesize=serial.EIGHTBITS,
+                                            stopbits=serial.STOPBITS_ONE,
+                                            parity=serial.PARITY_NONE, timeout=timeout)
+            except serial.SerialException as e:
+                print('Unable to connect to port ' + port + '. Error message: ' + e.__str__())
+                raise
+        self.char_pacing = char_pacing
+        self.reader = None
+        self._echo = None
         # Check the status
         sleep(0.5)
         out = self.get_status(print_status=False)
@@ -70,27 +877,107 @@ class DewMaster:
     def close(self):
         """ Closes communication with the DewMaster
         """
+        if self.reading:
+            self.stop_reader()
         self.device.close()
 
     def flush(self):
         """ Reads any data in the output buffer without raising a warning if there is none
+
+        While the reader thread is running, the records it has queued are discarded instead.
         """
-        if self.device.inWaiting():
+        if self.reading:
+            self.reader.drain()
+            self._echo = None
+        elif self.device.inWaiting():
             self.device.read(self.device.inWaiting())
 
-    def write(self, command):
-        """ Writes a command to the DewMaster
+    def _read_echo(self, command):
+        """ Reads the characters the DewMaster echoes while a command is typed
+
+        The first character of a command is echoed as 'INPUT: X' unless the DewMaster is waiting
+        for an answer to a prompt, and the others are echoed as they are.  Line breaks left over
+        from a previous reply are skipped.  The read returns as soon as the whole echo has arrived
+        and gives up after the serial timeout.
+
+        :param command: The command which was sent
+        :type command: str
+        :return: The echoed characters without the 'INPUT: ' prefix
+        :rtype: str
+        """
+        prefix = b'INPUT: '
+        expected = command.encode(encoding='utf-8')
+        t_stop = time() + self.device.timeout
+        received = b''
+        while True:
+            body = received.lstrip(b'\r\n')
+            if body == expected:
+                break
+            elif expected.startswith(body):
+                needed = len(expected) - len(body)
+            elif prefix.startswith(body[:len(prefix)]):
+                needed = len(prefix) + len(expected) - len(body)
+            else:
+                break
+            if needed <= 0 or time() >= t_stop:
+                break
+            chunk = self.device.read(needed)
+            if not chunk:
+                break
+            received += chunk
+        if body.startswith(prefix):
+            body = body[len(prefix):]
+        return body.decode(encoding='utf-8', errors='replace')
+
+    def _write_paced(self, command):
+        """ Types a command one character at a time, waiting for each echo
 
         :param command: a string command
         :type command: str
         """
-        # Send letters of command
         for char in command:
             self.device.write(char.encode(encoding='utf-8'))
             self.read()
+        self.device.write('\r\n'.encode(encoding='utf-8'))
+
+    @tracing.traced('write')
+    def write(self, command):
+        """ Writes a command to the DewMaster
+
+        The command is sent in a single transfer and its echo is read back and checked before
+        ENTER is sent.  If the DewMaster drops characters, the garbled line is discarded and this
+        and all later commands are typed one character at a time instead (see `char_pacing`).
+
+        While the reader thread is running the echo is consumed by the reader, so it is not
+        checked.
+
+        :param command: a string command
+        :type command: str
+        """
+        if self.reading:
+            if command:
+                self.device.write(command.encode(encoding='utf-8'))
+                self._echo = command
+        elif self.char_pacing:
+            self._write_paced(command)
+            return
+        elif command:
+            self.device.write(command.encode(encoding='utf-8'))
+            echo = self._read_echo(command)
+            if echo != command:
+                warnings.warn('DewMaster echoed {0!r} for {1!r}, switching to typing one character '
+                              'at a time'.format(echo, command))
+                self.char_pacing = True
+                # Discard the garbled line before typing the command again
+                self.device.write('\r\n'.encode(encoding='utf-8'))
+                self.read()
+                self.flush()
+                self._write_paced(command)
+                return
         # Send ENTER
         self.device.write('\r\n'.encode(encoding='utf-8'))
 
+    @tracing.traced('read')
     def read(self):
         """ Reads from the DewMaster
 
@@ -99,9 +986,35 @@ class DewMaster:
         and prints a warning.  The returned data is formatted as a string and has been stripped of
         leading and trailing whitespace.
 
+        While the reader thread is running, this method instead takes lines from the reader: it
+        skips anything received before the echo of the last command, waits for the next line for
+        up to the timeout and returns it together with the lines which follow until the DewMaster
+        stops sending.
+
         :return: All data waiting in the output buffer of the DewMaster
         :rtype: str
         """
+        quiet = 0.05
+        if self.reading:
+            t_stop = time() + self.device.timeout
+            echo, self._echo = self._echo, None
+            record = self.reader.get(self.device.timeout)
+            if echo:
+                while record is not None and record.line not in (echo, 'INPUT: ' + echo):
+                    record = self.reader.get(max(t_stop - time(), 0))
+                if record is not None:
+                    record = self.reader.get(max(t_stop - time(), 0))
+            if record is None:
+                warnings.warn('read attempt timed out')
+                return ''
+            lines = [record.line]
+            while time() < t_stop:
+                record = self.reader.get(quiet)
+                if record is not None:
+                    lines.append(record.line)
+                elif time() - self.reader.last_received >= quiet:
+                    break
+            return '\r\n'.join(lines).strip()
         # Get start time and define stop time
         t_now = time()
         t_stop = t_now + self.device.timeout
@@ -114,12 +1027,86 @@ class DewMaster:
                 break
             else:
                 last_val = now_val
-            sleep(0.05)
+            sleep(quiet)
             t_now = time()
         else:
             warnings.warn('read attempt timed out')
         return out.decode(encoding='utf-8').strip()
 
+    def _read_line(self):
+        """ Reads the next line of text from the DewMaster
+
+        Blank lines are skipped.  Unlike `read`, this method returns as soon as the end of the line
+        arrives instead of waiting for the DewMaster to stop sending.  If no complete line arrives
+        within the timeout, then it returns whatever was received and prints a warning.
+
+        :return: The line stripped of leading and trailing whitespace
+        :rtype: str
+        """
+        t_stop = time() + self.device.timeout
+        line = b''
+        while time() < t_stop:
+            line = self.device.read_until(b'\n')
+            if not line.endswith(b'\n'):
+                break
+            elif line.strip():
+                return line.decode(encoding='utf-8').strip()
+        warnings.warn('read attempt timed out')
+        return line.decode(encoding='utf-8').strip()
+
+    ###############################################################################################
+    # Background Reading
+    ###############################################################################################
+    @property
+    def reading(self):
+        """ True while the background reader thread is running
+        """
+        return self.reader is not None and self.reader.running
+
+    def start_reader(self, maxsize=10000):
+        """ Starts a thread which reads every line the DewMaster sends
+
+        Once the reader is running, each line is queued as a `Record` with the time at which it
+        was received, and data lines are parsed as they arrive by the reader's `RecordParser`,
+        which counts unusual lines in `reader.counts` instead of warning.  Use `next_record` to
+        wait for them.  `read`, `flush` and `get_data_immediate` take their input from the reader
+        for as long as it runs.
+
+        :param maxsize: The maximum number of records to hold before the oldest are discarded
+        :type maxsize: int
+        :return: The reader
+        :rtype: LineReader
+        """
+        if self.reading:
+            raise RuntimeError('the reader is already running')
+        self.flush()
+        self.reader = LineReader(self.device, maxsize=maxsize)
+        self.reader.start()
+        return self.reader
+
+    def stop_reader(self):
+        """ Stops the background reader thread
+
+        Records which have not been collected yet are discarded.
+        """
+        if self.reader is not None:
+            self.reader.stop()
+            self.reader = None
+
+    def next_record(self, timeout=None, data_only=True):
+        """ Waits for the next line received by the background reader
+
+        :param timeout: The longest time in seconds to wait, or None to wait forever
+        :param data_only: If True, then lines which are not data are skipped
+        :type timeout: float
+        :type data_only: bool
+        :return: The next record, or None if none arrived in time
+        :rtype: Record
+        """
+        if not self.reading:
+            raise IOError('the reader is not running; call start_reader first')
+        return self.reader.get(timeout, data_only=data_only)
+
     ###############################################################################################
     # Get/Set commands
     ###############################################################################################
@@ -214,48 +1201,26 @@ class DewMaster:
     def _parse_data(data_str):
         """ Parses the data string returned by the DewMaster when it is polled
 
+        The string is parsed with a `RecordParser`, and a warning is printed if it has no time
+        stamp or its status is not SERVOLOCK.
+
         :param data_str: A data string from the DewMaster
         :type data_str: str
         :return: (time stamp, list of measurements, list of data values, measurement state)
         :rtype: (datetime.datetime, list of str, list of float, str)
         """
-        # Check for multiple lines
-        if re.search('\r\n', data_str):
-            warnings.warn('data_str has multiple lines, using the first recognized data line')
-            for data_n in data_str.split('\r\n'):
-                if re.search(r"([A-Z]+)\s+=\s+([-\d\.]+)", data_str):
-                    data_str = data_n
-                    break
-            else:
-                raise ValueError('{0} does not appear to contain any data'.format(data_str))
-        # Create datetime object
-        match = re.search(r"(\d\d/?){3}\s+(\d\d:?){3}", data_str)
-        if not match:
-            warnings.warn('Unable to identify timestamp, using local time')
-            dt = datetime.fromtimestamp(time())
-        else:
-            dt = datetime.strptime(match.group(0), r"%m/%d/%y %H:%M:%S")
-        # Create list of measurements
-        match = re.findall(r"([A-Z]+)\s+=\s+([-\d\.]+)", data_str)
-        if not match:
+        parser = RecordParser()
+        _, points = parser.parse_points(data_str)
+        if not points:
             raise ValueError('{0} does not appear to contain any data'.format(data_str))
-        else:
-            measurements = []
-            data = []
-            for m in match:
-                measurements.append(m[0])
-                data.append(float(m[1]))
-        # Check status
-        match = re.search(r"(?!C\s+|F\s+)([A-Z]+( [A-Z]+)*)\s*$", data_str)
-        if not match:
-            warnings.warn('Unable to identify status of measurement')
-            status = 'UNKNOWN'
-        else:
-            status = match.group(0)
-            if not status == 'SERVOLOCK':
-                warnings.warn('Status is {0}, data may be inaccurate'.format(status))
-        # Return
-        return (dt, measurements, data, status)
+        if len(points) > 1:
+            warnings.warn('data_str has multiple data lines, using the first one')
+        if parser.counts['no_timestamp']:
+            warnings.warn('Unable to identify timestamp, using local time')
+        data = points[0]
+        if not data[3] == 'SERVOLOCK':
+            warnings.warn('Status is {0}, data may be inaccurate'.format(data[3]))
+        return data
 
     def get_data_immediate(self, return_raw=False):
         """ Polls the DewMaster for the current data on screen
@@ -275,15 +1240,35 @@ class DewMaster:
         # Write polling command and get data
         self.flush()
         self.write('P')
-        out = self.read()
-        self.read()
+        if self.reading:
+            record = self.reader.get(self.device.timeout, data_only=True)
+            out = record.line if record is not None else ''
+        else:
+            # The blank line which follows the data is discarded by the next command
+            out = self._read_line()
         # Check that out has the proper number of values
         if return_raw:
             return out
         else:
             return self._parse_data(out)
 
-    def log_data(self, filename, interval, total=None, npy=True, csv=True):
+    def _collect_data(self, timeout):
+        """ Waits for the next data line from the reader and collects any others already received
+
+        :param timeout: The longest time in seconds to wait for a data line
+        :type timeout: float
+        :return: The reader records of the data lines
+        :rtype: list of Record
+        """
+        record = self.reader.get(timeout, data_only=True)
+        if record is None:
+            return []
+        records = [record] + [r for r in self.reader.drain() if r.data is not None]
+        for r in records:
+            print(r.line)
+        return records
+
+    def log_data(self, filename, interval, total=None, npy=True, csv=True, sync='flush'):
         """ Logs data to npy and csv files
 
         This routine logs data to either a numpy .npy file or a .csv file, or both.  The interval
@@ -294,16 +1279,26 @@ class DewMaster:
 
         If both npy and csv are False, then the data will simply be printed to the screen.
 
+        The data lines are received by the background reader (see `start_reader`), which is
+        started for the duration of the log if it is not already running.
+
+        The npy file holds an array of `RECORD_DTYPE` records and is written by a
+        `DewMasterLogWriter`, which appends each new point to the end of the file; `sync` is its
+        durability policy.  Neither file is rewritten and the points are not kept in memory, so
+        the log can run indefinitely.
+
         :param filename: The filename (without extensions) of the files which will be created
         :param interval: The time period in seconds between each data point
         :param totol: The total amount of time to record for, records forever if None
         :param npy: Specifies whether or not the data should be saved as an .npy file
         :param csv: Specifies whether or not the data should be saved as a .csv file
+        :param sync: The durability policy of the npy file, 'none', 'flush' or 'fsync'
         :type filename: str
         :type interval: int
         :type total: int
         :type npy: bool
         :type csv: bool
+        :type sync: str
         """
         # Check path and create filenames
         if not os.path.exists(os.path.split(filename)[0]):
@@ -312,38 +1307,41 @@ class DewMaster:
         npy_flnm = os.path.splitext(filename)[0] + '.npy'
         # Start the data output from the DewMaster
         self.set_output_interval(interval)
+        started = not self.reading
+        if started:
+            self.start_reader()
+        log = DewMasterLogWriter(npy_flnm, sync=sync) if npy else None
+        try:
+            self._log_records(csv_flnm, log, interval, total, csv)
+        finally:
+            if log is not None:
+                log.close()
+            if started:
+                self.stop_reader()
+
+    def _log_records(self, csv_flnm, log, interval, total, csv):
+        """ Runs the loop of `log_data` once the reader is running
+        """
+        timeout = interval + self.device.timeout
         # Get the first data points
-        data, tries = [], 0
+        data, tries = self._collect_data(timeout), 0
         while not data:
-            sleep(interval)
-            raw_data = self.read().split('\r\n')
-            for d in raw_data:
-                try:
-                    data.append(self._parse_data(d))
-                    print(d)
-                except ValueError:
-                    pass
             if tries > 2:
                 raise IOError('unable to get data from instrument')
             tries += 1
+            data = self._collect_data(timeout)
         # Start the files
-        if npy:
-            np.save(npy_flnm, data)
+        if log is not None:
+            log.append(np.array([r.data for r in data], dtype=RECORD_DTYPE))
         if csv:
             with open(csv_flnm, mode='w') as f:
                 # Write header
                 f.write('Time, ')
-                for measurement in data[0][1]:
+                for measurement in data[0].point[1]:
                     f.write(measurement + ', ')
                 f.write('Status\n')
                 # Write data
-                for d in data:
-                    f.write(d[0].strftime('%m/%d/%Y %H:%M:%S') + ', ')
-                    for measurement in d[2]:
-                        f.write('{0:g}, '.format(measurement))
-                    f.write(d[3] + '\n')
-        for d in data:
-            print(d)
+                f.write(_csv_lines([r.point for r in data]))
         # Start the data collection loop
         if total is None:
             go_cond = True
@@ -351,31 +1349,17 @@ class DewMaster:
             t_stop = time() + total
             go_cond = True
         while go_cond:
-            data_n = []
-            sleep(interval)
-            raw_data = self.read().split('\r\n')
-            for d in raw_data:
-                try:
-                    data_n.append(self._parse_data(d))
-                    print(d)
-                except ValueError:
-                    pass
+            data_n = self._collect_data(timeout)
             # Write data to files
             if data_n:
                 tries = 0
                 # npy file
-                data += data_n
-                if npy:
-                    np.save(npy_flnm, data)
+                if log is not None:
+                    log.append(np.array([r.data for r in data_n], dtype=RECORD_DTYPE))
                 # csv file
                 if csv:
                     with open(csv_flnm, mode='a') as f:
-                        # Write data
-                        for d in data_n:
-                            f.write(d[0].strftime('%m/%d/%Y %H:%M:%S') + ', ')
-                            for measurement in d[2]:
-                                f.write('{0:g}, '.format(measurement))
-                            f.write(d[3] + '\n')
+                        f.write(_csv_lines([r.point for r in data_n]))
             else:
                 if tries > 3:
                     raise IOError('No data received for 4 tries in a row')
@@ -383,6 +1367,7 @@ class DewMaster:
             if total is not None:
                 go_cond = time() < t_stop
 
+
 class DewMasterData:
     """ A class for accessing data stored by the `log_data` method of the DewMaster class
 
@@ -390,41 +1375,181 @@ class DewMasterData:
     with a csv extension is passed to the constructor, then it changes the extension to .npy and
     tries to import that file.
 
+    The data is held as an array of `RECORD_DTYPE` records, and the accessors return views of its
+    fields or arrays computed from them without looping over the points.  Logs in the object-array
+    format of older versions are converted when they are loaded; use `upgrade_log` to convert the
+    file itself.
+
+    By default the log is memory-mapped rather than read, so opening even a very large log is
+    immediate and only the parts of the file which are used are ever read.  The `times`,
+    `values`, `types` and `status` attributes are views of the record fields, and the derived
+    arrays (e.g. the times in seconds) are computed the first time they are requested and cached.
+
+    `slice` selects a time range with a binary search, `resample` reduces the values to fixed
+    time bins and `find_gaps` locates interruptions of the log.
     """
-    def __init__(self, filename):
+    def __init__(self, filename, mmap=True):
         """ The constructor for the DewMasterData class
 
+        When the log is memory-mapped, the number of records is taken from the size of the file,
+        so the records which a running log has appended since it last updated the header are
+        included.
+
         :param filename: The complete path to the file
+        :param mmap: If True, then the log is memory-mapped instead of being read into memory
         :type filename: str
+        :type mmap: bool
         """
         # Check extension
         if not os.path.splitext(filename)[1] == '.npy':
             warnings.warn('filename should point to an npy file')
-            filename = os.path.splitext(filename)[0] +'.npy'
+            npy_filename = os.path.splitext(filename)[0] +'.npy'
+            if not os.path.exists(npy_filename) and os.path.exists(filename):
+                raise FileNotFoundError('Can not locate file: {0}; convert {1} with import_csv or '
+                                        'load it with DewMasterData.from_csv'.format(npy_filename,
+                                                                                      filename))
+            filename = npy_filename
         # Try to import
         try:
-            data = np.load(filename)
+            data = self._map(filename) if mmap else np.load(filename)
         except FileNotFoundError:
             raise FileNotFoundError('Can not locate file: {0}'.format(filename))
+        except ValueError:
+            # Object arrays can not be loaded without pickle
+            warnings.warn('{0} is in the old object-array format; convert it with '
+                          'upgrade_log'.format(filename))
+            data = encode_records([tuple(row) for row in np.load(filename, allow_pickle=True)])
+        if data.dtype != RECORD_DTYPE:
+            raise ValueError('{0} does not hold DewMaster log records'.format(filename))
         # Assign data to self
         self.data = data
+        self._cache = {}
+
+    @staticmethod
+    def _map(filename):
+        """ Memory-maps the records of a log file
+
+        :param filename: The complete path to the file
+        :type filename: str
+        :return: The records
+        :rtype: np.memmap
+        """
+        with open(filename, 'rb') as f:
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+            offset = f.tell()
+        if dtype.hasobject:
+            # Handled as an old log by the caller
+            raise ValueError('{0} holds an object array'.format(filename))
+        if dtype != RECORD_DTYPE or len(shape) != 1:
+            return np.load(filename)
+        count = (os.path.getsize(filename) - offset) // dtype.itemsize
+        if not count:
+            return np.zeros(0, dtype=RECORD_DTYPE)
+        return np.memmap(filename, dtype=dtype, mode='r', offset=offset, shape=(count,))
+
+    def _cached(self, name, function):
+        """ Returns the cached value of a derived array, computing it on first use
+        """
+        if name not in self._cache:
+            self._cache[name] = function()
+        return self._cache[name]
+
+    @property
+    def times(self):
+        """ The time stamps in nanoseconds since the epoch
+        """
+        return self.data['time']
+
+    @property
+    def values(self):
+        """ The N x 3 measurement values
+        """
+        return self.data['values']
+
+    @property
+    def types(self):
+        """ The N x 3 measurement type codes, indices into `MEASUREMENT_TYPES`
+        """
+        return self.data['types']
+
+    @property
+    def status(self):
+        """ The status codes, indices into `STATUSES`
+        """
+        return self.data['status']
 
     def join(self, data2):
         """ Joins the data from a second DewMasterData object
 
         This method takes a second DewMasterData instance and joins its data to
-        the current DewMaster instance.  The combined dataset is sorted by the
-        timestamps.  It modifies the current instance in-place.
+        the current DewMaster instance.  The two datasets are merged in time
+        order, keeping only the first of any points with the same timestamp.
+        It modifies the current instance in-place, and the joined data is held
+        in memory.  Use `from_files` or `merge_logs` to combine many logs.
 
         :param data2: An second instance of the DewMasterData class
         :type data2: DewMasterData
         """
         assert type(data2) is DewMasterData
-        # Make a copy of the data from data2
-        data2_copy = copy.deepcopy(data2.data)
-        # Join the two datasets and sort
-        self.data = np.concatenate((self.data, data2_copy), axis=0)
-        self.data = self.data[self.data[:, 0].argsort()]
+        # Merge the two sorted datasets
+        chunks = list(_merge_records([self.sorted_records(), data2.sorted_records()],
+                                     chunk_size=len(self.data) + len(data2.data)))
+        self.data = np.concatenate(chunks) if chunks else self.data[:0]
+        self._cache = {'sorted': True}
+
+    @classmethod
+    def from_files(cls, filenames, chunk_size=65536):
+        """ Loads and merges several logs
+
+        Each log is memory-mapped and checked to be sorted by time, and the logs are combined with
+        a k-way merge which takes `chunk_size` records from each log at a time.  Points with the
+        same timestamp are only kept once.  When the logs cover separate time ranges, the merge
+        simply copies them one after the other.  The merged data is held in memory; use
+        `merge_logs` to write it to a new log instead.
+
+        :param filenames: The paths of the logs
+        :param chunk_size: The number of records read from each log at a time
+        :type filenames: list of str
+        :type chunk_size: int
+        :return: The merged data
+        :rtype: DewMasterData
+        """
+        sources = [cls(filename).sorted_records() for filename in filenames]
+        chunks = list(_merge_records(sources, chunk_size))
+        return cls._from_records(np.concatenate(chunks) if chunks else
+                                 np.zeros(0, dtype=RECORD_DTYPE))
+
+    @classmethod
+    def from_csv(cls, filename, chunk_size=1 << 22):
+        """ Loads a csv log written by `DewMaster.log_data`
+
+        The file is parsed a block of rows at a time (see `import_csv`), and the data is held in
+        memory.
+
+        :param filename: The path of the csv file
+        :param chunk_size: The number of bytes read at a time
+        :type filename: str
+        :type chunk_size: int
+        :return: The data
+        :rtype: DewMasterData
+        """
+        new = cls._from_records(np.concatenate(list(_csv_records(filename, chunk_size,
+                                                                 RecordParser()))))
+        new._cache = {}
+        return new
+
+    def sorted_records(self):
+        """ Returns the records, sorting them by time first if they are not sorted
+
+        :return: The records
+        :rtype: np.ndarray of RECORD_DTYPE
+        """
+        self._ensure_sorted()
+        return self.data
 
     ###############################################################################################
     # Internal Get Methods
@@ -437,15 +1562,15 @@ class DewMasterData:
         :return: Measurement value for each of the three measurements at each data point
         :rtype: np.ndarray of float
         """
-        return np.array(self.data[:, 2].tolist())
+        return self.values
 
     def _get_datetimes(self):
-        """ Returns the datetime instances as a single column ndarray
+        """ Returns the time stamps as a single column ndarray
 
-        :return: The datetime instances of each data point as a single column ndarray
-        :rtype: np.ndarray of datetime.datetime
+        :return: The time stamp of each data point
+        :rtype: np.ndarray of np.datetime64
         """
-        return self.data[:, 0]
+        return self.times.view('datetime64[ns]')
 
     def _get_measurement_types(self):
         """ Returns the type for each of the three measurements for each data point
@@ -455,15 +1580,17 @@ class DewMasterData:
         :return: Type of each of the three measurements for each data point
         :rtype: np.ndarray of str
         """
-        return np.array(self.data[:, 1].tolist())
+        return self._cached('types', lambda: np.array(MEASUREMENT_TYPES)[self.types])
 
     def _get_measurement_status(self):
-        """ Returns the status of each measurement as a single column ndarray
+        """ Returns the status code of each measurement as a single column ndarray
 
-        :return: The status of each measurement as a single column ndarray
-        :rtype: np.ndarray of str
+        The codes are indices into `STATUSES`.
+
+        :return: The status code of each measurement as a single column ndarray
+        :rtype: np.ndarray of np.uint8
         """
-        return self.data[:, 3]
+        return self.status
 
     ###############################################################################################
     # User Get Methods
@@ -490,11 +1617,12 @@ class DewMasterData:
         :return: A 3-element list or an N x 3 ndarray describing the type of each of the three measurements
         :rtype: list or np.ndarray
         """
-        types = self._get_measurement_types()
         if summary:
-            return ['/'.join([x for x in set(types[:, j])]) for j in range(3)]
+            return self._cached('type_summary', lambda: [
+                '/'.join(MEASUREMENT_TYPES[c] for c in np.unique(self.types[:, j]))
+                for j in range(3)])
         else:
-            return types
+            return self._get_measurement_types()
 
     def get_measurement_status(self, numerical=True):
         """ Returns the status of each measurement
@@ -513,9 +1641,9 @@ class DewMasterData:
         """
         status = self._get_measurement_status()
         if numerical:
-            return np.array([1 if 'SERVOLOCK' in x else 2 if 'HOLD' in x else 0 for x in status])
-        else:
             return status
+        else:
+            return self._cached('status_names', lambda: np.array(STATUSES)[status])
 
     def get_times_in_seconds(self):
         """ Returns the time of each measurement in seconds since the epoch
@@ -527,4 +1655,127 @@ class DewMasterData:
         :return: A single column numpy array with the time of each data point in seconds
         :rtype: np.ndarray of float
         """
-        return np.array([x.timestamp() for x in self._get_datetimes()])
+        return self._cached('seconds', lambda: self.times * 1e-9)
+
+    ###############################################################################################
+    # Time Queries
+    ###############################################################################################
+    @staticmethod
+    def _to_ns(t):
+        """ Converts a time to nanoseconds since the epoch
+
+        :param t: seconds since the epoch, a datetime or a np.datetime64
+        :type t: float or datetime.datetime or np.datetime64
+        :return: nanoseconds since the epoch
+        :rtype: int
+        """
+        if isinstance(t, datetime):
+            return int(round(t.timestamp() * 1e6)) * 1000
+        elif isinstance(t, np.datetime64):
+            return int(t.astype('datetime64[ns]').astype(np.int64))
+        return int(round(float(t) * 1e9))
+
+    def _ensure_sorted(self):
+        """ Sorts the records by time if they are not sorted already
+
+        The check is made once; the logs written by `DewMaster.log_data` are normally sorted, in
+        which case the records are left in place (and memory-mapped).
+        """
+        if self._cache.get('sorted'):
+            return
+        if len(self.data) > 1 and np.any(np.diff(self.times) < 0):
+            warnings.warn('the records are not in time order; sorting them in memory')
+            self.data = self.data[np.argsort(self.times, kind='stable')]
+            self._cache = {}
+        self._cache['sorted'] = True
+
+    @classmethod
+    def _from_records(cls, records):
+        """ Returns a DewMasterData instance holding `records`
+        """
+        new = cls.__new__(cls)
+        new.data = records
+        new._cache = {'sorted': True}
+        return new
+
+    def slice(self, t0=None, t1=None):
+        """ Returns the data points with t0 <= time < t1
+
+        The points are found with a binary search of the time stamps, and the result is a view of
+        the records of this instance, so slicing a memory-mapped log only reads the pages around
+        the two ends of the range.
+
+        :param t0: The start of the range, or None for the first point
+        :param t1: The end of the range, or None for the last point
+        :type t0: float or datetime.datetime or np.datetime64
+        :type t1: float or datetime.datetime or np.datetime64
+        :return: The data in the range
+        :rtype: DewMasterData
+        """
+        self._ensure_sorted()
+        start = 0 if t0 is None else np.searchsorted(self.times, self._to_ns(t0), side='left')
+        stop = (len(self.data) if t1 is None else
+                np.searchsorted(self.times, self._to_ns(t1), side='left'))
+        return self._from_records(self.data[start:max(start, stop)])
+
+    def resample(self, interval, how='mean', t0=None):
+        """ Reduces the measurement values to fixed time bins
+
+        The bins are `interval` seconds wide and start at `t0` (the first point by default).  `how`
+        is one of 'mean', 'min', 'max' or 'last'.  Bins without any points are filled with NaN.
+
+        :param interval: The width of the bins in seconds
+        :param how: The reduction applied to the points in each bin
+        :param t0: The start of the first bin
+        :type interval: float
+        :type how: str
+        :type t0: float or datetime.datetime or np.datetime64
+        :return: (start of each bin in seconds since the epoch, N x 3 array of values)
+        :rtype: (np.ndarray of float, np.ndarray of float)
+        """
+        if how not in ('mean', 'min', 'max', 'last'):
+            raise ValueError("how should be 'mean', 'min', 'max' or 'last'")
+        width = int(round(interval * 1e9))
+        if width <= 0:
+            raise ValueError('interval should be positive')
+        self._ensure_sorted()
+        data = self if t0 is None else self.slice(t0)
+        if not len(data.data):
+            return np.zeros(0), np.zeros((0, 3))
+        times = data.times
+        start = times[0] if t0 is None else self._to_ns(t0)
+        bins = (times - start) // width
+        # The records are sorted, so each bin is a contiguous run of points
+        first = np.flatnonzero(np.diff(bins, prepend=-1))
+        values = np.asarray(data.values)
+        if how == 'mean':
+            reduced = np.add.reduceat(values, first) / np.diff(first, append=len(bins))[:, None]
+        elif how == 'min':
+            reduced = np.minimum.reduceat(values, first)
+        elif how == 'max':
+            reduced = np.maximum.reduceat(values, first)
+        else:
+            reduced = values[np.append(first[1:], len(bins)) - 1]
+        out = np.full((bins[-1] + 1, 3), np.nan)
+        out[bins[first]] = reduced
+        return (start + np.arange(len(out)) * width) * 1e-9, out
+
+    def find_gaps(self, max_gap=None):
+        """ Finds the gaps in the data
+
+        A gap is a pair of consecutive points more than `max_gap` seconds apart.  By default
+        `max_gap` is 1.5 times the median spacing of the points.
+
+        :param max_gap: The longest spacing in seconds which is not a gap
+        :type max_gap: float
+        :return: M x 2 array with the times in seconds of the points before and after each gap
+        :rtype: np.ndarray of float
+        """
+        self._ensure_sorted()
+        if len(self.data) < 2:
+            return np.zeros((0, 2))
+        times = self.times
+        spacing = np.diff(times)
+        limit = 1.5 * np.median(spacing) if max_gap is None else max_gap * 1e9
+        index = np.flatnonzero(spacing > limit)
+        return np.column_stack((times[index], times[index + 1])) * 1e-9
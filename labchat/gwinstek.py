@@ -10,13 +10,20 @@ from National Instruments.
 """
 
 import logging
+from collections import deque, namedtuple
+from time import time
+from labchat import waveform
 from labchat.visausb import VisaUsbInstrument
+from labchat.tracing import sleep
 
 __email__ = "chrisark7@gmail.com"
 __status__ = "Development"
 
 logger = logging.getLogger(__name__)
 
+# An entry of the instrument's error queue
+ErrorRecord = namedtuple("ErrorRecord", ["code", "message"])
+
 
 class AFG2225(VisaUsbInstrument):
     """ A class for communicating with the GW Instek AFG-2225
@@ -24,7 +31,55 @@ class AFG2225(VisaUsbInstrument):
     This class is likely generic enough to work with other models in the GW
     Instek line but has not been tested.
     """
-    def __init__(self, device_id=0, timeout=0.5):
+    # Query and readback parser of each setting held in the shadow state
+    _SETTINGS = {"wavetype": ("SOURCE{0}:FUNCTION?", str),
+                 "frequency": ("SOURCE{0}:FREQUENCY?", float),
+                 "amplitude": ("SOURCE{0}:AMPLITUDE?", float),
+                 "offset": ("SOURCE{0}:DCOFFSET?", float),
+                 "square_duty": ("SOURCE{0}:SQUARE:DCYCLE?", float),
+                 "ramp_symmetry": ("SOURCE{0}:RAMP:SYMMETRY?", float),
+                 "phase": ("SOURCE{0}:PHASE?", float),
+                 "output_onoff": ("OUTPUT{0}?", lambda x: bool(int(x))),
+                 "output_load": ("OUTPUT{0}:LOAD?", str),
+                 "voltageunits": ("SOURCE{0}:VOLTAGE:UNIT?", str)}
+    # SCPI header below SOURCE<n> of the numeric settings
+    _NUMERIC_HEADERS = {"frequency": "FREQUENCY",
+                        "amplitude": "AMPLITUDE",
+                        "offset": "DCOFFSET",
+                        "square_duty": "SQUARE:DCYCLE",
+                        "ramp_symmetry": "RAMP:SYMMETRY",
+                        "phase": "PHASE"}
+    # Settings which the instrument may change when the key is set
+    _SHADOW_DEPENDENTS = {"wavetype": ("frequency", "amplitude", "offset",
+                                       "square_duty", "ramp_symmetry"),
+                          "output_load": ("amplitude", "offset"),
+                          "voltageunits": ("amplitude", "offset"),
+                          "amplitude": ("offset",),
+                          "frequency": ("square_duty",)}
+    # APPLy shape of each wavetype readback; noise has no frequency to apply
+    _APPLY_SHAPES = {"SIN": "SINUSOID",
+                     "SQU": "SQUARE",
+                     "RAMP": "RAMP",
+                     "PULS": "PULSE",
+                     "ARB": "USER"}
+    # Order in which the waveform settings are applied and verified
+    _WAVE_ORDER = ("wavetype", "frequency", "amplitude", "offset",
+                   "square_duty", "ramp_symmetry", "phase")
+    # Settings which determine the range limits of the numeric settings
+    _LIMIT_KEYS = ("wavetype", "output_load", "voltageunits")
+    # Numeric settings whose limits also depend on another numeric setting
+    _LIMIT_DEPENDENCIES = {"amplitude": ("offset",),
+                           "frequency": ("square_duty",)}
+    # Size and code range of the volatile arbitrary waveform memory
+    _ARB_LENGTH = 4096
+    _ARB_FULL_SCALE = 511
+    # Query, device, execution and command error bits of *ESR?
+    _ESR_ERROR_BITS = 0x3C
+    # Error queue bit of *STB?
+    _STB_ERROR_QUEUE = 0x04
+
+    def __init__(self, device_id=0, timeout=0.5, resource_manager=None,
+                 shadow_ttl=0, cache_limits=True, error_check=False):
         """ The constructor for the AFG2225 class
 
         This function searches the devices connected to the computer and
@@ -35,14 +90,52 @@ class AFG2225(VisaUsbInstrument):
         The list of devices connected to the computer will be printed to the
         log.
 
+        The instance keeps a shadow copy of the settings of both channels
+        which is updated by every successful set and every query.
+        `shadow_ttl` sets how long a shadow value may be returned by the
+        `get_*` methods instead of querying the instrument: 0 (the default)
+        always queries, a positive number of seconds serves values younger
+        than that, and `float('inf')` serves shadow values until they are
+        invalidated.
+
+        The MIN/MAX range limits of the numeric settings are cached as well,
+        keyed by the channel's wavetype, load and voltage unit, so that range
+        checks are made locally.  The key is taken from the shadow state and
+        so is subject to `shadow_ttl`: while any part of it is older than
+        that, the limits are queried again (together with the key, in one
+        transfer).  With the default `shadow_ttl` of 0 the limits are
+        therefore always queried.  If a set made with cached limits fails,
+        the limits are queried again and the set retried.  Set `cache_limits`
+        to False to query the limits on every set.
+
+        If `error_check` is True, the status registers are checked after
+        every batched set (e.g. `set_wave` and `set_waves`) and any errors
+        found are logged as warnings and kept in `error_log`.
+
         :param device_id: Integer or string which describes the device to connect to
         :param timeout: The timeout value to use with the instrument in seconds
+        :param resource_manager: The resource manager used to open the device
+        :param shadow_ttl: The maximum age in seconds of shadow values returned by the getters
+        :param cache_limits: Whether to cache the range limits of the numeric settings
+        :param error_check: Whether to check for errors after batched sets
         :type device_id: int or str
         :type timeout: int or float
+        :type resource_manager: visa.ResourceManager
+        :type shadow_ttl: float
+        :type cache_limits: bool
+        :type error_check: bool
         :return: An instance of the AFG2225 class
         :rtype: AFG2225
         """
-        super(AFG2225, self).__init__(device_id=device_id, timeout=timeout)
+        super(AFG2225, self).__init__(device_id=device_id, timeout=timeout,
+                                      resource_manager=resource_manager)
+        self.shadow_ttl = shadow_ttl
+        self.cache_limits = cache_limits
+        self._shadow = {1: {}, 2: {}}
+        self._limits = {}
+        self._arb_memory = {}
+        self.error_check = error_check
+        self.error_log = deque(maxlen=100)
 
     ###########################################################################
     # Helper Methods
@@ -64,90 +157,508 @@ class AFG2225(VisaUsbInstrument):
             raise ValueError("channel should be 1 or 2")
         return channel
 
+    @staticmethod
+    def _clamp(name, value, min_value, max_value):
+        """ Clamps a value to the range [min_value, max_value]
+
+        A warning is logged if the value is out of range.
+
+        :param name: The name of the parameter used in the warning
+        :param value: The value to clamp
+        :param min_value: The minimum allowed value
+        :param max_value: The maximum allowed value
+        :type name: str
+        :type value: float
+        :type min_value: float
+        :type max_value: float
+        :return: The clamped value and whether it was in range
+        :rtype: (float, bool)
+        """
+        if value > max_value:
+            logger.warning("{0} is greater than the max for the current "
+                           "settings; setting to {1}".format(name, max_value))
+            return max_value, False
+        elif value < min_value:
+            logger.warning("{0} is less than the min for the current "
+                           "settings; setting to {1}".format(name, min_value))
+            return min_value, False
+        return value, True
+
+    def _set_numeric(self, channel, name, value):
+        """ Sets a numeric setting after clamping it to its range
+
+        The min and max are taken from the limits cache or queried with
+        `SOURCE<n>:<header>? MIN|MAX`, the value is clamped to that range,
+        and it is then set with `_set_with_check`.  False is returned if the
+        value had to be clamped, even though the clamped value is still set.
+
+        :param channel: The channel to set (1 or 2)
+        :param name: The name of the setting, e.g. "frequency"
+        :param value: The value to set
+        :type channel: int
+        :type name: str
+        :type value: float
+        :return: True if set, False if not
+        :rtype: bool
+        """
+        return self._run_steps(self._set_numeric_steps(channel, name, value))
+
+    def _set_numeric_steps(self, channel, name, value):
+        """ The steps of `_set_numeric` as a generator (see `_set_with_check_steps`)
+        """
+        header = self._NUMERIC_HEADERS[name]
+        min_value, max_value, cached = self._get_limits(channel, name)
+        clamped, in_range = self._clamp(name.replace("_", " "), value, min_value, max_value)
+        out = yield from self._set_setting_steps(
+            channel, name,
+            command="SOURCE{0}:{1} {2}".format(channel, header, clamped),
+            query="SOURCE{0}:{1}?".format(channel, header),
+            result=clamped,
+            transform=float)
+        if not out and cached:
+            # The cached limits may be stale, e.g. after a front panel change
+            logger.info("Setting {0} failed with cached limits; refreshing the "
+                        "limits and retrying".format(name))
+            self.invalidate(channel, self._LIMIT_KEYS)
+            return (yield from self._set_numeric_steps(channel, name, value))
+        return in_range and out
+
+    def _set_setting(self, channel, name, command, query, result, transform=None):
+        """ Sets a setting with `_set_with_check` and records it in the shadow
+
+        :param channel: The channel of the setting (1 or 2)
+        :param name: The name of the setting, e.g. "wavetype"
+        :param command: The full command to issue to the device
+        :param query: The full query command
+        :param result: The expected result
+        :param transform: A function applied to readback before comparision
+        :type channel: int
+        :type name: str
+        :return: True if set, False if not
+        :rtype: bool
+        """
+        return self._run_steps(self._set_setting_steps(channel, name, command, query,
+                                                       result, transform))
+
+    def _set_setting_steps(self, channel, name, command, query, result, transform=None):
+        """ The steps of `_set_setting` as a generator (see `_set_with_check_steps`)
+        """
+        out = yield from self._set_with_check_steps(command=command,
+                                                    query=query,
+                                                    result=result,
+                                                    transform=transform)
+        self._record_set(channel, name, out, result)
+        return out
+
     ###########################################################################
-    # System Methods
+    # Shadow State
     ###########################################################################
-    def system_read_error_queue(self):
-        """ Reads all messages stored in the error queue
+    def _store_shadow(self, channel, name, value):
+        """ Stores a value read from or verified on the instrument
+        """
+        self._shadow[channel][name] = (value, time())
 
-        This method reads all messages stored in the AFG2225's internal error
-        queue and returns them to the user as a list of 2-element tuples where
-        the first element is the error code and the second is the message.
-
-        Note that the error queue reads out in a strange way from this device
-        where the separation between successive reads from the error queue is
-        broken at the end of the error code.  This means that the messages
-        returned have the last error's message and the next error's code.
-        However, this quirk is handled internally so it should not affect the
-        user.
-
-        :return: list of tuples with (error code, error message)
-        :rtype: list of tuple
-        """
-        # Read the error queue until 'No error.' is returned
-        last_message = ''
-        messages = []
-        i = 0
-        self.flush()
-        while i < 20:
-            last_message = self.query("SYSTEM:ERROR?")
-            if last_message == "No error.":
-                break
+    def _record_set(self, channel, name, success, result):
+        """ Updates the shadow state after an attempt to set a setting
+
+        The settings which the instrument may adjust as a consequence are
+        invalidated.  If the set failed, the setting itself is invalidated.
+
+        :param channel: The channel of the setting (1 or 2)
+        :param name: The name of the setting
+        :param success: Whether the readback matched
+        :param result: The expected readback
+        :type channel: int
+        :type name: str
+        :type success: bool
+        """
+        self.invalidate(channel, self._SHADOW_DEPENDENTS.get(name, ()))
+        for dependent in self._LIMIT_DEPENDENCIES.get(name, ()):
+            self._drop_limits(channel, dependent)
+        if success:
+            self._store_shadow(channel, name, self._SETTINGS[name][1](result))
+        else:
+            self.invalidate(channel, name)
+
+    def _get_setting(self, channel, name):
+        """ Returns a setting from the shadow state or from the instrument
+
+        The shadow value is returned if it is younger than `shadow_ttl`;
+        otherwise the instrument is queried and the shadow updated.
+
+        :param channel: The channel to query (1 or 2)
+        :param name: The name of the setting
+        :type channel: int
+        :type name: str
+        :return: The value of the setting
+        """
+        return self._get_settings(channel, [name])[name]
+
+    def _get_settings(self, channel, names):
+        """ Returns several settings, querying the stale ones in one transfer
+
+        :param channel: The channel to query (1 or 2)
+        :param names: The names of the settings
+        :type channel: int
+        :type names: list of str
+        :return: dictionary of {setting: value}
+        :rtype: dict
+        """
+        out = {}
+        stale = []
+        for name in names:
+            entry = self._shadow[channel].get(name)
+            if (self.shadow_ttl and entry is not None and
+                    time() - entry[1] <= self.shadow_ttl):
+                out[name] = entry[0]
             else:
-                messages.append(last_message)
-        self.flush()
-        print(messages)
-        # Parse messages
+                stale.append(name)
+        if stale:
+            replies = self.query(";:".join(self._SETTINGS[name][0].format(channel)
+                                           for name in stale)).split(";")
+            if len(replies) != len(stale):
+                raise IOError("Expected {0} values from the compound query but "
+                              "received {1}".format(len(stale), len(replies)))
+            for name, reply in zip(stale, replies):
+                value = self._SETTINGS[name][1](reply.strip())
+                self._store_shadow(channel, name, value)
+                out[name] = value
+        return out
+
+    def _write_and_verify(self, commands, checks):
+        """ Sends commands in one transfer and verifies them in another
+
+        The commands are joined into one compound command and the checks are
+        read back with one compound query.  The shadow state is updated with
+        the outcome of each check, so the checks should be listed in the
+        order in which the settings depend on each other (wavetype first).
+
+        :param commands: The full commands to issue
+        :param checks: (channel, setting, expected value) for each setting to verify
+        :type commands: list of str
+        :type checks: list of tuple
+        :return: dictionary of {(channel, setting): True if verified}
+        :rtype: dict
+        """
+        pause_between_set_and_query = 25e-3
+        self.write(";:".join(commands))
+        sleep(pause_between_set_and_query)
+        out = self._verify_readback(checks, self.query(self._readback_query(checks)))
+        if self.error_check:
+            self.check_errors()
+        return out
+
+    def _readback_query(self, checks):
+        """ Returns the compound query which reads back the checked settings
+        """
+        return ";:".join(self._SETTINGS[name][0].format(channel)
+                         for channel, name, expected in checks)
+
+    def _verify_readback(self, checks, reply):
+        """ Compares a compound read-back with the expected values
+
+        :param checks: (channel, setting, expected value) for each setting
+        :param reply: The reply to the query from `_readback_query`
+        :type checks: list of tuple
+        :type reply: str
+        :return: dictionary of {(channel, setting): True if verified}
+        :rtype: dict
+        """
+        replies = reply.split(";")
+        if len(replies) != len(checks):
+            logger.warning("Expected {0} values from the compound read-back but "
+                           "received {1}".format(len(checks), len(replies)))
+            replies = [None] * len(checks)
+        out = {}
+        for (channel, name, expected), reply in zip(checks, replies):
+            try:
+                ok = (reply is not None and
+                      self._SETTINGS[name][1](reply.strip()) == expected)
+            except ValueError:
+                ok = False
+            self._record_set(channel, name, ok, expected)
+            out[(channel, name)] = ok
+        return out
+
+    def invalidate(self, channel=None, names=None):
+        """ Discards shadow values so that the next get queries the instrument
+
+        Call this when the instrument may have been changed behind the
+        driver's back, e.g. from the front panel.  Invalidating all of the
+        settings of a channel also discards its cached limits, and
+        invalidating everything also forgets which arbitrary waveforms are in
+        instrument memory.
+
+        :param channel: The channel to invalidate; None for both
+        :param names: A setting name or list of names; None for all
+        :type channel: int
+        :type names: str or list of str
+        """
+        channels = [1, 2] if channel is None else [self._check_channel(channel)]
+        if channel is None and names is None:
+            self._arb_memory.clear()
+        if isinstance(names, str):
+            names = [names]
+        for ch in channels:
+            if names is None:
+                self._shadow[ch].clear()
+                self._drop_limits(ch)
+            else:
+                for name in names:
+                    self._shadow[ch].pop(name, None)
+
+    def resync(self, channels=(1, 2)):
+        """ Refreshes the shadow state of the channels with one compound query
+
+        :param channels: The channels to refresh
+        :type channels: list of int
+        :return: dictionary of {channel: {setting: value}}
+        :rtype: dict
+        """
+        channels = [self._check_channel(channel) for channel in channels]
+        keys = [(channel, name) for channel in channels for name in self._SETTINGS]
+        query = ";:".join(self._SETTINGS[name][0].format(channel)
+                          for channel, name in keys)
+        replies = self.query(query).split(";")
+        if len(replies) != len(keys):
+            self.invalidate()
+            raise IOError("Expected {0} values from the compound query but "
+                          "received {1}".format(len(keys), len(replies)))
+        t = time()
+        for (channel, name), reply in zip(keys, replies):
+            self._shadow[channel][name] = (self._SETTINGS[name][1](reply.strip()), t)
+        return {channel: self.shadow_state(channel) for channel in channels}
+
+    def shadow_state(self, channel):
+        """ Returns the shadow values of a channel without querying
+
+        Settings which are not known are omitted.
+
+        :param channel: The channel (1 or 2)
+        :type channel: int
+        :return: dictionary of {setting: value}
+        :rtype: dict
+        """
+        channel = self._check_channel(channel)
+        return {name: entry[0] for name, entry in self._shadow[channel].items()}
+
+    ###########################################################################
+    # Limits Cache
+    ###########################################################################
+    def _limit_key(self, channel, ttl=None):
+        """ Returns the (wavetype, load, unit) key of a channel or None
+
+        The key is taken from the shadow state; None is returned if any part
+        of it is unknown or, if `ttl` is given, older than `ttl` seconds.
+        """
+        shadow = self._shadow[channel]
+        try:
+            entries = [shadow[name] for name in self._LIMIT_KEYS]
+        except KeyError:
+            return None
+        if ttl is not None:
+            now = time()
+            if not ttl or any(now - entry[1] > ttl for entry in entries):
+                return None
+        return tuple(entry[0] for entry in entries)
+
+    def _drop_limits(self, channel, name=None):
+        """ Discards cached limits of a channel, optionally for one setting
+        """
+        for key in [key for key in self._limits
+                    if key[0] == channel and (name is None or key[1] == name)]:
+            del self._limits[key]
+
+    def _get_limits(self, channel, name):
+        """ Returns the range limits of a numeric setting
+
+        :param channel: The channel (1 or 2)
+        :param name: The name of the numeric setting
+        :type channel: int
+        :type name: str
+        :return: (min, max, from_cache)
+        :rtype: (float, float, bool)
+        """
+        key = self._limit_key(channel, self.shadow_ttl)
+        if self.cache_limits and key is not None:
+            limits = self._limits.get((channel, name) + key)
+            if limits is not None:
+                return limits + (True,)
+        limits = self.load_limits([channel], [name])[channel][name]
+        return limits + (False,)
+
+    def load_limits(self, channels=(1, 2), names=None):
+        """ Queries the range limits of numeric settings in one transfer
+
+        The wavetype, load and voltage unit of each channel are read in the
+        same compound query, so the shadow state and the limits cache are
+        both brought up to date.
+
+        :param channels: The channels whose limits to load
+        :param names: The numeric settings to load; None for all of them
+        :type channels: list of int
+        :type names: list of str
+        :return: dictionary of {channel: {setting: (min, max)}}
+        :rtype: dict
+        """
+        channels = [self._check_channel(channel) for channel in channels]
+        if names is None:
+            names = list(self._NUMERIC_HEADERS)
+        queries = []
+        for channel in channels:
+            queries.extend(self._SETTINGS[key][0].format(channel)
+                           for key in self._LIMIT_KEYS)
+            for name in names:
+                header = self._NUMERIC_HEADERS[name]
+                queries.append("SOURCE{0}:{1}? MIN".format(channel, header))
+                queries.append("SOURCE{0}:{1}? MAX".format(channel, header))
+        replies = self.query(";:".join(queries)).split(";")
+        if len(replies) != len(queries):
+            raise IOError("Expected {0} values from the compound query but "
+                          "received {1}".format(len(queries), len(replies)))
+        replies = iter(reply.strip() for reply in replies)
+        out = {}
+        for channel in channels:
+            for key in self._LIMIT_KEYS:
+                self._store_shadow(channel, key, self._SETTINGS[key][1](next(replies)))
+            limit_key = self._limit_key(channel)
+            out[channel] = {}
+            for name in names:
+                limits = (float(next(replies)), float(next(replies)))
+                self._limits[(channel, name) + limit_key] = limits
+                out[channel][name] = limits
+        return out
+
+    ###########################################################################
+    # System Methods
+    ###########################################################################
+    def _error_status(self):
+        """ Returns True if the status registers report an error
+
+        One compound query reads (and so clears) the standard event status
+        register and reads the status byte.  An error is reported if one of
+        the query, device, execution or command error bits of the former is
+        set or if the error queue bit of the latter is set.
+
+        :return: True if there may be entries in the error queue
+        :rtype: bool
+        """
+        reply = self.query("*ESR?;*STB?").split(";")
+        try:
+            esr, stb = int(reply[0]), int(reply[1])
+        except (IndexError, ValueError):
+            logger.warning("Unable to interpret status registers {0!r}; reading "
+                           "the error queue".format(reply))
+            return True
+        return bool(esr & self._ESR_ERROR_BITS or stb & self._STB_ERROR_QUEUE)
+
+    @staticmethod
+    def _parse_error_segments(segments):
+        """ Reassembles error queue entries from the replies to SYSTEM:ERROR?
+
+        The error queue reads out in a strange way from this device: the
+        separation between successive reads is broken at the end of the error
+        code, so the replies read "<code>", "<message>.<code>", ...,
+        "<message>.".
+
+        :param segments: The replies preceding "No error."
+        :type segments: list of str
+        :return: list of (code, message) records
+        :rtype: list of ErrorRecord
+        """
         out = []
-        next_code = None
-        last_code = None
-        last_message = None
-        for message in messages:
-            # Interpret message
-            if not message:
-                pass
-            elif '.' in message:
-                split_messages = message.split('.')
-                last_message = '.'.join(split_messages[:-1])
-                if split_messages[-1]:
-                    next_code = split_messages[-1]
-            elif next_code is None:
-                next_code = message
+        code = None
+        for segment in segments:
+            segment = segment.strip()
+            if not segment:
+                continue
+            if "." in segment:
+                message, _, next_code = segment.rpartition(".")
+                out.append(ErrorRecord(code, message))
             else:
-                last_message = message
-            # Check that error code is an integer
-            if next_code is not None:
+                next_code = segment
+            if next_code:
                 try:
-                    next_code = int(next_code)
-                except (ValueError, TypeError):
-                    logger.warning("Unable to interpret code as an integer; "
-                                   "something may be wrong with error readback")
-            # Save to output
-            if last_message is not None:
-                out.append((last_code, last_message))
-            last_code = next_code
-        # Return
+                    code = int(next_code)
+                except ValueError:
+                    logger.warning("Unable to interpret code {0!r} as an "
+                                   "integer; something may be wrong with error "
+                                   "readback".format(next_code))
+                    code = next_code
+            else:
+                code = None
         return out
 
+    def system_read_error_queue(self, max_entries=20, batch_size=8, check_status=True):
+        """ Reads all messages stored in the error queue
+
+        This method reads the messages stored in the AFG2225's internal error
+        queue and returns them as a list of (code, message) records.  The
+        quirk of the device's error read-out (see `_parse_error_segments`) is
+        handled internally.
+
+        When `check_status` is True the status registers are checked first,
+        so a clean queue costs one short query.  Otherwise the queue is read
+        with compound queries of `batch_size` `SYSTEM:ERROR?` commands until
+        "No error." is returned, reading at most `max_entries` entries.
+
+        :param max_entries: The maximum number of entries to read
+        :param batch_size: The number of entries read per transfer
+        :param check_status: Whether to skip the read-out if the status registers report no error
+        :type max_entries: int
+        :type batch_size: int
+        :type check_status: bool
+        :return: list of (code, message) records
+        :rtype: list of ErrorRecord
+        """
+        if check_status and not self._error_status():
+            return []
+        # A queue of n entries reads out as n + 1 segments
+        remaining = max_entries + 1
+        segments = []
+        while remaining > 0:
+            count = min(batch_size, remaining)
+            replies = self.query(";:".join(["SYSTEM:ERROR?"] * count)).split(";")
+            remaining -= count
+            if "No error." in replies:
+                segments += replies[:replies.index("No error.")]
+                break
+            segments += replies
+        else:
+            logger.warning("The error queue still held entries after reading "
+                           "{0} of them".format(max_entries))
+        return self._parse_error_segments(segments)
+
+    def check_errors(self, raise_on_error=False):
+        """ Reads the error queue if the status registers report an error
+
+        The errors found are logged as warnings and appended to `error_log`.
+
+        :param raise_on_error: Whether to raise an IOError if there were errors
+        :type raise_on_error: bool
+        :return: list of (code, message) records
+        :rtype: list of ErrorRecord
+        """
+        errors = self.system_read_error_queue()
+        for error in errors:
+            logger.warning("AFG2225 error {0}: {1}".format(*error))
+        self.error_log.extend(errors)
+        if errors and raise_on_error:
+            raise IOError("The AFG2225 reported errors: {0}".format(
+                "; ".join("{0}: {1}".format(*error) for error in errors)))
+        return errors
+
     ###########################################################################
     # Set/Get Waveform Properties Individually
     ###########################################################################
-    def set_wavetype(self, channel, wavetype):
-        """ Sets the channel's function
+    def _wavetype_commands(self, channel, wavetype):
+        """ Returns the command, query and expected result for `set_wavetype`
 
-        Possible channel wavetypes are: SINUSOID, SQUARE, RAMP, PULSE, NOISE,
-        USER
+        The arguments are validated as described in `set_wavetype`.
 
-        :param channel: The channel to set (1 or 2)
-        :param wavetype: A string corresponding to the function
-        :type channel: int
-        :type wavetype: str
-        :return: True if set, False if not
-        :rtype: bool
+        :return: (command, query, result) for `_set_with_check`
+        :rtype: (str, str, str)
         """
-        assert type(wavetype) is str
-        # Check channel
-        channel = self._check_channel(channel)
         # Define possibilities
         inputs = {"SINUSOID": "SIN",
                   "SQUARE": "SQU",
@@ -173,8 +684,26 @@ class AFG2225(VisaUsbInstrument):
         command = "SOURCE{0}:FUNCTION {1}".format(channel, wavetype)
         query = "SOURCE{0}:FUNCTION?".format(channel)
         result = inputs[wavetype]
-        # Issue command
-        return self._set_with_check(command, query, result)
+        return command, query, result
+
+    def set_wavetype(self, channel, wavetype):
+        """ Sets the channel's function
+
+        Possible channel wavetypes are: SINUSOID, SQUARE, RAMP, PULSE, NOISE,
+        USER
+
+        :param channel: The channel to set (1 or 2)
+        :param wavetype: A string corresponding to the function
+        :type channel: int
+        :type wavetype: str
+        :return: True if set, False if not
+        :rtype: bool
+        """
+        assert type(wavetype) is str
+        # Check channel
+        channel = self._check_channel(channel)
+        commands = self._wavetype_commands(channel, wavetype)
+        return self._set_setting(channel, "wavetype", *commands)
 
     def get_wavetype(self, channel):
         """ Returns the channel's current function setting
@@ -187,7 +716,7 @@ class AFG2225(VisaUsbInstrument):
         # Check channel
         channel = self._check_channel(channel)
         # Get Current Function
-        return self.query("SOURCE{0}:FUNCTION?".format(channel))
+        return self._get_setting(channel, "wavetype")
 
     def set_frequency(self, channel, frequency):
         """ Sets the channel's frequency
@@ -210,31 +739,8 @@ class AFG2225(VisaUsbInstrument):
         """
         # Check channel
         channel = self._check_channel(channel)
-        # Check
-        # Query the min and max possible frequencies
-        min_freq = float(self.query("SOURCE{0}:FREQUENCY? MIN".format(channel)))
-        max_freq = float(self.query("SOURCE{0}:FREQUENCY? MAX".format(channel)))
-        # Check that frequency is in the range
-        in_range = True
-        if frequency > max_freq:
-            logger.warning("Frequency is greater than the max for this function; "
-                           "setting to {0} instead".format(max_freq))
-            frequency = max_freq
-            in_range = False
-        elif frequency < min_freq:
-            logger.warning("Frequency is less than the min for this function; "
-                           "setting to {0} instead".format(min_freq))
-            frequency = min_freq
-            in_range = False
-        # Build commands
-        command = "SOURCE{0}:FREQUENCY {1}".format(channel, frequency)
-        query = "SOURCE{0}:FREQUENCY?".format(channel)
-        result = frequency
-        out =  self._set_with_check(command=command,
-                                    query=query,
-                                    result=result,
-                                    transform=float)
-        return in_range and out
+        # Clamp to the current min and max and set
+        return self._set_numeric(channel, "frequency", frequency)
 
     def get_frequency(self, channel):
         """ Returns the channel's current frequency in Hz
@@ -247,7 +753,7 @@ class AFG2225(VisaUsbInstrument):
         # Check channel
         channel = self._check_channel(channel)
         # Return
-        return float(self.query("SOURCE{0}:FREQUENCY?".format(channel)))
+        return self._get_setting(channel, "frequency")
 
     def set_amplitude(self, channel, amplitude):
         """ Sets the channel's amplitude
@@ -274,31 +780,9 @@ class AFG2225(VisaUsbInstrument):
         :rtype: bool
         """
         # Check channel
-        channel = self._check_channel(channel=channel)
-        # Get min and max
-        min_amp = float(self.query("SOURCE{0}:AMPLITUDE? MIN".format(channel)))
-        max_amp = float(self.query("SOURCE{0}:AMPLITUDE? MAX".format(channel)))
-        # Check the amplitude and set
-        in_range = True
-        if amplitude > max_amp:
-            logger.warning("amplitude is greater than the max for the current "
-                           "settings; setting to {0}".format(max_amp))
-            amplitude = max_amp
-            in_range = False
-        elif amplitude < min_amp:
-            logger.warning("amplitude is less than the min for the current "
-                           "settings; setting to {0}".format(min_amp))
-            amplitude = min_amp
-            in_range = False
-        # Issue command
-        command = "SOURCE{0}:AMPLITUDE {1}".format(channel, amplitude)
-        query = "SOURCE{0}:AMPLITUDE?".format(channel)
-        result = amplitude
-        out = self._set_with_check(command=command,
-                                   query=query,
-                                   result=result,
-                                   transform=float)
-        return in_range and out
+        channel = self._check_channel(channel)
+        # Clamp to the current min and max and set
+        return self._set_numeric(channel, "amplitude", amplitude)
 
     def get_amplitude(self, channel):
         """ Query the channel's amplitude in units of Vpp
@@ -311,7 +795,7 @@ class AFG2225(VisaUsbInstrument):
         # Check channel
         channel = self._check_channel(channel)
         # Query
-        return float(self.query("SOURCE{0}:AMPLITUDE?".format(channel)))
+        return self._get_setting(channel, "amplitude")
 
     def set_offset(self, channel, offset):
         """ Sets the channel's DC offset
@@ -338,29 +822,8 @@ class AFG2225(VisaUsbInstrument):
         """
         # Check channel
         channel = self._check_channel(channel)
-        # Get min and max
-        min_off = float(self.query("SOURCE{0}:DCOFFSET? MIN".format(channel)))
-        max_off = float(self.query("SOURCE{0}:DCOFFSET? MAX".format(channel)))
-        # Check the offset and set
-        in_range = True
-        if offset > max_off:
-            logger.warning("offset is greater than the max for the current "
-                           "settings; setting to {0}".format(max_off))
-            offset = max_off
-            in_range = False
-        elif offset < min_off:
-            logger.warning("offset is less than the min for the current "
-                           "settings; setting to {0}".format(min_off))
-            offset = min_off
-            in_range = False
-        command = "SOURCE{0}:DCOFFSET {1}".format(channel, offset)
-        query = "SOURCE{0}:DCOFFSET?".format(channel)
-        result = offset
-        out = self._set_with_check(command=command,
-                                   query=query,
-                                   result=result,
-                                   transform=float)
-        return in_range and out
+        # Clamp to the current min and max and set
+        return self._set_numeric(channel, "offset", offset)
 
     def get_offset(self, channel):
         """ Queries the channel's current DC offset
@@ -373,7 +836,7 @@ class AFG2225(VisaUsbInstrument):
         # Check channel
         channel = self._check_channel(channel)
         # Query channel
-        return float(self.query("SOURCE{0}:DCOFFSET?".format(channel)))
+        return self._get_setting(channel, "offset")
 
     def set_square_duty(self, channel, duty):
         """ Sets the duty cycle for the square waveform
@@ -399,29 +862,8 @@ class AFG2225(VisaUsbInstrument):
         """
         # Check channel
         channel = self._check_channel(channel)
-        # Get min and max
-        min_duty = float(self.query("SOURCE{0}:SQUARE:DCYCLE? MIN".format(channel)))
-        max_duty = float(self.query("SOURCE{0}:SQUARE:DCYCLE? MAX".format(channel)))
-        # Check the offset and set
-        in_range = True
-        if duty > max_duty:
-            logger.warning("duty is greater than the max for the current "
-                           "settings; setting to {0}".format(max_duty))
-            duty = max_duty
-            in_range = False
-        elif duty < min_duty:
-            logger.warning("duty is less than the min for the current "
-                           "settings; setting to {0}".format(min_duty))
-            duty = min_duty
-            in_range = False
-        command = "SOURCE{0}:SQUARE:DCYCLE {1}".format(channel, duty)
-        query = "SOURCE{0}:SQUARE:DCYCLE?".format(channel)
-        result = duty
-        out = self._set_with_check(command=command,
-                                   query=query,
-                                   result=result,
-                                   transform=float)
-        return in_range and out
+        # Clamp to the current min and max and set
+        return self._set_numeric(channel, "square_duty", duty)
 
     def get_square_duty(self, channel):
         """ Queries the current square wave duty cycle for the specified channel
@@ -434,7 +876,7 @@ class AFG2225(VisaUsbInstrument):
         # Check channel
         channel = self._check_channel(channel)
         # Query
-        return float(self.query("SOURCE{0}:SQUARE:DCYCLE?".format(channel)))
+        return self._get_setting(channel, "square_duty")
 
     def set_ramp_symmetry(self, channel, symmetry):
         """ Sets the symmetry parameter for the ramp waveform
@@ -455,29 +897,8 @@ class AFG2225(VisaUsbInstrument):
         """
         # Check channel
         channel = self._check_channel(channel)
-        # Get min and max
-        min_sym = float(self.query("SOURCE{0}:RAMP:SYMMETRY? MIN".format(channel)))
-        max_sym = float(self.query("SOURCE{0}:RAMP:SYMMETRY? MAX".format(channel)))
-        # Check the offset and set
-        in_range = True
-        if symmetry > max_sym:
-            logger.warning("symmetry is greater than the max for the current "
-                           "settings; setting to {0}".format(max_sym))
-            symmetry = max_sym
-            in_range = False
-        elif symmetry < min_sym:
-            logger.warning("symmetry is less than the min for the current "
-                           "settings; setting to {0}".format(min_sym))
-            symmetry = min_sym
-            in_range = False
-        command = "SOURCE{0}:RAMP:SYMMETRY {1}".format(channel, symmetry)
-        query = "SOURCE{0}:RAMP:SYMMETRY?".format(channel)
-        result = symmetry
-        out =  self._set_with_check(command=command,
-                                    query=query,
-                                    result=result,
-                                    transform=float)
-        return in_range and out
+        # Clamp to the current min and max and set
+        return self._set_numeric(channel, "ramp_symmetry", symmetry)
 
     def get_ramp_symmetry(self, channel):
         """ Queries the current ramp symmetry for the specified channel
@@ -490,7 +911,7 @@ class AFG2225(VisaUsbInstrument):
         # Check channel
         channel = self._check_channel(channel)
         # Query
-        return float(self.query("SOURCE{0}:RAMP:SYMMETRY?".format(channel)))
+        return self._get_setting(channel, "ramp_symmetry")
 
     def set_phase(self, channel, phase):
         """ Sets the phase of the specified channel
@@ -507,29 +928,8 @@ class AFG2225(VisaUsbInstrument):
         """
         # Check channel
         channel = self._check_channel(channel)
-        # Get min and max
-        min_phase = float(self.query("SOURCE{0}:PHASE? MIN".format(channel)))
-        max_phase = float(self.query("SOURCE{0}:PHASE? MAX".format(channel)))
-        # Check the phase and set
-        in_range = True
-        if phase > max_phase:
-            logger.warning("phase is greater than the max for the current "
-                           "settings; setting to {0}".format(max_phase))
-            phase = max_phase
-            in_range = False
-        elif phase < min_phase:
-            logger.warning("phase is less than the min for the current "
-                           "settings; setting to {0}".format(min_phase))
-            phase = min_phase
-            in_range = False
-        command = "SOURCE{0}:PHASE {1}".format(channel, phase)
-        query = "SOURCE{0}:PHASE?".format(channel)
-        result = phase
-        out =  self._set_with_check(command=command,
-                                    query=query,
-                                    result=result,
-                                    transform=float)
-        return in_range and out
+        # Clamp to the current min and max and set
+        return self._set_numeric(channel, "phase", phase)
 
     def get_phase(self, channel):
         """ Queries the phase setting of the specified channel
@@ -542,27 +942,19 @@ class AFG2225(VisaUsbInstrument):
         # Check channel
         channel = self._check_channel(channel)
         # Query
-        return float(self.query("SOURCE{0}:PHASE?".format(channel)))
+        return self._get_setting(channel, "phase")
 
     ###########################################################################
     # Set/Get Interface Properties
     ###########################################################################
-    def set_output_onoff(self, channel, on_off):
-        """ Switches the output on or off
+    def _output_onoff_commands(self, channel, on_off):
+        """ Returns the command, query and expected result for `set_output_onoff`
 
-        `on_off` can be the strings "ON" or "OFF" or a 0 or 1.  Any other
-        value will be evaluated with bool(), used to set the output to on for
-        true/off for false, and raise a warning.
+        The arguments are validated as described in `set_output_onoff`.
 
-        :param channel: The channel whose output will be switched
-        :param on_off: "ON" or "OFF", 0 or 1
-        :type channel: int
-        :type on_off: str or int
-        :return: True if set, False if not
-        :rtype: bool
+        :return: (command, query, result) for `_set_with_check`
+        :rtype: (str, str, str)
         """
-        # Check channel
-        channel = self._check_channel(channel)
         # Parse on_off
         if type(on_off) is str:
             on_off = on_off.upper()
@@ -591,9 +983,26 @@ class AFG2225(VisaUsbInstrument):
             command = "OUTPUT{0} OFF".format(channel)
             query = "OUTPUT{0}?".format(channel)
             result = '0'
-        return self._set_with_check(command=command,
-                                    query=query,
-                                    result=result)
+        return command, query, result
+
+    def set_output_onoff(self, channel, on_off):
+        """ Switches the output on or off
+
+        `on_off` can be the strings "ON" or "OFF" or a 0 or 1.  Any other
+        value will be evaluated with bool(), used to set the output to on for
+        true/off for false, and raise a warning.
+
+        :param channel: The channel whose output will be switched
+        :param on_off: "ON" or "OFF", 0 or 1
+        :type channel: int
+        :type on_off: str or int
+        :return: True if set, False if not
+        :rtype: bool
+        """
+        # Check channel
+        channel = self._check_channel(channel)
+        commands = self._output_onoff_commands(channel, on_off)
+        return self._set_setting(channel, "output_onoff", *commands)
 
     def get_output_onoff(self, channel):
         """ Queries the output state of the specified channel
@@ -606,24 +1015,16 @@ class AFG2225(VisaUsbInstrument):
         # Check channel
         channel = self._check_channel(channel)
         # Get value and parse
-        return bool(int(self.query("OUTPUT{0}?".format(channel))))
+        return self._get_setting(channel, "output_onoff")
 
-    def set_output_load(self, channel, load):
-        """ Sets the output load to 50 Ohm or infinite for the specified channel
+    def _output_load_commands(self, channel, load):
+        """ Returns the command, query and expected result for `set_output_load`
 
-        Valid inputs for load are
-          - 50 Ohm (Low Z): '50', 'FIFTY', 'DEF', 'DEFAULT', 'LOWZ', 'LZ'
-          - High Z: 'HZ', 'HIGHZ', 'INF', 'INFINITE'
+        The arguments are validated as described in `set_output_load`.
 
-        :param channel: The channel whose load will be set
-        :param load: The desired load (see above for valid inputs)
-        :type channel: int
-        :type load: str or int
-        :return: True if set, False if not
-        :rtype: bool
+        :return: (command, query, result) for `_set_with_check`
+        :rtype: (str, str, str)
         """
-        # Check channel
-        channel = self._check_channel(channel)
         # Possible inputs
         inputs = {"HZ": "INF",
                   "HIGHZ": "INF",
@@ -665,9 +1066,26 @@ class AFG2225(VisaUsbInstrument):
             command = "OUTPUT{0}:LOAD DEFAULT".format(channel)
             query = "OUTPUT{0}:LOAD?".format(channel)
             result = inputs[load]
-        return self._set_with_check(command=command,
-                                    query=query,
-                                    result=result)
+        return command, query, result
+
+    def set_output_load(self, channel, load):
+        """ Sets the output load to 50 Ohm or infinite for the specified channel
+
+        Valid inputs for load are
+          - 50 Ohm (Low Z): '50', 'FIFTY', 'DEF', 'DEFAULT', 'LOWZ', 'LZ'
+          - High Z: 'HZ', 'HIGHZ', 'INF', 'INFINITE'
+
+        :param channel: The channel whose load will be set
+        :param load: The desired load (see above for valid inputs)
+        :type channel: int
+        :type load: str or int
+        :return: True if set, False if not
+        :rtype: bool
+        """
+        # Check channel
+        channel = self._check_channel(channel)
+        commands = self._output_load_commands(channel, load)
+        return self._set_setting(channel, "output_load", *commands)
 
     def get_output_load(self, channel):
         """ Queries the current output load
@@ -684,20 +1102,16 @@ class AFG2225(VisaUsbInstrument):
         # Check channel
         channel = self._check_channel(channel)
         # Query
-        return self.query("OUTPUT{0}:LOAD?".format(channel))
+        return self._get_setting(channel, "output_load")
 
-    def set_voltageunits(self, channel, unit='VPP'):
-        """ Sets the current units used to specify the voltage
+    def _voltageunits_commands(self, channel, unit='VPP'):
+        """ Returns the command, query and expected result for `set_voltageunits`
 
-        :param channel: The channel whose units will be set
-        :param unit: One of ['VPP', 'VRMS', 'DBM']
-        :type channel: int
-        :type unit: str
-        :return: True if set, False if not
-        :rtype: bool
+        The arguments are validated as described in `set_voltageunits`.
+
+        :return: (command, query, result) for `_set_with_check`
+        :rtype: (str, str, str)
         """
-        # Check channel
-        channel = self._check_channel(channel)
         # Check unit
         unit = unit.upper()
         unit_list = ['VPP', 'VRMS', 'DBM']
@@ -713,9 +1127,22 @@ class AFG2225(VisaUsbInstrument):
         command = "SOURCE{0}:VOLTAGE:UNIT {1}".format(channel, unit)
         query = "SOURCE{0}:VOLTAGE:UNIT?".format(channel)
         result = unit
-        return self._set_with_check(command=command,
-                                    query=query,
-                                    result=result)
+        return command, query, result
+
+    def set_voltageunits(self, channel, unit='VPP'):
+        """ Sets the current units used to specify the voltage
+
+        :param channel: The channel whose units will be set
+        :param unit: One of ['VPP', 'VRMS', 'DBM']
+        :type channel: int
+        :type unit: str
+        :return: True if set, False if not
+        :rtype: bool
+        """
+        # Check channel
+        channel = self._check_channel(channel)
+        commands = self._voltageunits_commands(channel, unit)
+        return self._set_setting(channel, "voltageunits", *commands)
 
     def get_voltageunits(self, channel):
         """ Queries the channel's current voltage unit
@@ -728,7 +1155,7 @@ class AFG2225(VisaUsbInstrument):
         # Check channel
         channel = self._check_channel(channel)
         # Query channel
-        return self.query("SOURCE{0}:VOLTAGE:UNIT?".format(channel))
+        return self._get_setting(channel, "voltageunits")
 
     ###########################################################################
     # Composite Methods
@@ -772,13 +1199,20 @@ class AFG2225(VisaUsbInstrument):
         return it_worked
 
     def set_wave(self, channel, wavetype=None, frequency=None, amplitude=None,
-                 offset=None, symmetry=None, duty=None, phase=None):
+                 offset=None, symmetry=None, duty=None, phase=None, fast=True):
         """ Composite function to set all key output function parameters
 
         Any parameters left as `None` will not be changed from the current
         state.  Note that many of the parameters are only valid for some
         wavetypes.
 
+        By default the wavetype, frequency, amplitude and offset are applied
+        with a single `SOURCE<n>:APPLY:<shape>` command, sent in the same
+        transfer as the duty, symmetry and phase commands, and all of the
+        parameters are verified with one compound read-back.  Only the
+        parameters which fail verification are then set again one at a time.
+        Set `fast` to False to set each parameter with its own setter.
+
         :param channel: 1 or 2
         :param wavetype: 'SIN', 'SQUARE', 'RAMP', 'PULSE', 'NOISE', 'USER'
         :param frequency: unit is Hertz, minimum is 1e-6, max is 25e6
@@ -787,6 +1221,7 @@ class AFG2225(VisaUsbInstrument):
         :param symmetry: unit is percent, only for ramp wave, 0-100
         :param duty: unit is percent, only for square wave, 1-99
         :param phase: unit is degrees, -180 - 180
+        :param fast: Whether to use the single-command path
         :type channel: int
         :type wavetype: str
         :type frequency: float
@@ -795,11 +1230,17 @@ class AFG2225(VisaUsbInstrument):
         :type symmetry: float
         :type duty: float
         :type phase: float
+        :type fast: bool
         :return: True if set, False if not
         :rtype: bool
         """
         # Check channel
         channel = self._check_channel(channel)
+        if fast:
+            params = zip(self._WAVE_ORDER, (wavetype, frequency, amplitude,
+                                            offset, duty, symmetry, phase))
+            params = {name: value for name, value in params if value is not None}
+            return self._set_wave_fast(channel, params)
         # Issue commands
         it_worked = True
         if wavetype is not None:
@@ -824,3 +1265,250 @@ class AFG2225(VisaUsbInstrument):
             out = self.set_phase(channel, phase)
             it_worked = it_worked and out
         return it_worked
+
+    def _wave_batch(self, channel, params):
+        """ Builds the commands and read-back checks which apply `params`
+
+        The wavetype, frequency, amplitude and offset are combined into one
+        APPLY command, filling in the current values of any that are not
+        given.  Values are clamped locally when their limits are cached.
+
+        :param channel: The channel (1 or 2)
+        :param params: dictionary of {setting: value} with the names of `_WAVE_ORDER`
+        :type channel: int
+        :type params: dict
+        :return: (commands, checks, in_range) for `_write_and_verify`
+        :rtype: (list, list, bool)
+        """
+        params = dict(params)
+        commands = []
+        in_range = True
+        # Determine the target wavetype and the key of its limits
+        if "wavetype" in params:
+            params["wavetype"] = self._wavetype_commands(channel, params["wavetype"])[2]
+        applied = [name for name in ("frequency", "amplitude", "offset")
+                   if name in params]
+        if "wavetype" in params or applied:
+            wave = params.get("wavetype")
+            if wave is None:
+                wave = self._get_setting(channel, "wavetype")
+            key = self._limit_key(channel, self.shadow_ttl)
+            if key is not None:
+                key = (wave,) + key[1:]
+        else:
+            wave, key = None, None
+        # Clamp the numeric values whose limits are known
+        for name in self._WAVE_ORDER[1:]:
+            if name not in params or key is None or not self.cache_limits:
+                continue
+            if any(name in self._LIMIT_DEPENDENCIES.get(other, ())
+                   for other in params):
+                # The limits will change with the other setting
+                continue
+            limits = self._limits.get((channel, name) + key)
+            if limits is not None:
+                params[name], ok = self._clamp(name.replace("_", " "), params[name], *limits)
+                in_range = in_range and ok
+        for name in self._WAVE_ORDER[1:]:
+            if name in params:
+                params[name] = float(params[name])
+        # Build the commands
+        shape = self._APPLY_SHAPES.get(wave)
+        if shape is not None:
+            current = self._get_settings(channel, [name for name in
+                                                   ("frequency", "amplitude", "offset")
+                                                   if name not in params])
+            values = [params.get(name, current.get(name))
+                      for name in ("frequency", "amplitude", "offset")]
+            commands.append("SOURCE{0}:APPLY:{1} {2},{3},{4}".format(channel, shape, *values))
+            individual = [name for name in self._WAVE_ORDER[4:] if name in params]
+        else:
+            if "wavetype" in params:
+                commands.append("SOURCE{0}:FUNCTION {1}".format(channel, params["wavetype"]))
+            individual = [name for name in self._WAVE_ORDER[1:] if name in params]
+        for name in individual:
+            commands.append("SOURCE{0}:{1} {2}".format(channel, self._NUMERIC_HEADERS[name],
+                                                       params[name]))
+        checks = [(channel, name, params[name]) for name in self._WAVE_ORDER
+                  if name in params]
+        return commands, checks, in_range
+
+    def _set_wave_fast(self, channel, params):
+        """ Applies waveform settings in one transfer and verifies them in one
+
+        Settings which fail verification are set again with their individual
+        setters.
+
+        :param channel: The channel (1 or 2)
+        :param params: dictionary of {setting: value} with the names of `_WAVE_ORDER`
+        :type channel: int
+        :type params: dict
+        :return: True if set, False if not
+        :rtype: bool
+        """
+        if not params:
+            return True
+        commands, checks, in_range = self._wave_batch(channel, params)
+        results = self._write_and_verify(commands, checks)
+        return self._retry_failed(results, {channel: params}) and in_range
+
+    def _retry_failed(self, results, params):
+        """ Sets the settings which failed a batched verification one by one
+
+        :param results: The output of `_write_and_verify`
+        :param params: dictionary of {channel: {setting: requested value}}
+        :type results: dict
+        :type params: dict
+        :return: True if all settings were set
+        :rtype: bool
+        """
+        it_worked = True
+        for (channel, name), ok in results.items():
+            if ok:
+                continue
+            logger.info("Channel {0} {1} did not verify after the batched set; "
+                        "setting it individually".format(channel, name))
+            out = getattr(self, "set_" + name)(channel, params[channel][name])
+            it_worked = it_worked and out
+        return it_worked
+
+    def _dual_batch(self, waves, on_off=None, sync_phase=False):
+        """ Builds the commands and read-back checks for `set_waves`
+
+        :return: (commands, checks, params, in_range) where params is {channel: {setting: value}}
+        :rtype: (list, list, dict, bool)
+        """
+        names = {"wavetype": "wavetype", "frequency": "frequency",
+                 "amplitude": "amplitude", "offset": "offset",
+                 "symmetry": "ramp_symmetry", "duty": "square_duty",
+                 "phase": "phase"}
+        commands = []
+        checks = []
+        params = {}
+        in_range = True
+        for channel in sorted(waves):
+            channel = self._check_channel(channel)
+            unknown = set(waves[channel]) - set(names)
+            if unknown:
+                raise ValueError("unknown waveform settings: {0}".format(
+                    ", ".join(sorted(unknown))))
+            params[channel] = {names[key]: value for key, value in waves[channel].items()
+                               if value is not None}
+            if params[channel]:
+                channel_commands, channel_checks, ok = self._wave_batch(channel,
+                                                                        params[channel])
+                commands += channel_commands
+                checks += channel_checks
+                in_range = in_range and ok
+        if sync_phase:
+            commands.append("SOURCE1:PHASE:SYNCHRONIZE")
+        if on_off is not None:
+            # Switching the outputs last, in the same transfer, enables them together
+            for channel in sorted(params):
+                command, query, result = self._output_onoff_commands(channel, on_off)
+                commands.append(command)
+                params[channel]["output_onoff"] = result == "1"
+                checks.append((channel, "output_onoff", result == "1"))
+        return commands, checks, params, in_range
+
+    def set_waves(self, waves, on_off=None, sync_phase=False):
+        """ Configures both channels with one transfer and one read-back
+
+        `waves` maps each channel to a dictionary of the keyword arguments of
+        `set_wave` (wavetype, frequency, amplitude, offset, symmetry, duty and
+        phase).  The commands for all of the channels are sent in a single
+        compound command, followed by the phase synchronization (if
+        `sync_phase` is True) and the output switching (if `on_off` is given),
+        so that the outputs change state together.  Everything is then
+        verified with one compound read-back and only the settings which fail
+        are set again individually.
+
+        For example, quadrature outputs at 1 kHz::
+
+            afg.set_waves({1: dict(wavetype='SIN', frequency=1e3, phase=0),
+                           2: dict(wavetype='SIN', frequency=1e3, phase=90)},
+                          on_off='ON', sync_phase=True)
+
+        :param waves: dictionary of {channel: {setting: value}}
+        :param on_off: 'ON' or 'OFF' to switch the outputs of the channels in `waves`
+        :param sync_phase: Whether to synchronize the phases of the two channels
+        :type waves: dict
+        :type on_off: str
+        :type sync_phase: bool
+        :return: True if set, False if not
+        :rtype: bool
+        """
+        commands, checks, params, in_range = self._dual_batch(waves, on_off, sync_phase)
+        if not commands:
+            return True
+        if not checks:
+            self.write(";:".join(commands))
+            return True
+        results = self._write_and_verify(commands, checks)
+        return self._retry_failed(results, params) and in_range
+
+    ###########################################################################
+    # Arbitrary Waveforms
+    ###########################################################################
+    def upload_arb(self, data, start=0, scale=True):
+        """ Loads waveform data into the volatile arbitrary waveform memory
+
+        The data is quantized to the 10-bit DAC codes (-511 to 511) with
+        `waveform.quantize` and sent as a binary block.  The driver remembers
+        the content hash of every waveform it has loaded, so if identical data
+        is already in memory it is not sent again and its existing location is
+        returned instead of `start`.
+
+        :param data: The waveform samples, 2 to 4096 of them
+        :param start: The memory address at which to load the waveform
+        :param scale: Whether to scale the data to the full DAC range; if False it should be between -1 and 1
+        :type data: np.ndarray
+        :type start: int
+        :type scale: bool
+        :return: (start, length) of the waveform in memory
+        :rtype: (int, int)
+        """
+        codes = waveform.quantize(data, self._ARB_FULL_SCALE, '>i2',
+                                  max_length=self._ARB_LENGTH, scale=scale)
+        key = waveform.digest(codes)
+        if key in self._arb_memory:
+            logger.debug('Waveform {0} is already in memory'.format(key))
+            return self._arb_memory[key]
+        length = len(codes)
+        if not 0 <= start <= self._ARB_LENGTH - length:
+            raise ValueError('the waveform does not fit in memory at address '
+                             '{0}'.format(start))
+        # Forget the waveforms which are about to be overwritten
+        for other, (other_start, other_length) in list(self._arb_memory.items()):
+            if other_start < start + length and start < other_start + other_length:
+                del self._arb_memory[other]
+        message = "DATA:DAC VOLATILE,{0},".format(start).encode('ascii')
+        message += waveform.binary_block(codes.tobytes())
+        self.write_raw(message + self.device.write_termination.encode('ascii'))
+        self.check_errors(raise_on_error=True)
+        self._arb_memory[key] = (start, length)
+        return start, length
+
+    def set_arb(self, channel, data, start=0, scale=True):
+        """ Outputs an arbitrary waveform on the channel
+
+        The waveform is loaded with `upload_arb` (unless it is already in
+        memory), selected with `SOURCE<n>:ARB:OUTPUT` and the channel's
+        function is set to USER.  The frequency, amplitude and offset of the
+        channel apply to the waveform as usual.
+
+        :param channel: The channel to set (1 or 2)
+        :param data: The waveform samples, 2 to 4096 of them
+        :param start: The memory address at which to load the waveform
+        :param scale: Whether to scale the data to the full DAC range; if False it should be between -1 and 1
+        :type channel: int
+        :type data: np.ndarray
+        :type start: int
+        :type scale: bool
+        :return: True if set, False if not
+        :rtype: bool
+        """
+        channel = self._check_channel(channel)
+        start, length = self.upload_arb(data, start=start, scale=scale)
+        self.write("SOURCE{0}:ARB:OUTPUT {1},{2}".format(channel, start, length))
+        return self.set_wavetype(channel, "USER")
@@ -7,10 +7,11 @@ Note that the relays only understand ascii (latin_1) encoded messages.  Read the
 details.
 """
 
-from time import sleep
 import logging
 import warnings
 import pyvisa
+from labchat import tracing
+from labchat.tracing import sleep
 
 __email__ = "chrisark7@gmail.com"
 __status__ = "Development"
@@ -21,16 +22,27 @@ logger = logging.getLogger(__name__)
 class Relay(object):
     """ A class for working with the National Control Dynamics R120HPRS switching relay.
     """
-    def __init__(self, port, timeout=2):
+    def __init__(self, port, timeout=2, resource_manager=None):
         """
 
+        The `resource_manager` argument can be used to supply an object other than
+        `pyvisa.ResourceManager()` to open the port, such as the `SimResourceManager` in the
+        `labchat.simulator` module.
+
         :param port: The name of the port to which the NCD device is connected
+        :param timeout: The timeout value to use with the device in seconds
+        :param resource_manager: The resource manager used to open the port
         :type port: str
+        :type timeout: int or float
+        :type resource_manager: pyvisa.ResourceManager
         :return: An instance of the Relay class
         :rtype: Relay
         """
         # Create resource manager
-        rm = pyvisa.ResourceManager()
+        if resource_manager is None:
+            rm = pyvisa.ResourceManager()
+        else:
+            rm = resource_manager
         # Parse the port
         if type(port) is str:
             if port[0:3].upper() == 'COM':
@@ -79,6 +91,7 @@ class Relay(object):
         self.device.close()
         self.is_open = False
 
+    @tracing.traced('write')
     def write(self, code):
         """ Sends a code to the device.
 
@@ -98,6 +111,7 @@ class Relay(object):
         # Send command
         self.device.write_raw(chr(code).encode(encoding='latin_1'))
 
+    @tracing.traced('read')
     def read(self):
         """ Reads a message from the device one byte at a time
 
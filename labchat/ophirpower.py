@@ -21,9 +21,10 @@ to Python 3.
 
 # modules
 import win32com.client
-from time import sleep
 import logging
 from collections import Counter
+from labchat import tracing
+from labchat.tracing import sleep
 
 __email__ = "chrisark7@gmail.com"
 __status__ = "Development"
@@ -65,7 +66,8 @@ class OphirCOM(object):
         self.measurement_running = False
         # Connect to activeX class and store module in adwin_ax
         logger.info("Try to connect to ActiveX component..")
-        self.USBI_com = win32com.client.Dispatch("OphirLMMeasurement.CoLMMeasurement")
+        self.USBI_com = tracing.TracedObject(
+            win32com.client.Dispatch("OphirLMMeasurement.CoLMMeasurement"), 'OphirCOM')
         logger.info("..success")
         logger.info("COM Version: {0}".format(self.USBI_com.GetVersion()))
 
@@ -0,0 +1,121 @@
+""" Pacing of the commands sent to an instrument
+
+Some instruments drop commands which arrive too soon after the previous
+transfer, so drivers such as `BKFunGen` used to sleep for a fixed time before
+every write.  A `Pacer` instead enforces a minimum gap measured from the end
+of the previous transfer: a command issued after the instrument has been idle
+for longer than the gap is sent at once, and only commands issued back to
+back wait for the remainder of the gap.  The gap can be measured for a
+particular instrument with `Pacer.calibrate`.
+
+`Pacer.read` replaces read-sleep-retry loops with a single read which waits
+for the message terminator for up to a given time, so a late reply is
+returned as soon as it arrives instead of after a fixed pause.
+
+Example::
+
+    pacer = Pacer(min_gap=0.1)
+    pacer.wait()
+    device.write('C1:OUTPUT ON')
+    pacer.mark()
+    reply = pacer.read(device, timeout=1.0)
+"""
+
+import logging
+import time
+import visa
+from labchat import tracing
+
+__email__ = "chrisark7@gmail.com"
+__status__ = "Development"
+
+logger = logging.getLogger(__name__)
+
+# Gaps tried by `Pacer.calibrate` in seconds
+CALIBRATION_GAPS = (0, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2)
+
+
+class Pacer(object):
+    """ Enforces a minimum gap between the transfers to one instrument
+    """
+    def __init__(self, min_gap=0.0):
+        """ The constructor for the Pacer class
+
+        :param min_gap: The minimum time in seconds between the end of one transfer and the next command
+        :type min_gap: float
+        """
+        if min_gap < 0:
+            raise ValueError('min_gap should not be negative')
+        self.min_gap = min_gap
+        self._last = float('-inf')
+
+    def __repr__(self):
+        return '{0}(min_gap={1!r})'.format(type(self).__name__, self.min_gap)
+
+    def wait(self):
+        """ Waits until the minimum gap since the last transfer has passed
+
+        :return: The time waited in seconds
+        :rtype: float
+        """
+        remaining = self._last + self.min_gap - time.perf_counter()
+        if remaining > 0:
+            tracing.sleep(remaining)
+            return remaining
+        return 0.0
+
+    def mark(self):
+        """ Records the end of a transfer
+        """
+        self._last = time.perf_counter()
+
+    def read(self, device, timeout):
+        """ Reads one message, waiting up to `timeout` seconds for its terminator
+
+        The device timeout is changed for the duration of the read only.
+
+        :param device: The pyvisa resource to read from
+        :param timeout: The longest time to wait for the message in seconds
+        :type timeout: float
+        :return: The message, or None if nothing arrived in time
+        :rtype: str
+        """
+        previous = device.timeout
+        device.timeout = timeout * 1e3
+        try:
+            return device.read()
+        except visa.VisaIOError:
+            return None
+        finally:
+            device.timeout = previous
+            self.mark()
+
+    def calibrate(self, probe, gaps=CALIBRATION_GAPS, trials=3, margin=1.5):
+        """ Sets `min_gap` to the smallest gap at which `probe` succeeds
+
+        Each gap in `gaps` (in increasing order) is tried in turn by calling
+        `probe` `trials` times.  `probe` should exchange a few commands with
+        the instrument back to back and return True if they all worked.  The
+        first gap for which every trial succeeds, multiplied by `margin`, is
+        kept.  If no gap works, the largest is kept and a warning is logged.
+
+        :param probe: A function of no arguments returning True on success
+        :param gaps: The gaps to try in seconds
+        :param trials: The number of probes at each gap
+        :param margin: The factor applied to the gap found
+        :type probe: callable
+        :type gaps: list of float
+        :type trials: int
+        :type margin: float
+        :return: The new minimum gap in seconds
+        :rtype: float
+        """
+        for gap in sorted(gaps):
+            self.min_gap = gap
+            if all(probe() for _ in range(trials)):
+                self.min_gap = gap * margin
+                logger.info('Calibrated the command gap to {0:.1f} ms'.format(
+                    self.min_gap * 1e3))
+                return self.min_gap
+        logger.warning('Probe failed at every gap; keeping {0} s'.format(self.min_gap))
+        return self.min_gap
@@ -0,0 +1,422 @@
+""" A local server which shares instruments between processes
+
+A VISA or serial resource can only be opened by one process at a time.  The
+`InstrumentServer` owns the instrument connections and serves requests from
+any number of client processes over a Unix domain socket.  Calls to each
+instrument are serialized through an `InstrumentWorker`, read-only calls are
+cached for a short time, and identical read-only calls which arrive while
+one is already in progress share its result instead of being sent to the
+instrument again.
+
+On the client side `InstrumentClient` is a proxy with the same method API as
+the driver class it stands in for::
+
+    # in the server process
+    server = InstrumentServer('/tmp/labchat.sock', {'scope': scope})
+    server.serve_forever()
+
+    # in any client process
+    scope = InstrumentClient('/tmp/labchat.sock', 'scope')
+    times, data = scope.get_data(1)
+
+The server can also be started from the command line, e.g.::
+
+    python -m labchat.server /tmp/labchat.sock scope=tekscope.Scope:0 \\
+        relay=ncdrelay.Relay:ASRL1::INSTR --open
+
+Messages are pickled, so the socket is created with mode 0600 and must only
+be reachable by the user running the server.
+"""
+
+import argparse
+import importlib
+import inspect
+import logging
+import os
+import pickle
+import socket
+import socketserver
+import stat
+import struct
+import threading
+import time
+from labchat.worker import InstrumentWorker, NORMAL
+
+__email__ = "chrisark7@gmail.com"
+__status__ = "Development"
+
+logger = logging.getLogger(__name__)
+
+_HEADER = struct.Struct('>I')
+
+
+###############################################################################
+# Message Framing
+###############################################################################
+def _send(sock, obj):
+    data = pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+    sock.sendall(_HEADER.pack(len(data)) + data)
+
+
+def _recv_exactly(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(min(size, 1 << 20))
+        if not chunk:
+            raise EOFError('connection closed')
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def _recv(sock):
+    size, = _HEADER.unpack(_recv_exactly(sock, _HEADER.size))
+    return pickle.loads(_recv_exactly(sock, size))
+
+
+###############################################################################
+# Server
+###############################################################################
+def is_read_only(method, args, kwargs):
+    """ The default rule for which calls may be cached and coalesced
+
+    Methods whose names start with 'get_' or 'measure', and `query` calls
+    whose command contains a '?', are considered read-only.
+
+    :param method: The name of the method
+    :param args: The positional arguments of the call
+    :param kwargs: The keyword arguments of the call
+    :type method: str
+    :type args: tuple
+    :type kwargs: dict
+    :return: True if the call does not change the instrument state
+    :rtype: bool
+    """
+    if method.startswith('get_') or method.startswith('measure'):
+        return True
+    if method == 'query':
+        command = args[0] if args else kwargs.get('command', '')
+        return isinstance(command, str) and '?' in command
+    return False
+
+
+class _ManagedInstrument(object):
+    """ The worker, cache and in-flight calls of one served instrument
+    """
+    def __init__(self, name, instrument):
+        self.name = name
+        self.instrument = instrument
+        self.worker = InstrumentWorker(instrument,
+                                       name='labchat-server-{0}'.format(name))
+        self.lock = threading.Lock()
+        self.generation = 0
+        self.cache = {}
+        self.in_flight = {}
+
+
+class InstrumentServer(socketserver.ThreadingMixIn,
+                       socketserver.UnixStreamServer):
+    """ Serves a set of instruments to client processes over a Unix socket
+
+    Each client connection is handled on its own thread, and each instrument
+    has its own worker thread so that calls to different instruments run
+    concurrently.
+    """
+    daemon_threads = True
+
+    def __init__(self, path, instruments, cache_ttl=0.5,
+                 read_only=is_read_only):
+        """ The constructor for the InstrumentServer class
+
+        :param path: The filesystem path of the Unix socket
+        :param instruments: A mapping from names to driver instances
+        :param cache_ttl: The time in seconds for which read-only results are reused
+        :param read_only: A function (method, args, kwargs) -> bool marking cacheable calls
+        :type path: str
+        :type instruments: dict
+        :type cache_ttl: float
+        :type read_only: callable
+        """
+        self.path = path
+        self.cache_ttl = cache_ttl
+        self.read_only = read_only
+        self.instruments = {name: _ManagedInstrument(name, inst)
+                            for name, inst in instruments.items()}
+        if os.path.exists(path):
+            if not stat.S_ISSOCK(os.stat(path).st_mode):
+                raise IOError('{0} exists and is not a socket'.format(path))
+            os.remove(path)
+        old_umask = os.umask(0o177)
+        try:
+            socketserver.UnixStreamServer.__init__(self, path, _Handler)
+        finally:
+            os.umask(old_umask)
+        os.chmod(path, 0o600)
+        logger.info('Serving {0} on {1}'.format(sorted(self.instruments), path))
+
+    def server_close(self):
+        socketserver.UnixStreamServer.server_close(self)
+        for managed in self.instruments.values():
+            managed.worker.shutdown(wait=False)
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def dispatch(self, name, method, args, kwargs):
+        """ Runs a call on the named instrument and returns its result
+
+        Read-only calls are answered from the cache if an identical call
+        finished less than `cache_ttl` seconds ago, and wait for an identical
+        call already in progress instead of issuing a new one.  Any other
+        call invalidates the instrument's cache and starts a new generation;
+        read-only calls queued in an earlier generation are neither cached
+        nor shared with later callers.
+
+        :param name: The name of the instrument
+        :param method: The name of the method to call
+        :param args: The positional arguments
+        :param kwargs: The keyword arguments
+        :type name: str
+        :type method: str
+        :type args: tuple
+        :type kwargs: dict
+        :return: The result of the call
+        """
+        try:
+            managed = self.instruments[name]
+        except KeyError:
+            raise KeyError('no instrument named {0!r}'.format(name))
+        if method.startswith('_'):
+            raise AttributeError('private method {0!r} cannot be called '
+                                 'remotely'.format(method))
+        func = getattr(managed.instrument, method)
+        if not self.read_only(method, args, kwargs):
+            # The write is queued under the lock, so every read queued after
+            # the new generation starts also runs after the write
+            with managed.lock:
+                managed.generation += 1
+                managed.cache.clear()
+                managed.in_flight.clear()
+                future = managed.worker.submit_priority(NORMAL, func, *args,
+                                                        **kwargs)
+            return future.result()
+        key = pickle.dumps((method, args, sorted(kwargs.items())))
+        with managed.lock:
+            cached = managed.cache.get(key)
+            if cached is not None and time.monotonic() - cached[0] < self.cache_ttl:
+                return cached[1]
+            future = managed.in_flight.get(key)
+            if future is None:
+                generation = managed.generation
+                future = managed.worker.submit(func, *args, **kwargs)
+                managed.in_flight[key] = future
+                future.add_done_callback(
+                    lambda f: self._finish(managed, key, generation, f))
+        return future.result()
+
+    @staticmethod
+    def _finish(managed, key, generation, future):
+        with managed.lock:
+            if managed.in_flight.get(key) is future:
+                del managed.in_flight[key]
+            if generation != managed.generation:
+                return
+            if not future.cancelled() and future.exception() is None:
+                managed.cache[key] = (time.monotonic(), future.result())
+
+    def get_attribute(self, name, attr):
+        """ Returns a public attribute of the named instrument
+        """
+        if attr.startswith('_'):
+            raise AttributeError('private attribute {0!r} cannot be read '
+                                 'remotely'.format(attr))
+        managed = self.instruments[name]
+        return managed.worker.submit(getattr, managed.instrument, attr).result()
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    """ Handles the requests of one client connection
+    """
+    def handle(self):
+        server = self.server
+        while True:
+            try:
+                request = _recv(self.request)
+            except (EOFError, ConnectionError):
+                return
+            kind, name, method, args, kwargs = request
+            try:
+                if kind == 'call':
+                    value = server.dispatch(name, method, args, kwargs)
+                elif kind == 'getattr':
+                    value = server.get_attribute(name, method)
+                elif kind == 'list':
+                    value = {key: type(managed.instrument).__name__
+                             for key, managed in server.instruments.items()}
+                else:
+                    raise ValueError('unknown request {0!r}'.format(kind))
+                response = (True, value)
+            except Exception as e:
+                response = (False, e)
+            try:
+                _send(self.request, response)
+            except pickle.PicklingError as e:
+                _send(self.request, (False, TypeError(
+                    'result could not be pickled: {0}'.format(e))))
+            except (ConnectionError, OSError):
+                return
+
+
+###############################################################################
+# Client
+###############################################################################
+class ServerConnection(object):
+    """ A connection to an InstrumentServer
+
+    The connection may be shared between threads; requests are sent one at a
+    time.
+    """
+    def __init__(self, path, timeout=None):
+        """ The constructor for the ServerConnection class
+
+        :param path: The filesystem path of the server's Unix socket
+        :param timeout: A socket timeout in seconds, None to wait forever
+        :type path: str
+        :type timeout: float
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.settimeout(timeout)
+        self._sock.connect(path)
+
+    def request(self, kind, name=None, method=None, args=(), kwargs=None):
+        """ Sends a request to the server and returns the result
+
+        Exceptions raised on the server are raised again in the client.
+        """
+        with self._lock:
+            _send(self._sock, (kind, name, method, tuple(args), kwargs or {}))
+            ok, value = _recv(self._sock)
+        if not ok:
+            raise value
+        return value
+
+    def list_instruments(self):
+        """ Returns a dictionary of the served instrument names and classes
+        """
+        return self.request('list')
+
+    def instrument(self, name):
+        """ Returns a proxy for the named instrument
+        """
+        return InstrumentClient(self, name)
+
+    def close(self):
+        """ Closes the connection
+        """
+        self._sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class InstrumentClient(object):
+    """ A proxy for an instrument served by an InstrumentServer
+
+    Method calls on the proxy are forwarded to the instrument in the server
+    process and return its result.  Attributes can be read with
+    `get_attribute`.
+    """
+    def __init__(self, connection, name):
+        """ The constructor for the InstrumentClient class
+
+        :param connection: A ServerConnection or the path of the server socket
+        :param name: The name of the instrument on the server
+        :type connection: ServerConnection or str
+        :type name: str
+        """
+        if isinstance(connection, str):
+            connection = ServerConnection(connection)
+        self._connection = connection
+        self._name = name
+
+    def __repr__(self):
+        return '{0}({1!r}, {2!r})'.format(type(self).__name__,
+                                          self._connection.path, self._name)
+
+    def __getattr__(self, attr):
+        if attr.startswith('_'):
+            raise AttributeError(attr)
+        connection, name = self._connection, self._name
+
+        def method(*args, **kwargs):
+            return connection.request('call', name, attr, args, kwargs)
+        method.__name__ = attr
+        return method
+
+    def get_attribute(self, attr):
+        """ Returns the value of an attribute of the remote instrument
+        """
+        return self._connection.request('getattr', self._name, attr)
+
+
+###############################################################################
+# Command Line
+###############################################################################
+def _parse_spec(spec, simulate=False):
+    """ Builds an instrument from a 'name=module.Class:argument' string
+    """
+    name, _, target = spec.partition('=')
+    target, _, argument = target.partition(':')
+    module_name, _, class_name = target.rpartition('.')
+    module = importlib.import_module('labchat.' + module_name)
+    cls = getattr(module, class_name)
+    args = []
+    if argument:
+        args.append(int(argument) if argument.isdigit() else argument)
+    kwargs = {}
+    if simulate:
+        from labchat import simulator
+        parameters = inspect.signature(cls).parameters
+        if 'resource_manager' in parameters:
+            kwargs['resource_manager'] = simulator.SimResourceManager()
+        elif 'device' in parameters:
+            kwargs['device'] = simulator.SimSerial()
+    return name, cls(*args, **kwargs)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Share labchat instruments between processes')
+    parser.add_argument('path', help='path of the Unix socket')
+    parser.add_argument('instruments', nargs='+',
+                        help='instruments as name=module.Class:argument, '
+                             'e.g. scope=tekscope.Scope:0')
+    parser.add_argument('--open', action='store_true',
+                        help='open the instruments before serving')
+    parser.add_argument('--ttl', type=float, default=0.5,
+                        help='cache time for read-only calls in seconds')
+    parser.add_argument('--simulate', action='store_true',
+                        help='serve simulated instruments')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    instruments = dict(_parse_spec(spec, args.simulate)
+                       for spec in args.instruments)
+    if args.open:
+        for instrument in instruments.values():
+            if hasattr(instrument, 'open'):
+                instrument.open()
+    server = InstrumentServer(args.path, instruments, cache_ttl=args.ttl)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
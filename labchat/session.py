@@ -0,0 +1,776 @@
+""" Recording and replaying instrument sessions
+
+This module provides transports which record all of the traffic between a
+driver and its instrument to a compact binary session file, and transports
+which replay such a file in place of the instrument.  Sessions captured in
+the lab can then be used to profile the drivers without any hardware
+attached.
+
+Recording is done by wrapping the usual transport objects::
+
+    rm = RecordingResourceManager(visa.ResourceManager(), 'scope.lcs')
+    scope = Scope(device_id=0, resource_manager=rm)
+    ...
+    rm.close()
+
+    port = RecordingSerial(serial.Serial('COM2', timeout=2), 'dew.lcs')
+    dew = DewMaster('COM2', device=port)
+
+and the session is served back with the matching replay transports::
+
+    scope = Scope(device_id=0,
+                  resource_manager=ReplayResourceManager('scope.lcs'))
+    dew = DewMaster('COM2', device=ReplaySerial('dew.lcs'))
+
+Replay is deterministic: every read is answered with the recorded response
+in order.  With `pacing='realtime'` the responses are released with the
+recorded timing, while `pacing='fast'` serves them as soon as they are
+requested.
+
+The session file starts with an 8 byte magic string and the start time of
+the session as a little-endian float64.  It is followed by records which
+each consist of a `<BBdI` header (event kind, channel, seconds since the
+start of the session and payload length) and the payload bytes.
+"""
+
+import logging
+import struct
+import threading
+from collections import deque
+from time import time, sleep
+import visa
+from labchat.simulator import TransportStats
+
+__email__ = "chrisark7@gmail.com"
+__status__ = "Development"
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'LCSESS\x00\x01'
+RECORD = struct.Struct('<BBdI')
+OPEN, WRITE, READ, TIMEOUT, CLOSE = range(5)
+
+
+###############################################################################
+# Session Files
+###############################################################################
+class SessionWriter(object):
+    """ Writes events to a binary session file
+
+    A single writer can be shared by several transports, each of which
+    writes under its own channel number.  Writes are serialized with a lock
+    so that transports used from different threads do not interleave.
+    """
+    def __init__(self, filename):
+        """ The constructor for the SessionWriter class
+
+        :param filename: The path of the session file to create
+        :type filename: str
+        """
+        self.filename = filename
+        self.t0 = time()
+        self.channels = []
+        self._lock = threading.Lock()
+        self._file = open(filename, 'wb')
+        self._file.write(MAGIC + struct.pack('<d', self.t0))
+
+    def add_channel(self, name):
+        """ Registers a new channel and returns its number
+
+        :param name: The resource name or port of the channel
+        :type name: str
+        :return: channel number
+        :rtype: int
+        """
+        with self._lock:
+            channel = len(self.channels)
+            if channel > 255:
+                raise ValueError('a session file supports at most 256 '
+                                 'channels')
+            self.channels.append(name)
+        self.record(OPEN, channel, name.encode('utf-8'))
+        return channel
+
+    def record(self, kind, channel, payload=b''):
+        """ Appends an event to the session file
+
+        :param kind: One of OPEN, WRITE, READ, TIMEOUT or CLOSE
+        :param channel: The channel number
+        :param payload: The bytes transferred
+        :type kind: int
+        :type channel: int
+        :type payload: bytes
+        """
+        header = RECORD.pack(kind, channel, time() - self.t0, len(payload))
+        with self._lock:
+            self._file.write(header)
+            self._file.write(payload)
+
+    def close(self):
+        """ Flushes and closes the session file
+        """
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+
+
+class Session(object):
+    """ The contents of a session file
+
+    The `channels` attribute lists the names of the recorded channels and
+    `events` maps each channel number to its list of `(kind, t, payload)`
+    tuples in the order they were recorded.
+    """
+    def __init__(self, filename):
+        """ The constructor for the Session class
+
+        :param filename: The path of the session file to read
+        :type filename: str
+        """
+        with open(filename, 'rb') as f:
+            data = f.read()
+        if data[:len(MAGIC)] != MAGIC:
+            raise ValueError('{0} is not a labchat session file'.format(
+                filename))
+        self.filename = filename
+        self.t0 = struct.unpack_from('<d', data, len(MAGIC))[0]
+        self.channels = []
+        self.events = {}
+        offset = len(MAGIC) + 8
+        while offset + RECORD.size <= len(data):
+            kind, channel, t, length = RECORD.unpack_from(data, offset)
+            offset += RECORD.size
+            payload = data[offset:offset + length]
+            offset += length
+            if len(payload) < length:
+                logger.warning('Session file {0} is truncated'.format(
+                    filename))
+                break
+            if kind == OPEN:
+                self.channels.append(payload.decode('utf-8'))
+                self.events[channel] = []
+            elif channel in self.events:
+                self.events[channel].append((kind, t, payload))
+
+    def duration(self, channel=None):
+        """ Returns the recorded length of a channel (or all) in seconds
+        """
+        channels = self.events if channel is None else [channel]
+        times = [ev[-1][1] - ev[0][1] for ev in
+                 (self.events[c] for c in channels) if ev]
+        return max(times) if times else 0.0
+
+
+###############################################################################
+# Recording Transports
+###############################################################################
+class _RecordingVisaLibrary(object):
+    """ Wraps the `visalib` of a resource so that raw reads are recorded
+    """
+    def __init__(self, visalib, recorder):
+        self._visalib = visalib
+        self._recorder = recorder
+
+    def read(self, session, count):
+        out = self._visalib.read(session, count)
+        self._recorder._record(READ, out[0])
+        return out
+
+    def __getattr__(self, name):
+        return getattr(self._visalib, name)
+
+
+class RecordingResource(object):
+    """ Wraps a pyvisa resource and records all reads and writes
+
+    Attributes which are not part of the recorded interface (`timeout`,
+    `bytes_in_buffer`, `flush`, ...) are passed straight through to the
+    wrapped resource.
+    """
+    def __init__(self, resource, writer, name=None):
+        """ The constructor for the RecordingResource class
+
+        :param resource: The pyvisa resource to wrap
+        :param writer: The session writer or the filename of a new session
+        :param name: The name recorded for the channel
+        :type resource: visa.resources.MessageBasedResource
+        :type writer: SessionWriter or str
+        :type name: str
+        """
+        if not isinstance(writer, SessionWriter):
+            writer = SessionWriter(writer)
+        if name is None:
+            name = getattr(resource, 'resource_name', 'resource')
+        self.__dict__['_resource'] = resource
+        self.__dict__['_writer'] = writer
+        self.__dict__['_channel'] = writer.add_channel(name)
+        self.__dict__['visalib'] = _RecordingVisaLibrary(resource.visalib,
+                                                         self)
+
+    def __getattr__(self, name):
+        return getattr(self._resource, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._resource, name, value)
+
+    def _record(self, kind, payload=b''):
+        self._writer.record(kind, self._channel, payload)
+
+    def _read(self, method, *args, **kwargs):
+        try:
+            out = method(*args, **kwargs)
+        except visa.VisaIOError:
+            self._record(TIMEOUT)
+            raise
+        return out
+
+    def write(self, message, *args, **kwargs):
+        """ Writes `message` and records the bytes sent
+        """
+        termination = kwargs.get('termination', self._resource.write_termination)
+        encoding = kwargs.get('encoding', self._resource.encoding)
+        self._record(WRITE, (message + (termination or '')).encode(encoding))
+        return self._resource.write(message, *args, **kwargs)
+
+    def write_raw(self, message):
+        """ Writes raw bytes and records them
+        """
+        self._record(WRITE, bytes(message))
+        return self._resource.write_raw(message)
+
+    def read(self, *args, **kwargs):
+        """ Reads a response and records it
+        """
+        out = self._read(self._resource.read, *args, **kwargs)
+        encoding = kwargs.get('encoding') or self._resource.encoding
+        self._record(READ, out.encode(encoding))
+        return out
+
+    def read_raw(self, *args):
+        """ Reads a raw response and records it
+        """
+        out = self._read(self._resource.read_raw, *args)
+        self._record(READ, bytes(out))
+        return out
+
+    def read_bytes(self, count, *args, **kwargs):
+        """ Reads `count` bytes and records them
+        """
+        out = self._read(self._resource.read_bytes, count, *args, **kwargs)
+        self._record(READ, bytes(out))
+        return out
+
+    def query(self, message, delay=None):
+        """ Writes `message`, reads the response and records both
+        """
+        self.write(message)
+        if delay:
+            sleep(delay)
+        return self.read()
+
+    def close(self):
+        """ Closes the wrapped resource and records the event
+        """
+        self._record(CLOSE)
+        return self._resource.close()
+
+
+class RecordingResourceManager(object):
+    """ Wraps a resource manager so that every opened resource is recorded
+
+    All of the resources opened through the manager are recorded as
+    separate channels of the same session file.
+    """
+    def __init__(self, resource_manager, filename):
+        """ The constructor for the RecordingResourceManager class
+
+        :param resource_manager: The resource manager to wrap
+        :param filename: The path of the session file to create
+        :type resource_manager: visa.ResourceManager
+        :type filename: str
+        """
+        self.resource_manager = resource_manager
+        self.writer = SessionWriter(filename)
+
+    def list_resources(self, *args, **kwargs):
+        """ Lists the resources of the wrapped resource manager
+        """
+        return self.resource_manager.list_resources(*args, **kwargs)
+
+    def open_resource(self, resource_name, *args, **kwargs):
+        """ Opens a resource and wraps it in a `RecordingResource`
+        """
+        resource = self.resource_manager.open_resource(resource_name, *args,
+                                                       **kwargs)
+        return RecordingResource(resource, self.writer, name=resource_name)
+
+    def close(self):
+        """ Closes the session file
+        """
+        self.writer.close()
+
+
+class RecordingSerial(object):
+    """ Wraps a `serial.Serial` port and records all reads and writes
+
+    Polling calls such as `inWaiting` are passed through without being
+    recorded; only the bytes actually transferred are logged.
+    """
+    def __init__(self, device, writer, name=None):
+        """ The constructor for the RecordingSerial class
+
+        :param device: The serial port to wrap
+        :param writer: The session writer or the filename of a new session
+        :param name: The name recorded for the channel
+        :type device: serial.Serial
+        :type writer: SessionWriter or str
+        :type name: str
+        """
+        if not isinstance(writer, SessionWriter):
+            writer = SessionWriter(writer)
+        if name is None:
+            name = str(getattr(device, 'port', 'serial'))
+        self.__dict__['_device'] = device
+        self.__dict__['_writer'] = writer
+        self.__dict__['_channel'] = writer.add_channel(name)
+
+    def __getattr__(self, name):
+        return getattr(self._device, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._device, name, value)
+
+    def write(self, data):
+        """ Writes bytes to the port and records them
+        """
+        self._writer.record(WRITE, self._channel, bytes(data))
+        return self._device.write(data)
+
+    def read(self, size=1):
+        """ Reads from the port and records the bytes received
+        """
+        out = self._device.read(size)
+        if out:
+            self._writer.record(READ, self._channel, bytes(out))
+        else:
+            self._writer.record(TIMEOUT, self._channel)
+        return out
+
+    def read_until(self, expected=b'\n', size=None):
+        """ Reads up to `expected` from the port and records the bytes received
+        """
+        out = self._device.read_until(expected, size)
+        if out:
+            self._writer.record(READ, self._channel, bytes(out))
+        else:
+            self._writer.record(TIMEOUT, self._channel)
+        return out
+
+    def close(self):
+        """ Closes the port and the session file
+        """
+        self._writer.record(CLOSE, self._channel)
+        self._device.close()
+        self._writer.close()
+
+
+###############################################################################
+# Replay Transports
+###############################################################################
+class _ReplayStream(object):
+    """ A cursor over the recorded events of one channel
+
+    Writes are checked against the recorded writes as a byte stream and the
+    recorded reads are released once all of the writes preceding them have
+    been made (and, for real-time pacing, once their recorded time has
+    passed).
+
+    The stream may be shared by a reading and a writing thread: every
+    method holds `lock`, and waiting readers are woken by each write.
+    """
+    def __init__(self, events, pacing='fast', name=''):
+        if pacing not in ('fast', 'realtime'):
+            raise ValueError("pacing should be 'fast' or 'realtime'")
+        self.events = deque([kind, t, bytearray(payload)]
+                            for kind, t, payload in events
+                            if kind in (WRITE, READ, TIMEOUT))
+        self.pacing = pacing
+        self.name = name
+        self.t_first = self.events[0][1] if self.events else 0
+        self.t_start = None
+        self.mismatches = 0
+        self.lock = threading.Condition(threading.RLock())
+
+    def _due(self, t):
+        """ Returns the wall-clock time at which an event is due
+        """
+        if self.t_start is None:
+            self.t_start = time()
+        return self.t_start + t - self.t_first
+
+    def _wait(self, t):
+        """ Waits until an event is due, letting other threads use the stream
+        """
+        if self.pacing == 'realtime':
+            delay = self._due(t) - time()
+            while delay > 0:
+                self.lock.wait(delay)
+                delay = self._due(t) - time()
+
+    def _released(self, t):
+        return self.pacing == 'fast' or self._due(t) <= time()
+
+    def wait_readable(self, timeout=None):
+        """ Waits until the next event is a released read or a timeout
+
+        Like a serial port with nothing to read, this blocks while the next
+        recorded event is a write which has not been made yet, or while the
+        recording is exhausted.
+
+        :param timeout: The longest time in seconds to wait, None to wait forever
+        :type timeout: float
+        :return: True if there is something to take
+        :rtype: bool
+        """
+        t_stop = None if timeout is None else time() + timeout
+        with self.lock:
+            while True:
+                delay = None
+                if self.events:
+                    kind, t, _ = self.events[0]
+                    if kind == TIMEOUT:
+                        return True
+                    if kind == READ:
+                        if self._released(t):
+                            return True
+                        delay = self._due(t) - time()
+                if t_stop is not None:
+                    remaining = t_stop - time()
+                    if remaining <= 0:
+                        return False
+                    delay = remaining if delay is None else min(delay, remaining)
+                self.lock.wait(delay)
+
+    def consume_write(self, data):
+        """ Matches `data` against the recorded writes
+        """
+        with self.lock:
+            self._consume_write(bytes(data))
+            self.lock.notify_all()
+
+    def _consume_write(self, data):
+        """ Matches `data` against the recorded writes with the lock held
+        """
+        expected = bytearray()
+        while len(expected) < len(data) and self.events:
+            event = self.events[0]
+            if event[0] != WRITE:
+                # Recorded output which the driver never read
+                self.events.popleft()
+                continue
+            n = len(data) - len(expected)
+            expected += event[2][:n]
+            del event[2][:n]
+            if not event[2]:
+                self.events.popleft()
+        if bytes(expected) != data:
+            self.mismatches += 1
+            logger.warning('Replay of {0} diverged: wrote {1!r}, session '
+                           'has {2!r}'.format(self.name, data,
+                                              bytes(expected)))
+
+    def next_kind(self):
+        """ Returns the kind of the next event or None
+        """
+        with self.lock:
+            if not self.events:
+                return None
+            return self.events[0][0]
+
+    def available(self):
+        """ Returns the number of recorded bytes readable now
+
+        With fast pacing the recorded reads are released one at a time so
+        that the driver sees the same chunks it received when recording.
+        """
+        total = 0
+        with self.lock:
+            for kind, t, payload in self.events:
+                if kind != READ or not self._released(t):
+                    break
+                total += len(payload)
+                if self.pacing == 'fast':
+                    break
+        return total
+
+    def take_message(self):
+        """ Removes and returns the next recorded response
+
+        A recorded timeout is returned as None.
+        """
+        with self.lock:
+            if self.next_kind() not in (READ, TIMEOUT):
+                return None
+            kind, t, payload = self.events.popleft()
+            self._wait(t)
+            return bytes(payload) if kind == READ else None
+
+    def take(self, count):
+        """ Removes and returns up to `count` recorded bytes
+        """
+        out = bytearray()
+        with self.lock:
+            while self.events and len(out) < count:
+                kind, t, payload = self.events[0]
+                if kind == WRITE:
+                    break
+                if kind == TIMEOUT:
+                    self.events.popleft()
+                    if out:
+                        break
+                    continue
+                self._wait(t)
+                n = count - len(out)
+                out += payload[:n]
+                del payload[:n]
+                if not payload:
+                    self.events.popleft()
+        return bytes(out)
+
+
+class _ReplayVisaLibrary(object):
+    """ Stand-in for the `visalib` attribute of a replayed resource
+    """
+    def __init__(self, resource):
+        self._resource = resource
+
+    def read(self, session, count):
+        return (self._resource.read_bytes(count),
+                visa.constants.StatusCode.success)
+
+
+class ReplayResource(object):
+    """ Replays one recorded channel in place of a pyvisa resource
+    """
+    def __init__(self, session, channel=0, pacing='fast', timeout=2000,
+                 read_termination='\n', write_termination='\n',
+                 encoding='ascii', **kwargs):
+        """ The constructor for the ReplayResource class
+
+        :param session: The session or the filename of a session file
+        :param channel: The recorded channel to replay
+        :param pacing: 'fast' to serve reads immediately or 'realtime'
+        :type session: Session or str
+        :type channel: int
+        :type pacing: str
+        """
+        if not isinstance(session, Session):
+            session = Session(session)
+        self.resource_name = session.channels[channel]
+        self.timeout = timeout
+        self.read_termination = read_termination
+        self.write_termination = write_termination
+        self.encoding = encoding
+        self.session = channel
+        self.visalib = _ReplayVisaLibrary(self)
+        self.stats = TransportStats()
+        self._stream = _ReplayStream(session.events[channel], pacing=pacing,
+                                     name=self.resource_name)
+        for key in kwargs:
+            setattr(self, key, kwargs[key])
+
+    def open(self):
+        pass
+
+    def close(self):
+        pass
+
+    def clear(self):
+        pass
+
+    def flush(self, mask):
+        pass
+
+    @property
+    def bytes_in_buffer(self):
+        """ The number of recorded bytes ready to be read
+        """
+        return self._stream.available()
+
+    def write_raw(self, message):
+        """ Checks raw bytes against the recording
+        """
+        self._stream.consume_write(message)
+        self.stats.writes += 1
+        self.stats.bytes_written += len(message)
+        return len(message)
+
+    def write(self, message, termination=None, encoding=None):
+        """ Checks a command against the recording
+        """
+        if termination is None:
+            termination = self.write_termination
+        if encoding is None:
+            encoding = self.encoding
+        return self.write_raw((message + (termination or '')).encode(encoding))
+
+    def read_raw(self, *args):
+        """ Returns the next recorded response as bytes
+        """
+        out = self._stream.take_message()
+        if out is None:
+            raise visa.VisaIOError(visa.constants.StatusCode.error_timeout)
+        self.stats.reads += 1
+        self.stats.bytes_read += len(out)
+        return out
+
+    def read_bytes(self, count, *args, **kwargs):
+        """ Returns up to `count` bytes of the recorded responses
+        """
+        if self._stream.next_kind() == TIMEOUT:
+            self._stream.take_message()
+            raise visa.VisaIOError(visa.constants.StatusCode.error_timeout)
+        out = self._stream.take(count)
+        if not out:
+            raise visa.VisaIOError(visa.constants.StatusCode.error_timeout)
+        self.stats.reads += 1
+        self.stats.bytes_read += len(out)
+        return out
+
+    def read(self, termination=None, encoding=None):
+        """ Returns the next recorded response as a string
+        """
+        if encoding is None:
+            encoding = self.encoding
+        return self.read_raw().decode(encoding)
+
+    def query(self, message, delay=None):
+        """ Checks `message` against the recording and returns the response
+        """
+        self.write(message)
+        return self.read()
+
+
+class ReplayResourceManager(object):
+    """ Serves the channels of a session file as pyvisa resources
+
+    Opening a resource returns the first channel recorded under that name
+    which has not been opened yet.
+    """
+    def __init__(self, filename, pacing='fast'):
+        """ The constructor for the ReplayResourceManager class
+
+        :param filename: The path of the session file
+        :param pacing: 'fast' to serve reads immediately or 'realtime'
+        :type filename: str
+        :type pacing: str
+        """
+        self.session = Session(filename)
+        self.pacing = pacing
+        self._used = set()
+
+    def list_resources(self, *args, **kwargs):
+        """ Returns the names of the recorded resources
+        """
+        return tuple(sorted(set(self.session.channels)))
+
+    def open_resource(self, resource_name, open_timeout=None, **kwargs):
+        """ Returns a `ReplayResource` for the named recorded channel
+        """
+        for channel, name in enumerate(self.session.channels):
+            if name == resource_name and channel not in self._used:
+                self._used.add(channel)
+                return ReplayResource(self.session, channel,
+                                      pacing=self.pacing, **kwargs)
+        raise visa.VisaIOError(
+            visa.constants.StatusCode.error_resource_not_found)
+
+    def close(self):
+        pass
+
+
+class ReplaySerial(object):
+    """ Replays one recorded channel in place of a `serial.Serial` port
+    """
+    def __init__(self, session, channel=0, pacing='fast', timeout=2):
+        """ The constructor for the ReplaySerial class
+
+        :param session: The session or the filename of a session file
+        :param channel: The recorded channel to replay
+        :param pacing: 'fast' to serve reads immediately or 'realtime'
+        :param timeout: Read timeout in seconds
+        :type session: Session or str
+        :type channel: int
+        :type pacing: str
+        :type timeout: float
+        """
+        if not isinstance(session, Session):
+            session = Session(session)
+        self.port = session.channels[channel]
+        self.timeout = timeout
+        self.is_open = True
+        self.stats = TransportStats()
+        self._stream = _ReplayStream(session.events[channel], pacing=pacing,
+                                     name=self.port)
+
+    def open(self):
+        self.is_open = True
+
+    def close(self):
+        self.is_open = False
+
+    def write(self, data):
+        """ Checks bytes against the recording
+        """
+        self._stream.consume_write(data)
+        self.stats.writes += 1
+        self.stats.bytes_written += len(data)
+        return len(data)
+
+    def inWaiting(self):
+        """ Returns the number of recorded bytes ready to be read
+        """
+        return self._stream.available()
+
+    @property
+    def in_waiting(self):
+        return self._stream.available()
+
+    def reset_input_buffer(self):
+        with self._stream.lock:
+            self._stream.take(self._stream.available())
+
+    def read(self, size=1):
+        """ Returns up to `size` recorded bytes
+
+        Like `serial.Serial.read`, this waits for up to `timeout` seconds for
+        the next recorded read to be released.
+        """
+        out = b''
+        if self._stream.wait_readable(self.timeout):
+            out = self._stream.take(size)
+        if out:
+            self.stats.reads += 1
+            self.stats.bytes_read += len(out)
+        return out
+
+    def read_until(self, expected=b'\n', size=None):
+        """ Returns recorded bytes up to and including `expected`
+
+        This waits for up to `timeout` seconds in total, as `read` does.
+        """
+        t_stop = None if self.timeout is None else time() + self.timeout
+        out = b''
+        while not out.endswith(expected) and (size is None or
+                                              len(out) < size):
+            remaining = None if t_stop is None else max(t_stop - time(), 0)
+            if not self._stream.wait_readable(remaining):
+                break
+            byte = self._stream.take(1)
+            if not byte:
+                break
+            out += byte
+        if out:
+            self.stats.reads += 1
+            self.stats.bytes_read += len(out)
+        return out
@@ -0,0 +1,1436 @@
+""" Simulated instruments for exercising the drivers without hardware
+
+This module provides software models of the instruments supported by labchat
+together with transports which mimic the objects the drivers normally talk
+to.  A `SimResourceManager` stands in for `visa.ResourceManager` and hands out
+`SimResource` instances which behave like pyvisa message-based resources,
+while a `SimSerial` instance stands in for the `serial.Serial` object used by
+the DewMaster.
+
+The drivers accept these objects through their `resource_manager` (or, for
+the DewMaster, `device`) constructor arguments::
+
+    rm = SimResourceManager(latency=1e-3, bandwidth=1e6)
+    scope = Scope(device_id=rm.find('DPO'), resource_manager=rm)
+
+Each model answers the commands actually issued by the corresponding driver.
+The transports add a configurable per-command latency (either a single value
+in seconds or a dict mapping command prefixes to seconds) and a bandwidth in
+bytes per second, so that the time spent in the drivers can be measured on a
+machine with no instruments attached.  Traffic counters are kept in the
+`stats` attribute of every transport.
+"""
+
+import logging
+import re
+import threading
+from collections import deque
+from datetime import datetime
+from time import time, sleep
+import numpy as np
+import visa
+
+__email__ = "chrisark7@gmail.com"
+__status__ = "Development"
+
+logger = logging.getLogger(__name__)
+
+
+###############################################################################
+# Transport Helpers
+###############################################################################
+class TransportStats(object):
+    """ Counters describing the traffic that passed through a transport
+
+    A round trip is counted every time the host receives a response from
+    the instrument.
+    """
+    def __init__(self):
+        """ The constructor for the TransportStats class
+        """
+        self.writes = 0
+        self.reads = 0
+        self.bytes_written = 0
+        self.bytes_read = 0
+
+    def reset(self):
+        """ Sets all of the counters back to zero
+        """
+        self.writes = 0
+        self.reads = 0
+        self.bytes_written = 0
+        self.bytes_read = 0
+
+    def as_dict(self):
+        """ Returns the counters as a dictionary
+
+        :return: dictionary of counter values
+        :rtype: dict
+        """
+        return {'writes': self.writes,
+                'round_trips': self.reads,
+                'bytes_written': self.bytes_written,
+                'bytes_read': self.bytes_read}
+
+
+class _TimedBuffer(object):
+    """ A byte buffer whose chunks only become readable at scheduled times
+    """
+    def __init__(self):
+        self._chunks = deque()
+
+    def put(self, data, ready):
+        """ Adds `data` to the buffer, readable from time `ready` on
+        """
+        if data:
+            self._chunks.append([ready, bytearray(data)])
+
+    def clear(self):
+        """ Discards everything in the buffer
+        """
+        self._chunks.clear()
+
+    def available(self, now):
+        """ Returns the number of bytes which are readable at time `now`
+        """
+        total = 0
+        for ready, data in self._chunks:
+            if ready > now:
+                break
+            total += len(data)
+        return total
+
+    def next_ready(self):
+        """ Returns the time at which the next chunk is readable or None
+        """
+        if not self._chunks:
+            return None
+        return self._chunks[0][0]
+
+    def take_chunk(self):
+        """ Removes and returns the next complete chunk
+        """
+        return bytes(self._chunks.popleft()[1])
+
+    def take(self, count, now):
+        """ Removes and returns up to `count` bytes readable at time `now`
+        """
+        out = bytearray()
+        while self._chunks and len(out) < count:
+            ready, data = self._chunks[0]
+            if ready > now:
+                break
+            n = count - len(out)
+            out += data[:n]
+            del data[:n]
+            if not data:
+                self._chunks.popleft()
+        return bytes(out)
+
+
+class _SimTransport(object):
+    """ Shared machinery of the simulated VISA and serial transports
+
+    Sending data to the model blocks for the time needed to push the bytes
+    through the link.  Each command then occupies the simulated instrument
+    for its latency, and its response becomes readable once it has been
+    transferred back across the link.  As with a real port, one thread may
+    read while another writes.
+    """
+    def __init__(self, model, latency=0, bandwidth=None):
+        self.model = model
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.stats = TransportStats()
+        self._out = _TimedBuffer()
+        self._busy_until = 0
+        self._lock = threading.RLock()
+        # Notified when a write schedules new output
+        self._output_added = threading.Condition(self._lock)
+
+    def command_latency(self, command):
+        """ Returns the processing time in seconds of `command`
+
+        When `latency` is a dict, the entry with the longest key that
+        prefixes `command` is used and the entry under `None` (if any) is the
+        fallback.
+
+        :param command: The command as a string
+        :type command: str
+        :return: processing time in seconds
+        :rtype: float
+        """
+        if not isinstance(self.latency, dict):
+            return self.latency
+        best = None
+        command = command.upper()
+        for prefix in self.latency:
+            if prefix is None:
+                continue
+            if command.startswith(prefix.upper()):
+                if best is None or len(prefix) > len(best):
+                    best = prefix
+        return self.latency.get(best, 0)
+
+    def transfer_time(self, nbytes):
+        """ Returns the time needed to move `nbytes` across the link
+        """
+        if not self.bandwidth:
+            return 0
+        return nbytes / self.bandwidth
+
+    def _send(self, data):
+        """ Pushes raw bytes to the model and schedules its responses
+        """
+        data = bytes(data)
+        duration = self.transfer_time(len(data))
+        if duration:
+            sleep(duration)
+        with self._lock:
+            self.stats.writes += 1
+            self.stats.bytes_written += len(data)
+            now = time()
+            for command, response, delay in self.model.receive(data, now):
+                start = max(now, self._busy_until)
+                self._busy_until = start + self.command_latency(command)
+                if response:
+                    ready = (self._busy_until + delay +
+                             self.transfer_time(len(response)))
+                    self._out.put(response, ready)
+            self._output_added.notify_all()
+        return len(data)
+
+    def _poll(self):
+        """ Collects any unsolicited output produced by the model
+        """
+        with self._lock:
+            for ready, data in self.model.unsolicited(time()):
+                self._out.put(data, ready + self.transfer_time(len(data)))
+
+    def _available(self):
+        with self._lock:
+            self._poll()
+            return self._out.available(time())
+
+    def _discard(self):
+        with self._lock:
+            self._poll()
+            self._out.clear()
+
+
+###############################################################################
+# VISA Transport
+###############################################################################
+class _SimVisaLibrary(object):
+    """ Stand-in for the `visalib` attribute of a pyvisa resource
+    """
+    def __init__(self, resource):
+        self._resource = resource
+
+    def read(self, session, count):
+        """ Reads up to `count` bytes, mirroring `pyvisa`'s low-level read
+        """
+        return (self._resource.read_bytes(count, break_on_termchar=True),
+                visa.constants.StatusCode.success)
+
+
+class SimResource(_SimTransport):
+    """ A simulated pyvisa message-based resource
+
+    Only the parts of the pyvisa interface used by the labchat drivers are
+    implemented.  `timeout` is in milliseconds as in pyvisa.
+    """
+    def __init__(self, resource_name, model, latency=0, bandwidth=None,
+                 timeout=2000, read_termination='\n', write_termination='\n',
+                 encoding='ascii', **kwargs):
+        super(SimResource, self).__init__(model=model, latency=latency,
+                                          bandwidth=bandwidth)
+        self.resource_name = resource_name
+        self.timeout = timeout
+        self.read_termination = read_termination
+        self.write_termination = write_termination
+        self.encoding = encoding
+        self.session = id(self)
+        self.visalib = _SimVisaLibrary(self)
+        self.is_open = True
+        for key in kwargs:
+            setattr(self, key, kwargs[key])
+
+    def open(self):
+        """ Opens the simulated session
+        """
+        self.is_open = True
+
+    def close(self):
+        """ Closes the simulated session
+        """
+        self.is_open = False
+
+    def _check_open(self):
+        if not self.is_open:
+            raise visa.VisaIOError(
+                visa.constants.StatusCode.error_connection_lost)
+
+    def _timeout_seconds(self):
+        if self.timeout is None:
+            return float('inf')
+        return self.timeout * 1e-3
+
+    @property
+    def bytes_in_buffer(self):
+        """ The number of bytes waiting to be read
+        """
+        return self._available()
+
+    def flush(self, mask):
+        """ Discards the input buffer if requested by `mask`
+        """
+        if mask & (visa.constants.VI_READ_BUF_DISCARD |
+                   visa.constants.VI_IO_IN_BUF_DISCARD):
+            self._discard()
+
+    def clear(self):
+        """ Clears the device, discarding any pending output
+        """
+        self._discard()
+
+    def write_raw(self, message):
+        """ Sends raw bytes to the simulated instrument
+        """
+        self._check_open()
+        return self._send(message)
+
+    def write(self, message, termination=None, encoding=None):
+        """ Sends a command string to the simulated instrument
+        """
+        if termination is None:
+            termination = self.write_termination
+        if encoding is None:
+            encoding = self.encoding
+        return self.write_raw((message + termination).encode(encoding))
+
+    def _wait_for_output(self):
+        """ Blocks until a response is readable or raises on timeout
+        """
+        t0 = time()
+        deadline = t0 + self._timeout_seconds()
+        self._poll()
+        ready = self._out.next_ready()
+        if ready is None or ready > deadline:
+            remaining = deadline - t0
+            if remaining != float('inf') and remaining > 0:
+                sleep(remaining)
+            raise visa.VisaIOError(visa.constants.StatusCode.error_timeout)
+        if ready > t0:
+            sleep(ready - t0)
+
+    def read_raw(self):
+        """ Reads the next complete response as bytes
+        """
+        self._check_open()
+        self._wait_for_output()
+        out = self._out.take_chunk()
+        self.stats.reads += 1
+        self.stats.bytes_read += len(out)
+        return out
+
+    def read_bytes(self, count, break_on_termchar=False):
+        """ Reads up to `count` bytes from the next response
+        """
+        self._check_open()
+        self._wait_for_output()
+        out = self._out.take(count, time())
+        self.stats.reads += 1
+        self.stats.bytes_read += len(out)
+        return out
+
+    def read(self, termination=None, encoding=None):
+        """ Reads the next response as a string with its terminator removed
+        """
+        if termination is None:
+            termination = self.read_termination
+        if encoding is None:
+            encoding = self.encoding
+        out = self.read_raw().decode(encoding)
+        if termination and out.endswith(termination):
+            out = out[:-len(termination)]
+        return out
+
+    def query(self, message, delay=None):
+        """ Writes `message` and returns the response
+        """
+        self.write(message)
+        if delay:
+            sleep(delay)
+        return self.read()
+
+
+class SimResourceManager(object):
+    """ A stand-in for `visa.ResourceManager` serving simulated instruments
+
+    `resources` maps VISA resource names to instrument models.  If it is
+    not given, one of each VISA-based instrument is created.  The `latency`
+    and `bandwidth` arguments are applied to every resource that is opened.
+    """
+    def __init__(self, resources=None, latency=0, bandwidth=None):
+        """ The constructor for the SimResourceManager class
+
+        :param resources: mapping of resource name to instrument model
+        :param latency: per-command latency in seconds or dict of prefix: seconds
+        :param bandwidth: link bandwidth in bytes per second (None is unlimited)
+        :type resources: dict
+        :type latency: float or dict
+        :type bandwidth: float
+        """
+        if resources is None:
+            resources = {
+                'USB0::0x0699::0x0401::SIM0001::INSTR': ScopeModel(),
+                'USB0::0x2184::0x003C::SIM0002::INSTR': AFG2225Model(),
+                'USB0::0xF4EC::0x1102::SIM0003::INSTR': BKFunGenModel(),
+                'ASRL1::INSTR': RelayModel()}
+        self.resources = resources
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.opened = []
+
+    def list_resources(self, query='?*::INSTR'):
+        """ Returns the names of the simulated resources
+        """
+        return tuple(sorted(self.resources))
+
+    def find(self, model_type):
+        """ Returns the name of the first resource whose model is `model_type`
+
+        `model_type` may be a model class or the name of one (e.g. 'Scope').
+
+        :param model_type: class or class name of the model
+        :type model_type: type or str
+        :return: resource name
+        :rtype: str
+        """
+        for name in self.list_resources():
+            model = self.resources[name]
+            if isinstance(model_type, str):
+                if type(model).__name__.lower().startswith(model_type.lower()):
+                    return name
+            elif isinstance(model, model_type):
+                return name
+        raise LookupError('no simulated resource of type {0}'.format(
+            model_type))
+
+    def open_resource(self, resource_name, open_timeout=None, **kwargs):
+        """ Returns a `SimResource` connected to the named model
+        """
+        if resource_name not in self.resources:
+            raise visa.VisaIOError(
+                visa.constants.StatusCode.error_resource_not_found)
+        resource = SimResource(resource_name, self.resources[resource_name],
+                               latency=self.latency, bandwidth=self.bandwidth,
+                               **kwargs)
+        self.opened.append(resource)
+        return resource
+
+    def close(self):
+        """ Closes every resource opened through the manager
+        """
+        for resource in self.opened:
+            resource.close()
+
+
+###############################################################################
+# Serial Transport
+###############################################################################
+class SimSerial(_SimTransport):
+    """ A simulated `serial.Serial` port
+
+    Only the parts of the pyserial interface used by the labchat drivers are
+    implemented.  `timeout` is in seconds as in pyserial.
+    """
+    def __init__(self, model=None, port='COM1', timeout=2, latency=0,
+                 bandwidth=960):
+        """ The constructor for the SimSerial class
+
+        The default bandwidth corresponds to 9600 baud with 8N1 framing.
+
+        :param model: The instrument model, a `DewMasterModel` by default
+        :param port: The name reported for the port
+        :param timeout: Read timeout in seconds
+        :param latency: per-command latency in seconds or dict of prefix: seconds
+        :param bandwidth: link bandwidth in bytes per second (None is unlimited)
+        """
+        if model is None:
+            model = DewMasterModel()
+        super(SimSerial, self).__init__(model=model, latency=latency,
+                                        bandwidth=bandwidth)
+        self.port = port
+        self.timeout = timeout
+        self.is_open = True
+
+    def open(self):
+        """ Opens the simulated port
+        """
+        self.is_open = True
+
+    def close(self):
+        """ Closes the simulated port
+        """
+        self.is_open = False
+
+    def write(self, data):
+        """ Writes bytes to the simulated instrument
+        """
+        return self._send(data)
+
+    def inWaiting(self):
+        """ Returns the number of bytes waiting to be read
+        """
+        return self._available()
+
+    @property
+    def in_waiting(self):
+        """ The number of bytes waiting to be read
+        """
+        return self._available()
+
+    def reset_input_buffer(self):
+        """ Discards any bytes waiting to be read
+        """
+        self._discard()
+
+    def read(self, size=1):
+        """ Reads `size` bytes, returning fewer if the timeout expires
+        """
+        deadline = time() + (self.timeout if self.timeout is not None
+                             else float('inf'))
+        out = bytearray()
+        with self._output_added:
+            while True:
+                self._poll()
+                now = time()
+                out += self._out.take(size - len(out), now)
+                if len(out) >= size or now >= deadline:
+                    break
+                ready = self._out.next_ready()
+                wake = deadline if ready is None else min(max(ready, now),
+                                                          deadline)
+                if self.model.next_unsolicited() is not None:
+                    wake = min(wake, max(self.model.next_unsolicited(), now))
+                # A write from another thread may schedule earlier output
+                self._output_added.wait(max(wake - now, 1e-4))
+        if out:
+            self.stats.reads += 1
+            self.stats.bytes_read += len(out)
+        return bytes(out)
+
+    def read_until(self, expected=b'\n', size=None):
+        """ Reads until `expected` is found, `size` bytes are read or the timeout expires
+        """
+        deadline = time() + (self.timeout if self.timeout is not None
+                             else float('inf'))
+        out = bytearray()
+        with self._output_added:
+            while True:
+                self._poll()
+                now = time()
+                while not out.endswith(expected) and (size is None or
+                                                      len(out) < size):
+                    byte = self._out.take(1, now)
+                    if not byte:
+                        break
+                    out += byte
+                if (out.endswith(expected) or (size is not None and
+                                               len(out) >= size) or
+                        now >= deadline):
+                    break
+                ready = self._out.next_ready()
+                wake = deadline if ready is None else min(max(ready, now),
+                                                          deadline)
+                if self.model.next_unsolicited() is not None:
+                    wake = min(wake, max(self.model.next_unsolicited(), now))
+                self._output_added.wait(max(wake - now, 1e-4))
+        if out:
+            self.stats.reads += 1
+            self.stats.bytes_read += len(out)
+        return bytes(out)
+
+
+###############################################################################
+# Instrument Models
+###############################################################################
+class SimModel(object):
+    """ Base class for the simulated instrument models
+
+    A model consumes raw bytes through `receive` and returns a list of
+    `(command, response, delay)` tuples, one per complete command, where
+    `response` is the reply as bytes (or None) and `delay` is any extra time
+    before the reply is sent.  Models which produce output on their own
+    override `unsolicited`.
+    """
+    def receive(self, data, now):
+        raise NotImplementedError
+
+    def unsolicited(self, now):
+        """ Returns a list of `(time, bytes)` produced spontaneously by `now`
+        """
+        return []
+
+    def next_unsolicited(self):
+        """ Returns the time of the next spontaneous output or None
+        """
+        return None
+
+
+class MessageModel(SimModel):
+    """ Base class for models of message-based (VISA) instruments
+
+    Incoming bytes are split into lines and each line into its
+    `;`-separated commands.  Every command is passed to `handle`, which
+    returns the reply string for queries and None otherwise.  The replies
+    to all of the queries in one line are joined by `;`.
+
+    Binary data in a line (by default IEEE 488.2 definite-length blocks,
+    found with `binary_start` and measured by `binary_data`) is not scanned
+    for terminators or separators.  It is replaced in the command by a
+    `#B<n>` placeholder and its bytes are available to `handle` as
+    `self.blocks[n]`.
+    """
+    termination = '\n'
+    binary_start = re.compile(r'#[1-9]')
+
+    def __init__(self):
+        self._buffer = ''
+        self.blocks = []
+
+    def binary_data(self, buffer, match, line_start):
+        """ Locates the binary data whose start was matched by `binary_start`
+
+        :param buffer: The received data as a latin-1 string
+        :param match: The match of `binary_start`
+        :param line_start: The index at which the current line starts
+        :type buffer: str
+        :type match: re.Match
+        :type line_start: int
+        :return: (start, end, ends_line) of the data or None if it is incomplete
+        :rtype: tuple
+        """
+        digits = int(buffer[match.start() + 1])
+        start = match.start() + 2 + digits
+        if start > len(buffer):
+            return None
+        return start, start + int(buffer[match.start() + 2:start]), False
+
+    def _take_line(self):
+        """ Removes the next complete line from the buffer or returns None
+        """
+        buffer = self._buffer
+        pieces = []
+        blocks = []
+        line_start = position = 0
+        while True:
+            end = buffer.find(self.termination, position)
+            match = self.binary_start.search(
+                buffer, position, len(buffer) if end < 0 else end)
+            if match is None:
+                if end < 0:
+                    return None
+                pieces.append(buffer[position:end])
+                rest = buffer[end + len(self.termination):]
+                break
+            found = self.binary_data(buffer, match, line_start)
+            if found is None or found[1] > len(buffer):
+                return None
+            start, stop, ends_line = found
+            pieces.append(buffer[position:match.start()])
+            pieces.append('#B{0}'.format(len(blocks)))
+            blocks.append(buffer[start:stop].encode('latin_1'))
+            position = stop
+            if ends_line:
+                rest = buffer[stop:]
+                break
+        self._buffer = rest
+        self.blocks = blocks
+        return ''.join(pieces)
+
+    def block(self, placeholder):
+        """ Returns the binary data referred to by a `#B<n>` placeholder
+        """
+        match = re.match(r'#B(\d+)$', placeholder.strip())
+        if match is None:
+            raise ValueError('{0!r} is not binary data'.format(placeholder))
+        return self.blocks[int(match.group(1))]
+
+    def receive(self, data, now):
+        self._buffer += data.decode('latin_1')
+        out = []
+        while True:
+            line = self._take_line()
+            if line is None:
+                break
+            line = line.strip()
+            if not line:
+                continue
+            replies = []
+            for command in self.split_commands(line):
+                reply = self.handle(command)
+                if reply is not None:
+                    replies.append(reply)
+            if replies:
+                response = (';'.join(replies) + self.termination)
+                out.append((line, response.encode('latin_1'), 0))
+            else:
+                out.append((line, None, 0))
+        return out
+
+    @staticmethod
+    def split_commands(line):
+        """ Splits a line into commands at `;` outside of quoted strings
+        """
+        return [c.strip() for c in re.split(r';(?=(?:[^"]*"[^"]*")*[^"]*$)',
+                                            line) if c.strip()]
+
+    def handle(self, command):
+        raise NotImplementedError
+
+
+class ScpiModel(MessageModel):
+    """ Base class for models of SCPI-style instruments
+
+    Command headers are reduced to a canonical short form so that long and
+    short spellings address the same setting.  Commands with a handler
+    registered in `handlers` (keyed by canonical header without the `?`)
+    are passed to it as `handler(channel_free_header, args, is_query)`; all
+    others are stored in, and answered from, the `settings` dict.
+    """
+    def __init__(self):
+        super(ScpiModel, self).__init__()
+        self.settings = {}
+        self.handlers = {}
+
+    @staticmethod
+    def short_form(header):
+        """ Returns the canonical short form of a SCPI command header
+
+        Each node is reduced to its first four letters, or three if the
+        fourth is a vowel, followed by any numeric suffix.
+        """
+        nodes = []
+        for node in header.strip().lstrip(':').upper().split(':'):
+            if node.startswith('*'):
+                nodes.append(node)
+                continue
+            match = re.match(r"([A-Z_]*)(\d*)$", node)
+            if not match:
+                nodes.append(node)
+                continue
+            letters, suffix = match.groups()
+            if len(letters) > 4:
+                letters = letters[:3] if letters[3] in 'AEIOU' else letters[:4]
+            nodes.append(letters + suffix)
+        return ':'.join(nodes)
+
+    def handle(self, command):
+        header, _, args = command.partition(' ')
+        is_query = header.endswith('?')
+        key = self.short_form(header.rstrip('?'))
+        args = args.strip()
+        for pattern, handler in self.handlers.items():
+            match = re.match('(?:' + pattern + ')$', key)
+            if match:
+                return handler(match, args, is_query)
+        if is_query:
+            return self.settings.get(key, '')
+        self.settings[key] = args
+        return None
+
+
+class ScopeModel(ScpiModel):
+    """ A model of a Tektronix DPO/TDS oscilloscope
+
+    Each analog channel displays a waveform described by an entry in the
+    `signals` dict (shape, frequency, peak-to-peak amplitude, offset and
+    noise level).  `CURVE?` digitizes the displayed record of the
+    `DATA:SOURCE` channel with the scale and position of that channel, and
+    the immediate measurements are computed from the same waveform.
+    """
+    def __init__(self, model='DPO4034', record_length=10000, seed=0):
+        """ The constructor for the ScopeModel class
+
+        :param model: The model name reported by `*IDN?` (DPO or TDS)
+        :param record_length: The number of points in a record
+        :param seed: Seed for the noise generator
+        :type model: str
+        :type record_length: int
+        :type seed: int
+        """
+        super(ScopeModel, self).__init__()
+        self.model = model
+        self.rng = np.random.RandomState(seed)
+        self.signals = {}
+        for n in range(1, 5):
+            self.signals['CH{0}'.format(n)] = {'shape': 'SINE',
+                                               'frequency': 1e3 * n,
+                                               'amplitude': 1.0,
+                                               'offset': 0.0,
+                                               'noise': 0.0}
+            for key, value in (('SCAL', '0.5'), ('POS', '0'),
+                               ('BAND', 'FULL'), ('COUP', 'DC'),
+                               ('DESK', '0'), ('IMP', 'MEG'), ('INV', 'OFF'),
+                               ('OFFS', '0'), ('PROB', '1'),
+                               ('YUNI', '"V"')):
+                self.settings['CH{0}:{1}'.format(n, key)] = value
+        self.settings.update({
+            'HOR:RECO': str(record_length),
+            'HOR:MAIN:SCAL': '1.0E-3',
+            'HOR:MAIN:SECD': '1.0E-3',
+            'HOR:DEL:STAT': '0',
+            'HOR:DEL:TIME': '0',
+            'HOR:RES': 'NORMAL',
+            'HOR:TRIG:POS': '50',
+            'TRIG:A:TYPE': 'EDGE',
+            'TRIG:A:LEV': '0',
+            'TRIG:A:HOLD:TIME': '2.5E-7',
+            'TRIG:A:HOLD:VAL': '2.5E-7',
+            'TRIG:A:EDGE:COUP': 'DC',
+            'TRIG:A:EDGE:SLOP': 'RISE',
+            'TRIG:A:EDGE:SOUR': 'CH1',
+            'DATA:SOUR': 'CH1',
+            'DATA:ENCD': 'ASCII',
+            'DATA:WIDT': '1',
+            'MEAS:IMM:SOUR': 'CH1',
+            'MEAS:IMM:TYPE': 'AMPLITUDE'})
+        self.handlers = {
+            r'\*IDN': self._idn,
+            r'\*WAI|\*CLS|\*RST': lambda m, a, q: None,
+            r'CURV': self._curve,
+            r'DATA:WIDT': self._width,
+            r'MEAS:IMM:(?:VAL|DATA)': self._measure,
+            r'MEAS:IMM:UNIT': self._units}
+
+    def handle(self, command):
+        # The preamble headers do not follow the SCPI short form rules
+        header, _, args = command.partition(' ')
+        node, _, field = header.rstrip('?').upper().partition(':')
+        if node in ('WFMPRE', 'WFMOUTPRE', 'WFMO', 'WFMP'):
+            if not header.endswith('?'):
+                if field in ('BYT_NR', 'BYT_N'):
+                    self.settings['DATA:WIDT'] = args.strip()
+                return None
+            if not field:
+                return ';'.join(' '.join(f) for f in self._preamble_fields())
+            for key, value in self._preamble_fields():
+                if key.startswith(field):
+                    return value
+            return ''
+        return super(ScopeModel, self).handle(command)
+
+    # Waveform generation ---------------------------------------------------
+    def _idn(self, match, args, is_query):
+        return 'TEKTRONIX,{0},SIM0001,CF:91.1CT FV:v1.0'.format(self.model)
+
+    def _width(self, match, args, is_query):
+        if is_query:
+            return self.settings['DATA:WIDT']
+        self.settings['DATA:WIDT'] = args
+        return None
+
+    def _xincr(self):
+        return (float(self.settings['HOR:MAIN:SCAL']) * 10 /
+                int(self.settings['HOR:RECO']))
+
+    def _scaling(self, channel):
+        """ Returns (ymult, yoff, yzero, limit) for the channel's digitizer
+        """
+        width = int(self.settings['DATA:WIDT'])
+        levels = 25.0 if width == 1 else 6400.0
+        limit = 127 if width == 1 else 32767
+        scale = float(self.settings.get(channel + ':SCAL', '1'))
+        position = float(self.settings.get(channel + ':POS', '0'))
+        return scale / levels, position * levels, 0.0, limit
+
+    def waveform(self, channel):
+        """ Returns the displayed record of `channel` in volts
+
+        :param channel: The channel name, e.g. 'CH1'
+        :type channel: str
+        :return: the waveform values
+        :rtype: np.ndarray
+        """
+        signal = self.signals[channel]
+        n = int(self.settings['HOR:RECO'])
+        t = np.arange(n) * self._xincr()
+        phase = 2 * np.pi * signal['frequency'] * t
+        if signal['shape'] == 'SQUARE':
+            shape = np.sign(np.sin(phase))
+        elif signal['shape'] == 'RAMP':
+            shape = 2 * ((signal['frequency'] * t) % 1) - 1
+        elif signal['shape'] == 'DC':
+            shape = np.zeros(n)
+        else:
+            shape = np.sin(phase)
+        values = signal['amplitude'] / 2 * shape + signal['offset']
+        if signal['noise']:
+            values = values + self.rng.normal(0, signal['noise'], n)
+        return values
+
+    def _digitize(self, channel):
+        ymult, yoff, yzero, limit = self._scaling(channel)
+        raw = np.round((self.waveform(channel) - yzero) / ymult + yoff)
+        return np.clip(raw, -limit - 1, limit).astype(int)
+
+    def _curve(self, match, args, is_query):
+        channel = self.settings['DATA:SOUR'].upper()
+        if channel not in self.signals:
+            return ''
+        return ','.join(map(str, self._digitize(channel).tolist()))
+
+    def _preamble_fields(self):
+        channel = self.settings['DATA:SOUR'].upper()
+        ymult, yoff, yzero, limit = self._scaling(channel)
+        width = int(self.settings['DATA:WIDT'])
+        return [('BYT_NR', str(width)),
+                ('BIT_NR', str(8 * width)),
+                ('ENCDG', self.settings['DATA:ENCD']),
+                ('BN_FMT', 'RI'),
+                ('BYT_OR', 'MSB'),
+                ('WFID', '"{0}, DC coupling, simulated"'.format(channel)),
+                ('NR_PT', self.settings['HOR:RECO']),
+                ('PT_FMT', 'Y'),
+                ('XUNIT', '"s"'),
+                ('XINCR', '{0:.6E}'.format(self._xincr())),
+                ('XZERO', '0.0E+0'),
+                ('PT_OFF', '0'),
+                ('YUNIT', '"V"'),
+                ('YMULT', '{0:.6E}'.format(ymult)),
+                ('YOFF', '{0:.6E}'.format(yoff)),
+                ('YZERO', '{0:.6E}'.format(yzero))]
+
+    # Measurements ----------------------------------------------------------
+    def _measure(self, match, args, is_query):
+        channel = self.settings['MEAS:IMM:SOUR'].upper()
+        kind = self.short_form(self.settings['MEAS:IMM:TYPE'])
+        if channel not in self.signals:
+            return ''
+        ymult, yoff, yzero, limit = self._scaling(channel)
+        values = self.waveform(channel)
+        # Clip to the screen as the instrument would
+        values = np.clip(values, (-limit - 1 - yoff) * ymult + yzero,
+                         (limit - yoff) * ymult + yzero)
+        frequency = self.signals[channel]['frequency']
+        results = {'MAX': values.max(),
+                   'MINI': values.min(),
+                   'AMPL': values.max() - values.min(),
+                   'PK2PK': values.max() - values.min(),
+                   'HIGH': values.max(),
+                   'LOW': values.min(),
+                   'MEAN': values.mean(),
+                   'CME': values.mean(),
+                   'RMS': np.sqrt(np.mean(values ** 2)),
+                   'CRMS': np.sqrt(np.mean(values ** 2)),
+                   'FREQ': frequency,
+                   'PERI': 1 / frequency,
+                   'PWID': 0.5 / frequency,
+                   'NWID': 0.5 / frequency,
+                   'PDUT': 50.0,
+                   'NDUT': 50.0}
+        value = '{0:.6E}'.format(float(results.get(kind, 9.91E37)))
+        if self.model.upper().startswith('TDS'):
+            return value + ',0'
+        return value
+
+    def _units(self, match, args, is_query):
+        kind = self.short_form(self.settings['MEAS:IMM:TYPE'])
+        units = {'FREQ': '"Hz"', 'PERI': '"s"', 'PWID': '"s"', 'NWID': '"s"',
+                 'PDUT': '"%"', 'NDUT': '"%"'}
+        return units.get(kind, '"V"')
+
+
+class AFG2225Model(ScpiModel):
+    """ A model of the GW Instek AFG-2225 function generator
+
+    The model enforces the range limits of the real instrument, so the
+    `MIN`/`MAX` queries issued by the driver return values that depend on
+    the function, load and voltage unit of the channel.  Unknown commands
+    are added to the error queue.
+    """
+    functions = {'SIN': 'SIN', 'SQU': 'SQU', 'RAMP': 'RAMP',
+                 'PULS': 'PULS', 'NOIS': 'NOIS', 'ARB': 'ARB', 'USER': 'ARB'}
+    max_frequency = {'SIN': 25e6, 'SQU': 25e6, 'RAMP': 1e6, 'PULS': 25e6,
+                     'NOIS': 25e6, 'ARB': 10e6}
+    # Size and code range of the volatile arbitrary waveform memory
+    arb_length = 4096
+    arb_full_scale = 511
+
+    def __init__(self):
+        super(AFG2225Model, self).__init__()
+        self.errors = deque()
+        self._segments = deque()
+        self.esr = 0
+        self.arb = np.zeros(self.arb_length, dtype=int)
+        self.channels = {}
+        for n in (1, 2):
+            self.channels[n] = {'FUNC': 'SIN', 'FREQ': 1e3, 'AMPL': 1.0,
+                                'DCO': 0.0, 'SQU:DCYC': 50.0,
+                                'RAMP:SYMM': 50.0, 'PHAS': 0.0,
+                                'OUTP': '0', 'LOAD': 'DEF', 'UNIT': 'VPP',
+                                'FREQ:STAR': 100.0, 'FREQ:STOP': 1e3,
+                                'SWE:STAT': '0', 'SWE:SPAC': 'LIN',
+                                'SWE:TIME': 1.0, 'SWE:SOUR': 'IMM',
+                                'ARB:OUTP': (0, 2)}
+        self.handlers = {
+            r'\*IDN': lambda m, a, q: 'GW INSTEK,AFG-2225,SIM0002,V1.00',
+            r'\*CLS': self._cls,
+            r'\*RST|\*WAI': lambda m, a, q: None,
+            r'\*ESR': self._esr,
+            r'\*STB': self._stb,
+            r'SYST:ERR': self._error,
+            r'SOUR([12]):FUNC': self._function,
+            r'SOUR([12]):(FREQ|AMPL|DCO|DCOF|SQU:DCYC|RAMP:SYMM|PHAS)':
+                self._numeric,
+            r'SOUR([12]):APPL:(SIN|SQU|RAMP|PULS|NOIS|USER)': self._apply,
+            r'SOUR([12]):(FREQ:STAR|FREQ:STOP|SWE:STAT|SWE:SPAC|SWE:TIME|'
+            r'SWE:SOUR)': self._sweep,
+            r'SOUR([12]):PHAS:SYNC': lambda m, a, q: None,
+            r'DATA:DAC': self._dac,
+            r'SOUR([12]):ARB:OUTP': self._arb_output,
+            r'SOUR([12]):VOLT:UNIT': self._unit,
+            r'OUTP([12])': self._output,
+            r'OUTP([12]):LOAD': self._load}
+
+    def handle(self, command):
+        key = self.short_form(command.partition(' ')[0].rstrip('?'))
+        for pattern in self.handlers:
+            if re.match('(?:' + pattern + ')$', key):
+                return super(AFG2225Model, self).handle(command)
+        self.push_error(-113, 'Undefined header')
+        return None
+
+    # Error reporting -------------------------------------------------------
+    def push_error(self, code, message):
+        """ Adds an entry to the error queue and flags a command error
+        """
+        self.errors.append((code, message))
+        self.esr |= 32
+
+    def _cls(self, match, args, is_query):
+        self.errors.clear()
+        self._segments.clear()
+        self.esr = 0
+        return None
+
+    def _esr(self, match, args, is_query):
+        out, self.esr = self.esr, 0
+        return str(out)
+
+    def _stb(self, match, args, is_query):
+        return str(4 if (self.errors or self._segments) else 0)
+
+    def _error(self, match, args, is_query):
+        # The instrument splits successive entries after the error code of
+        # the next entry, so the replies read "<code>", "<message>.<code>",
+        # ..., "<message>."
+        if not self._segments and self.errors:
+            entries = list(self.errors)
+            self.errors.clear()
+            self._segments.append(str(entries[0][0]))
+            for (code, message), following in zip(entries, entries[1:]):
+                self._segments.append('{0}.{1}'.format(message, following[0]))
+            self._segments.append('{0}.'.format(entries[-1][1]))
+        if not self._segments:
+            return 'No error.'
+        return self._segments.popleft()
+
+    # Settings --------------------------------------------------------------
+    def _limits(self, channel, name):
+        state = self.channels[channel]
+        vmax = 10.0 if state['LOAD'] == 'DEF' else 20.0
+        if name == 'FREQ':
+            return 1e-6, self.max_frequency[state['FUNC']]
+        if name == 'AMPL':
+            low, high = vmax / 10e3, vmax
+            if state['UNIT'] == 'VRMS':
+                low, high = low / 2 / np.sqrt(2), high / 2 / np.sqrt(2)
+            return low, high
+        if name in ('DCO', 'DCOF'):
+            limit = vmax / 2 - state['AMPL'] / 2
+            return -limit, limit
+        if name == 'SQU:DCYC':
+            return (1.0, 99.0) if state['FREQ'] <= 100e3 else (20.0, 80.0)
+        if name == 'RAMP:SYMM':
+            return 0.0, 100.0
+        return -180.0, 180.0
+
+    def _numeric(self, match, args, is_query):
+        channel, name = int(match.group(1)), match.group(2)
+        name = 'DCO' if name == 'DCOF' else name
+        low, high = self._limits(channel, name)
+        if is_query:
+            if args.upper().startswith('MIN'):
+                return repr(float(low))
+            if args.upper().startswith('MAX'):
+                return repr(float(high))
+            return repr(float(self.channels[channel][name]))
+        try:
+            value = float(args)
+        except ValueError:
+            self.push_error(-104, 'Data type error')
+            return None
+        if not low <= value <= high:
+            self.push_error(-222, 'Data out of range')
+            value = min(max(value, low), high)
+        self.channels[channel][name] = value
+        return None
+
+    def _apply(self, match, args, is_query):
+        channel, shape = int(match.group(1)), match.group(2)
+        if is_query:
+            return self._apply_query(channel)
+        self.channels[channel]['FUNC'] = self.functions[shape]
+        for name, value in zip(('FREQ', 'AMPL', 'DCO'), args.split(',')):
+            value = value.strip()
+            if value and not value.upper().startswith('DEF'):
+                self._numeric(re.match(r'(\d)(.*)', '{0}{1}'.format(channel, name)),
+                              value, False)
+        return None
+
+    def _apply_query(self, channel):
+        state = self.channels[channel]
+        return '"{0} {1!r},{2!r},{3!r}"'.format(state['FUNC'], state['FREQ'],
+                                               state['AMPL'], state['DCO'])
+
+    def _sweep(self, match, args, is_query):
+        channel, name = int(match.group(1)), match.group(2)
+        if is_query:
+            return str(self.channels[channel][name])
+        if name == 'SWE:STAT':
+            args = '1' if args.upper() in ('ON', '1') else '0'
+        elif name in ('SWE:SPAC', 'SWE:SOUR'):
+            args = self.short_form(args)
+        self.channels[channel][name] = args
+        return None
+
+    def _dac(self, match, args, is_query):
+        fields = [f.strip() for f in args.split(',')]
+        if is_query:
+            start, length = int(fields[1]), int(fields[2])
+            return ','.join(str(v) for v in self.arb[start:start + length])
+        if len(fields) < 3 or self.short_form(fields[0]) != 'VOL':
+            self.push_error(-109, 'Missing parameter')
+            return None
+        start = int(fields[1])
+        if fields[2].startswith('#B'):
+            codes = np.frombuffer(self.block(fields[2]), dtype='>i2')
+        else:
+            codes = np.array([int(f) for f in fields[2:]])
+        if (start + len(codes) > self.arb_length or
+                np.any(np.abs(codes) > self.arb_full_scale)):
+            self.push_error(-222, 'Data out of range')
+            return None
+        self.arb[start:start + len(codes)] = codes
+        return None
+
+    def _arb_output(self, match, args, is_query):
+        channel = int(match.group(1))
+        if is_query:
+            return '{0},{1}'.format(*self.channels[channel]['ARB:OUTP'])
+        start, length = [int(f) for f in args.split(',')]
+        if length < 2 or start + length > self.arb_length:
+            self.push_error(-222, 'Data out of range')
+            return None
+        self.channels[channel]['ARB:OUTP'] = (start, length)
+        self.channels[channel]['FUNC'] = 'ARB'
+        return None
+
+    def _function(self, match, args, is_query):
+        channel = int(match.group(1))
+        if is_query:
+            return self.channels[channel]['FUNC']
+        key = self.short_form(args)
+        if key not in self.functions:
+            self.push_error(-224, 'Illegal parameter value')
+            return None
+        self.channels[channel]['FUNC'] = self.functions[key]
+        return None
+
+    def _unit(self, match, args, is_query):
+        channel = int(match.group(1))
+        if is_query:
+            return self.channels[channel]['UNIT']
+        self.channels[channel]['UNIT'] = args.upper()
+        return None
+
+    def _output(self, match, args, is_query):
+        channel = int(match.group(1))
+        if is_query:
+            return self.channels[channel]['OUTP']
+        self.channels[channel]['OUTP'] = '1' if args.upper() in ('ON', '1') \
+            else '0'
+        return None
+
+    def _load(self, match, args, is_query):
+        channel = int(match.group(1))
+        if is_query:
+            return self.channels[channel]['LOAD']
+        self.channels[channel]['LOAD'] = 'INF' if args.upper().startswith(
+            'INF') else 'DEF'
+        return None
+
+
+class BKFunGenModel(MessageModel):
+    """ A model of the BK Precision 4050 series function generators
+
+    The `BASIC_WAVE` and `OUTPUT` commands (and their short forms `BSWV` and
+    `OUTP`) are supported for both channels.  Replies use long or short
+    headers according to the last `COMM_HEADER` command.
+    """
+    short_headers = {'BASIC_WAVE': 'BSWV', 'OUTPUT': 'OUTP',
+                     'COMM_HEADER': 'CHDR', 'ARBWAVE': 'ARWV'}
+    # The samples of a WVDT command run to the end of the write
+    binary_start = re.compile(r'(?<=WAVEDATA,)')
+
+    def __init__(self):
+        super(BKFunGenModel, self).__init__()
+        self.header = 'LONG'
+        self.waves = {}
+        self.outputs = {}
+        self.arbs = {}
+        self.selected_arbs = {}
+        for n in (1, 2):
+            self.waves[n] = [('WVTP', 'SINE'), ('FRQ', 1000.0),
+                             ('AMP', 4.0), ('OFST', 0.0), ('PHSE', 0.0)]
+            self.outputs[n] = ['OFF', 'HZ']
+
+    def binary_data(self, buffer, match, line_start):
+        return match.start(), len(buffer), True
+
+    def _header(self, name):
+        if self.header == 'LONG':
+            return name
+        return self.short_headers.get(name, name)
+
+    def _canonical(self, name):
+        for long_name, short_name in self.short_headers.items():
+            if name in (long_name, short_name):
+                return long_name
+        return name
+
+    def handle(self, command):
+        header, _, args = command.partition(' ')
+        is_query = header.endswith('?')
+        header = header.rstrip('?').upper()
+        if header == '*IDN':
+            return 'BK PRECISION,4054,SIM0003,1.01.01'
+        match = re.match(r"C([12]):(\w+)$", header)
+        if self._canonical(header) == 'COMM_HEADER':
+            if is_query:
+                return self.header
+            self.header = 'LONG' if args.upper().startswith('L') else 'SHORT'
+            return None
+        if not match:
+            return None
+        channel, name = int(match.group(1)), self._canonical(match.group(2))
+        prefix = 'C{0}:{1} '.format(channel, self._header(name))
+        if name == 'BASIC_WAVE':
+            if is_query:
+                return prefix + self._format_wave(channel)
+            self._set_wave(channel, args)
+        elif name == 'OUTPUT':
+            if is_query:
+                return prefix + '{0},LOAD,{1}'.format(*self.outputs[channel])
+            fields = [f.strip().upper() for f in args.split(',')]
+            if fields and fields[0] in ('ON', 'OFF'):
+                self.outputs[channel][0] = fields[0]
+            if 'LOAD' in fields and fields.index('LOAD') + 1 < len(fields):
+                self.outputs[channel][1] = fields[fields.index('LOAD') + 1]
+        elif name == 'WVDT':
+            fields = [f.strip() for f in args.split(',')]
+            options = dict(zip(fields[::2], fields[1::2]))
+            if 'WVNM' in options and 'WAVEDATA' in options:
+                self.arbs[options['WVNM']] = np.frombuffer(
+                    self.block(options['WAVEDATA']), dtype='<i2')
+        elif name == 'ARBWAVE':
+            if is_query:
+                return prefix + 'NAME,{0}'.format(
+                    self.selected_arbs.get(channel, ''))
+            fields = [f.strip() for f in args.split(',')]
+            if len(fields) == 2 and fields[0].upper() == 'NAME' and \
+                    fields[1] in self.arbs:
+                self.selected_arbs[channel] = fields[1]
+                self._set_wave(channel, 'WVTP,ARB')
+        return None
+
+    def _set_wave(self, channel, args):
+        fields = [f.strip() for f in args.split(',')]
+        wave = dict(self.waves[channel])
+        order = [k for k, v in self.waves[channel]]
+        for key, value in zip(fields[::2], fields[1::2]):
+            key = key.upper()
+            if key != 'WVTP':
+                value = float(re.match(r"[-+\d.eE]+", value).group(0))
+            else:
+                value = value.upper()
+            if key not in wave:
+                order.append(key)
+            wave[key] = value
+        self.waves[channel] = [(k, wave[k]) for k in order]
+
+    def _format_wave(self, channel):
+        units = {'FRQ': 'HZ', 'AMP': 'V', 'OFST': 'V', 'VAR': 'V',
+                 'MEAN': 'V', 'DLY': 'S', 'SYM': '', 'DUTY': '', 'PHSE': ''}
+        fields = []
+        wave = dict(self.waves[channel])
+        for key, value in self.waves[channel]:
+            if key == 'WVTP':
+                fields.append('WVTP,' + value)
+                continue
+            fields.append('{0},{1:g}{2}'.format(key, value, units.get(key, '')))
+            if key == 'FRQ' and value:
+                fields.append('PERI,{0:g}S'.format(1 / value))
+            if key == 'AMP':
+                high = wave.get('OFST', 0) + value / 2
+                low = wave.get('OFST', 0) - value / 2
+                fields.append('HLEV,{0:g}V'.format(high))
+                fields.append('LLEV,{0:g}V'.format(low))
+        return ','.join(fields)
+
+
+class RelayModel(SimModel):
+    """ A model of the NCD R120HPRS RS-232 relay controller
+
+    Every command is the byte 254 followed by a command byte.  Status
+    queries are answered with a single byte.
+    """
+    def __init__(self):
+        self.state = 0
+        self.default_state = 0
+        self._pending = None
+
+    def receive(self, data, now):
+        out = []
+        for code in bytearray(data):
+            if self._pending is None:
+                if code == 254:
+                    self._pending = code
+                continue
+            self._pending = None
+            response = None
+            if code == 0:
+                self.state = 0
+            elif code == 1:
+                self.state = 1
+            elif code == 4:
+                response = bytes(bytearray([self.state]))
+            elif code == 8:
+                self.default_state = self.state
+            elif code == 9:
+                response = bytes(bytearray([self.default_state]))
+            out.append(('254,{0}'.format(code), response, 0))
+        return out
+
+
+class DewMasterModel(SimModel):
+    """ A model of the Edgetech DewMaster chilled mirror hygrometer
+
+    The model mimics the terminal-style interface of the instrument: the
+    first character of a command is answered with 'INPUT: X', subsequent
+    characters are echoed and a carriage return executes the command.  The
+    'P' (poll), 'ST' (status), 'AV' (average) and 'O' (output interval)
+    commands are implemented; once an output interval has been set a data
+    line is produced every interval.
+    """
+    measurements = ('DP', 'RH', 'TA')
+    trailer_delay = 0.25
+
+    def __init__(self):
+        self.average = 4
+        self.interval = None
+        self.status = 'SERVOLOCK'
+        self._line = ''
+        self._prompt = None
+        self._next_output = None
+
+    def values(self, t):
+        """ Returns the simulated (dew point, RH, ambient) values at time `t`
+        """
+        phase = 2 * np.pi * t / 3600.0
+        return (-10.0 + 2.0 * np.sin(phase), 30.0 + 5.0 * np.cos(phase),
+                22.0 + 0.5 * np.sin(phase / 2))
+
+    def data_line(self, t):
+        """ Returns the data line the instrument prints at time `t`
+        """
+        stamp = datetime.fromtimestamp(t).strftime('%m/%d/%y %H:%M:%S')
+        units = ('C', '%', 'C')
+        fields = ['{0} = {1:7.2f} {2}'.format(m, v, u) for m, v, u in
+                  zip(self.measurements, self.values(t), units)]
+        return '{0}  {1}  {2}'.format(stamp, '  '.join(fields), self.status)
+
+    def receive(self, data, now):
+        out = []
+        for char in data.decode('latin_1'):
+            if char == '\n':
+                continue
+            if char == '\r':
+                line, self._line = self._line, ''
+                out.extend(self._execute(line.strip(), now))
+            elif not self._line and self._prompt is None:
+                self._line = char
+                out.append((char, 'INPUT: {0}'.format(char).encode(), 0))
+            else:
+                self._line += char
+                out.append((char, char.encode(), 0))
+        return out
+
+    def _reply(self, command, text, trailer=True):
+        out = [(command, ('\r\n' + text + '\r\n').encode(), 0)]
+        if trailer:
+            out.append(('', b'\r\n', self.trailer_delay))
+        return out
+
+    def _execute(self, line, now):
+        prompt, self._prompt = self._prompt, None
+        if prompt == 'AV':
+            try:
+                self.average = min(max(int(line), 1), 16)
+            except ValueError:
+                pass
+            return self._reply(line, 'Number of data points to average = '
+                               '{0}'.format(self.average))
+        if prompt == 'O':
+            try:
+                self.interval = max(int(line), 1)
+                self._next_output = now + self.interval
+            except ValueError:
+                pass
+            return self._reply(line, 'The new serial interval is '
+                               '{0}'.format(self.interval))
+        command = line.upper()
+        if command == 'P':
+            return self._reply(command, self.data_line(now))
+        if command == 'ST':
+            report = ['DewMaster System Status (simulated)',
+                      'Number of data points to average = {0}'.format(
+                          self.average),
+                      'Serial output interval = {0}'.format(self.interval),
+                      'Status: {0}'.format(self.status),
+                      'Press ENTER to continue.....']
+            return self._reply(command, '\r\n'.join(report), trailer=False)
+        if command == 'AV':
+            self._prompt = 'AV'
+            return self._reply(command, 'Enter number of data points to '
+                               'average (1-16): ', trailer=False)
+        if command == 'O':
+            self._prompt = 'O'
+            return self._reply(command, 'Enter serial output interval in '
+                               'seconds: ', trailer=False)
+        return self._reply(command, '')
+
+    def next_unsolicited(self):
+        return self._next_output
+
+    def unsolicited(self, now):
+        out = []
+        while self._next_output is not None and self._next_output <= now:
+            t = self._next_output
+            out.append((t, (self.data_line(t) + '\r\n').encode()))
+            self._next_output = t + self.interval
+        return out
@@ -0,0 +1,360 @@
+""" Fast open-loop parameter sweeps for the function generators
+
+Stepping `AFG2225.set_frequency` or `BKFunGen.set_wave` through thousands
+of setpoints is slow because every step is individually range checked,
+verified and padded with sleeps.  A `Sweep` instead validates the whole
+array of setpoints up front, writes each setpoint without verification at
+times scheduled on the monotonic clock (so that timing errors do not
+accumulate), and reads the parameter back only at configurable checkpoints.
+The time at which each setpoint was actually written is recorded so that
+measurements taken during the sweep can be aligned afterwards.
+
+Example::
+
+    sweep = Sweep(afg, channel=1, parameter='frequency', checkpoint_every=100)
+    result = sweep.run(np.logspace(1, 5, 2000), dwell=0.01)
+    result.completed  # seconds after result.start_time at which each step was applied
+
+When the setpoints are evenly spaced on a linear or logarithmic scale,
+`run(..., native=True)` uses the generator's own sweep mode instead, in
+which case the step times are the nominal ones.
+"""
+
+import logging
+import time
+import numpy as np
+from labchat.gwinstek import AFG2225
+from labchat.bkprecision import BKFunGen
+
+__email__ = "chrisark7@gmail.com"
+__status__ = "Development"
+
+logger = logging.getLogger(__name__)
+
+
+###############################################################################
+# Generator Adapters
+###############################################################################
+class _AFG2225Adapter(object):
+    """ Sweep commands for the GW Instek AFG2225
+    """
+    parameters = ('frequency', 'amplitude', 'offset', 'phase')
+
+    def __init__(self, generator):
+        self.generator = generator
+
+    def limits(self, channel, parameter):
+        min_value, max_value, cached = self.generator._get_limits(channel, parameter)
+        return min_value, max_value
+
+    def command(self, channel, parameter, value):
+        return 'SOURCE{0}:{1} {2!r}'.format(
+            channel, AFG2225._NUMERIC_HEADERS[parameter], float(value))
+
+    def send(self, command):
+        self.generator.write(command)
+
+    def read_back(self, channel, parameter):
+        return float(self.generator.query('SOURCE{0}:{1}?'.format(
+            channel, AFG2225._NUMERIC_HEADERS[parameter])))
+
+    def started(self, channel, parameter):
+        # The sweep writes behind the setters' backs
+        self.generator.invalidate(channel, parameter)
+
+    def finished(self, channel, parameter, value, verified):
+        self.generator._record_set(channel, parameter, verified, float(value))
+
+    def native(self, channel, start, stop, spacing, sweep_time):
+        return ['SOURCE{0}:FREQUENCY:START {1!r}'.format(channel, float(start)),
+                'SOURCE{0}:FREQUENCY:STOP {1!r}'.format(channel, float(stop)),
+                'SOURCE{0}:SWEEP:SPACING {1}'.format(channel, spacing),
+                'SOURCE{0}:SWEEP:TIME {1!r}'.format(channel, float(sweep_time)),
+                'SOURCE{0}:SWEEP:SOURCE IMMEDIATE'.format(channel),
+                'SOURCE{0}:SWEEP:STATE ON'.format(channel)]
+
+    def stop_native(self, channel):
+        return ['SOURCE{0}:SWEEP:STATE OFF'.format(channel)]
+
+
+class _BKFunGenAdapter(object):
+    """ Sweep commands for the BK Precision function generators
+    """
+    parameters = ('frequency', 'amplitude', 'offset')
+    _keys = {'frequency': 'FRQ', 'amplitude': 'AMP', 'offset': 'OFST'}
+    # The same limits enforced by BKFunGen.set_wave
+    _limits = {'frequency': (1e-6, 25e6), 'amplitude': (0.004, np.inf),
+               'offset': (-np.inf, np.inf)}
+
+    def __init__(self, generator):
+        self.generator = generator
+
+    def limits(self, channel, parameter):
+        return self._limits[parameter]
+
+    def command(self, channel, parameter, value):
+        return 'C{0}:BASIC_WAVE {1},{2!r}'.format(channel, self._keys[parameter],
+                                                 float(value))
+
+    def send(self, command):
+        self.generator.write(command)
+
+    def read_back(self, channel, parameter):
+        self.generator.invalidate(channel)
+        value = getattr(self.generator.get_wave(channel), parameter)
+        if value is None:
+            raise IOError('The function generator did not report its {0}'.format(parameter))
+        return value
+
+    def started(self, channel, parameter):
+        # The sweep writes behind set_wave's back
+        self.generator.invalidate(channel)
+
+    def finished(self, channel, parameter, value, verified):
+        pass
+
+    def native(self, channel, start, stop, spacing, sweep_time):
+        return ['C{0}:SWWV STATE,ON,TIME,{1!r}S,START,{2!r}HZ,STOP,{3!r}HZ,'
+                'SWMD,{4},DIR,UP,TRSR,INT'.format(channel, float(sweep_time),
+                                                  float(start), float(stop),
+                                                  'LINE' if spacing == 'LINEAR' else 'LOG')]
+
+    def stop_native(self, channel):
+        return ['C{0}:SWWV STATE,OFF'.format(channel)]
+
+
+def _adapter(generator):
+    if isinstance(generator, AFG2225):
+        return _AFG2225Adapter(generator)
+    if isinstance(generator, BKFunGen):
+        return _BKFunGenAdapter(generator)
+    raise TypeError('sweeps are supported for AFG2225 and BKFunGen instances')
+
+
+###############################################################################
+# Sweep
+###############################################################################
+class SweepResult(object):
+    """ The outcome of a sweep
+
+    All times are in seconds relative to `start_time`, which is a
+    `time.time()` timestamp.
+
+      - setpoints: the values written
+      - scheduled: the time at which each step was due
+      - sent: the time at which each write began
+      - completed: the time at which each write returned
+      - checkpoints: a list of (index, readback, ok) tuples
+      - native: True if the generator's own sweep mode was used, in which
+        case `sent` and `completed` are the nominal step times
+    """
+    def __init__(self, setpoints, start_time, native=False):
+        n = len(setpoints)
+        self.setpoints = np.asarray(setpoints, dtype=float)
+        self.start_time = start_time
+        self.scheduled = np.full(n, np.nan)
+        self.sent = np.full(n, np.nan)
+        self.completed = np.full(n, np.nan)
+        self.checkpoints = []
+        self.native = native
+
+    @property
+    def lateness(self):
+        """ How late each write began compared with its schedule, in seconds
+        """
+        return self.sent - self.scheduled
+
+    @property
+    def verified(self):
+        """ True if every checkpoint matched its setpoint
+        """
+        return all(ok for index, value, ok in self.checkpoints)
+
+    def absolute_times(self):
+        """ Returns the completion times as `time.time()` timestamps
+        """
+        return self.start_time + self.completed
+
+
+class Sweep(object):
+    """ Steps one parameter of a function generator through an array
+
+    The setpoints are written open-loop: each write is issued when its
+    scheduled time arrives, without waiting for the instrument to confirm
+    it.  The parameter is read back every `checkpoint_every` steps and after
+    the last step.
+    """
+    def __init__(self, generator, channel=1, parameter='frequency',
+                 checkpoint_every=0, rtol=1e-5, atol=0.0, on_mismatch='warn',
+                 spin=1e-3):
+        """ The constructor for the Sweep class
+
+        :param generator: The AFG2225 or BKFunGen instance
+        :param channel: The channel to sweep (1 or 2)
+        :param parameter: 'frequency', 'amplitude', 'offset' (or 'phase' on the AFG2225)
+        :param checkpoint_every: Read back every n steps; 0 reads back only after the last step
+        :param rtol: Relative tolerance of the checkpoint comparison
+        :param atol: Absolute tolerance of the checkpoint comparison
+        :param on_mismatch: 'warn' to log a failed checkpoint, 'raise' to abort the sweep
+        :param spin: The time in seconds before each step spent busy-waiting instead of sleeping
+        :type channel: int
+        :type parameter: str
+        :type checkpoint_every: int
+        :type rtol: float
+        :type atol: float
+        :type on_mismatch: str
+        :type spin: float
+        """
+        self.adapter = _adapter(generator)
+        if channel not in [1, 2]:
+            raise ValueError('channel should be 1 or 2')
+        if parameter not in self.adapter.parameters:
+            raise ValueError('parameter should be one of {0}'.format(
+                ', '.join(self.adapter.parameters)))
+        if on_mismatch not in ('warn', 'raise'):
+            raise ValueError("on_mismatch should be 'warn' or 'raise'")
+        self.generator = generator
+        self.channel = channel
+        self.parameter = parameter
+        self.checkpoint_every = int(checkpoint_every)
+        self.rtol = rtol
+        self.atol = atol
+        self.on_mismatch = on_mismatch
+        self.spin = spin
+
+    def validate(self, setpoints):
+        """ Checks that every setpoint is within the instrument's limits
+
+        :param setpoints: The setpoints of the sweep
+        :type setpoints: np.ndarray
+        :return: The setpoints as a float array
+        :rtype: np.ndarray
+        """
+        setpoints = np.asarray(setpoints, dtype=float)
+        if setpoints.ndim != 1 or not len(setpoints):
+            raise ValueError('setpoints should be a non-empty 1d array')
+        if not np.all(np.isfinite(setpoints)):
+            raise ValueError('setpoints should be finite')
+        min_value, max_value = self.adapter.limits(self.channel, self.parameter)
+        bad = np.flatnonzero((setpoints < min_value) | (setpoints > max_value))
+        if len(bad):
+            raise ValueError('{0} of the setpoints are outside of the range [{1}, {2}], '
+                             'the first at index {3}'.format(len(bad), min_value,
+                                                              max_value, bad[0]))
+        return setpoints
+
+    def _wait_until(self, target):
+        while True:
+            remaining = target - time.perf_counter()
+            if remaining <= 0:
+                return
+            if remaining > self.spin:
+                time.sleep(remaining - self.spin)
+
+    def _checkpoint(self, result, index):
+        expected = result.setpoints[index]
+        value = self.adapter.read_back(self.channel, self.parameter)
+        ok = bool(np.isclose(value, expected, rtol=self.rtol, atol=self.atol))
+        result.checkpoints.append((index, value, ok))
+        if not ok:
+            message = 'Step {0}: {1} read back as {2} instead of {3}'.format(
+                index, self.parameter, value, expected)
+            if self.on_mismatch == 'raise':
+                raise IOError(message)
+            logger.warning(message)
+        return ok
+
+    def run(self, setpoints, dwell, callback=None, native=False):
+        """ Runs the sweep
+
+        Step i is written at `i * dwell` seconds after the start.  If a write
+        or checkpoint overruns, the following steps are written as soon as
+        possible until the schedule is caught up; the schedule itself does
+        not drift.
+
+        :param setpoints: The values to step through
+        :param dwell: The time between steps in seconds
+        :param callback: Called as callback(index, value, completed) after each write
+        :param native: Use the generator's own sweep mode if the setpoints allow it
+        :type setpoints: np.ndarray
+        :type dwell: float
+        :type callback: callable
+        :type native: bool
+        :return: The setpoints and timing of the sweep
+        :rtype: SweepResult
+        """
+        setpoints = self.validate(setpoints)
+        if dwell < 0:
+            raise ValueError('dwell should not be negative')
+        if native:
+            spacing = self._native_spacing(setpoints)
+            if spacing is not None:
+                return self._run_native(setpoints, dwell, spacing)
+            logger.info('Setpoints are not evenly spaced for a native sweep; '
+                        'stepping them instead')
+        adapter, channel, parameter = self.adapter, self.channel, self.parameter
+        commands = [adapter.command(channel, parameter, value) for value in setpoints]
+        result = SweepResult(setpoints, time.time())
+        adapter.started(channel, parameter)
+        verified = False
+        t0 = time.perf_counter()
+        last = len(setpoints) - 1
+        for i, command in enumerate(commands):
+            scheduled = i * dwell
+            self._wait_until(t0 + scheduled)
+            sent = time.perf_counter()
+            adapter.send(command)
+            completed = time.perf_counter()
+            result.scheduled[i] = scheduled
+            result.sent[i] = sent - t0
+            result.completed[i] = completed - t0
+            if callback is not None:
+                callback(i, setpoints[i], completed - t0)
+            if i == last or (self.checkpoint_every and
+                             (i + 1) % self.checkpoint_every == 0):
+                verified = self._checkpoint(result, i)
+        # Convert from the monotonic clock to the start of the sweep
+        offset = t0 - time.perf_counter() + time.time() - result.start_time
+        result.sent += offset
+        result.completed += offset
+        result.scheduled += offset
+        adapter.finished(channel, parameter, setpoints[-1], verified)
+        late = np.count_nonzero(result.lateness > dwell)
+        if late:
+            logger.info('{0} of {1} steps started more than one dwell time late'.format(
+                late, len(setpoints)))
+        return result
+
+    @staticmethod
+    def _native_spacing(setpoints):
+        if len(setpoints) < 2 or setpoints[-1] <= setpoints[0]:
+            return None
+        steps = np.diff(setpoints)
+        if np.allclose(steps, steps[0], rtol=1e-6):
+            return 'LINEAR'
+        if setpoints[0] > 0:
+            ratios = setpoints[1:] / setpoints[:-1]
+            if np.allclose(ratios, ratios[0], rtol=1e-6):
+                return 'LOGARITHMIC'
+        return None
+
+    def _run_native(self, setpoints, dwell, spacing):
+        if self.parameter != 'frequency':
+            raise ValueError('native sweeps are only available for frequency')
+        sweep_time = dwell * (len(setpoints) - 1)
+        commands = self.adapter.native(self.channel, setpoints[0], setpoints[-1],
+                                       spacing, sweep_time)
+        result = SweepResult(setpoints, time.time(), native=True)
+        for command in commands:
+            self.adapter.send(command)
+        nominal = np.arange(len(setpoints)) * dwell
+        result.scheduled[:] = nominal
+        result.sent[:] = nominal
+        result.completed[:] = nominal
+        return result
+
+    def stop_native(self):
+        """ Turns the generator's own sweep mode off again
+        """
+        for command in self.adapter.stop_native(self.channel):
+            self.adapter.send(command)
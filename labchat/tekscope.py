@@ -7,10 +7,12 @@ Note that the computer must have an visa installation (such as NI-Visa) in order
 for pyvisa to be able to communicate with the oscilloscope.
 """
 
-from time import sleep, time
 import logging
 import numpy as np
 import visa
+from labchat import tracing
+from labchat.pacing import Pacer
+from labchat.tracing import sleep
 
 __author__ = "Chris Mueller"
 __email__ = "chrisark7@gmail.com"
@@ -28,7 +30,7 @@ class Scope(object):
     Valid commands can be found in the TEK-XXXX-Series-programing-manual available from the
     Tektronix website.
     """
-    def __init__(self, device_id=0, timeout=20):
+    def __init__(self, device_id=0, timeout=20, resource_manager=None, min_gap=0.1):
         """ Initializes an instance of the Scope class.
 
         This function searches the devices connected to the computer and initializes the Scope
@@ -37,15 +39,29 @@ class Scope(object):
 
         The list of devices connected to the computer will be printed to the log.
 
+        The `resource_manager` argument can be used to supply an object other than
+        `visa.ResourceManager()` to find and open the device, such as the `SimResourceManager` in
+        the `labchat.simulator` module.
+
+        Consecutive transfers are spaced by at least `min_gap` seconds (see
+        `labchat.pacing.Pacer`).
+
         :param device_id: Integer or string which describes the device to connect to
         :param timeout: The default timeout value to use when interacting with the scope in seconds
+        :param resource_manager: The resource manager used to open the device
+        :param min_gap: The minimum time between transfers in seconds
         :type device_id: int or str
         :type timeout: int or float
+        :type resource_manager: visa.ResourceManager
+        :type min_gap: float
         :return: An instance of the Scope class
         :rtype: Scope
         """
         # Get list of devices connected to the computer
-        rm = visa.ResourceManager()
+        if resource_manager is None:
+            rm = visa.ResourceManager()
+        else:
+            rm = resource_manager
         devices = rm.list_resources()
         # Check device list
         if not devices:
@@ -77,6 +93,7 @@ class Scope(object):
         self.resource_manager = rm
         self.is_open = False
         self.device = None
+        self.pacer = Pacer(min_gap)
         self.device_type = None
         self.measure_type = None
 
@@ -99,6 +116,7 @@ class Scope(object):
             cnt = 0
             while not idstr and cnt < 5:
                 sleep(5)
+                tracing.note_retry()
                 idstr = self.query('*IDN?')
                 cnt += 1
         logger.info('Successfully opened communication to device: {0}'.format(idstr))
@@ -128,6 +146,7 @@ class Scope(object):
         self.device.flush(mask=64)
         self.device.flush(mask=128)
 
+    @tracing.traced('write')
     def write(self, command):
         """ Writes a command to the scope
 
@@ -138,51 +157,42 @@ class Scope(object):
         """
         if not self.is_open:
             raise IOError('Communication to scope is closed')
+        self.pacer.wait()
         try:
-            sleep(0.1)
             out = self.device.write(command)
         except visa.VisaIOError:
             raise ValueError('command {0} timed out; most likely it is not a valid command'.format(command))
+        finally:
+            self.pacer.mark()
         return out
 
+    @tracing.traced('read')
     def read(self, timeout=0.5):
         """ Reads the most recent output from the scope
-        
-        The timeout argument is only used for USB devices which don't support the 
-        bytes_in_buffer property.
 
-        :param timeout: The timeout length in seconds
+        The read returns as soon as the message terminator arrives.  Devices
+        which support the bytes_in_buffer property (and TDS scopes) are given
+        5 seconds longer than the timeout for the reply to start.
+
+        :param timeout: The timeout length, passed to pyvisa in milliseconds
         :type timeout: float
         :return: The output of the read command
         :rtype: str
         """
+        reply_window = 5
         if not self.is_open:
             raise IOError('Communication to scope is closed')
         if self.device_type == 'TDS' or hasattr(self.device, 'bytes_in_buffer'):
-            t0, tn = time(), 0
-            self.device.timeout = timeout
-            while (not self.device.bytes_in_buffer) and (tn < 5):
-                sleep(0.1)
-                tn = time() - t0
-            else:
-                sleep(0.1)
-                try:
-                    out = self.device.read()
-                    self.device.timeout = self.timeout
-                except visa.VisaIOError:
-                    self.device.timeout = self.timeout
-                    out = ''
-                    logger.debug('Device did not return anything when trying to read')
+            out = self.pacer.read(self.device, reply_window + timeout*1e-3)
         else:
-            self.device.timeout = timeout
-            try:
-                out = self.device.read()
-            except visa.VisaIOError:
-                out = ''
-                logger.debug('Device did not return anything when trying to read')
-            self.device.timeout = self.timeout
+            out = self.pacer.read(self.device, timeout*1e-3)
+        self.device.timeout = self.timeout
+        if out is None:
+            out = ''
+            logger.debug('Device did not return anything when trying to read')
         return out.rstrip()
 
+    @tracing.traced('query')
     def query(self, command):
         """ Queries a value from the scope
 
@@ -412,6 +422,23 @@ class Scope(object):
         """
         logger.debug('get_data(channel={0}, data_width={1}, data_units={2}'.format(
             channel, data_width, data_units))
+        data_raw = self._request_curve(channel, data_width)
+        # Get the scope parameters to convert the data units
+        sleep(2)
+        return self._convert_curve(data_raw, data_units)
+
+    def _request_curve(self, channel=1, data_width=1):
+        """ Configures the data transfer and reads the raw curve from the scope
+
+        This is the first half of `get_data`.
+
+        :param channel: An integer which is a valid channel number or the channel name
+        :param data_width: Sets the bit depth of the returned data (1=8 bit, 2=16bit)
+        :type channel: int or str
+        :type data_width: int
+        :return: The comma separated curve data as transmitted by the scope
+        :rtype: str
+        """
         # Set the channel
         ch_int = self.parse_channel(channel)
         out = self.write('DATA:SOURCE ' + ch_int)
@@ -451,8 +478,20 @@ class Scope(object):
         logger.info('Data retrieval finished')
         # Reset the timeout
         self.device.timeout = self.timeout
-        # Get the scope parameters to convert the data units
-        sleep(2)
+        return data_raw
+
+    def _convert_curve(self, data_raw, data_units='volts'):
+        """ Converts the raw curve data using the scope's waveform preamble
+
+        This is the second half of `get_data`.
+
+        :param data_raw: The curve data returned by `_request_curve`
+        :param data_units: 'volts' returns the data in volts and 'bytes' returns the data in the form transmitted by the scope
+        :type data_raw: str
+        :type data_units: str ('volts' or 'bytes')
+        :return: The times and data as numpy arrays
+        :rtype: np.ndarray, np.ndarray
+        """
         logger.debug('Getting info to convert units of scope trace')
         if self.device_type == 'TDS':
             pre = 'WFMPRE:'
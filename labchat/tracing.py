@@ -0,0 +1,478 @@
+""" Per-command latency instrumentation for the labchat drivers
+
+The `write`, `read` and `query` methods of the drivers (and the COM calls of
+the Ophir power meter) are decorated with `traced`.  When at least one hook
+has been registered with `add_hook`, each call produces a `Span` recording
+the command, the bytes transferred, the duration, the number of retries and
+the time slept inside the call, and the finished span is passed to every
+hook.  When no hooks are registered the decorators reduce to a single list
+check, so the overhead of the instrumentation is negligible.
+
+Two collectors are provided:
+
+  - `HistogramCollector` keeps an HDR-style latency histogram per operation
+    and command prefix
+  - `ChromeTraceCollector` keeps the spans as Chrome trace events which can
+    be exported to JSON and opened in chrome://tracing or Perfetto
+
+Example::
+
+    hist = HistogramCollector()
+    add_hook(hist)
+    scope.get_data(1)
+    print(hist.summary())
+"""
+
+import collections
+import functools
+import json
+import logging
+import os
+import threading
+import time
+
+__email__ = "chrisark7@gmail.com"
+__status__ = "Development"
+
+logger = logging.getLogger(__name__)
+
+_hooks = []
+_local = threading.local()
+
+
+###############################################################################
+# Spans and Hooks
+###############################################################################
+class Span(object):
+    """ The record of a single traced call
+
+    Times are in seconds; `start` is taken from `time.perf_counter`.
+    """
+    __slots__ = ('instrument', 'operation', 'command', 'start', 'duration',
+                 'bytes_out', 'bytes_in', 'retries', 'sleep_time', 'depth',
+                 'thread', 'error')
+
+    def __init__(self, instrument, operation, command, depth):
+        self.instrument = instrument
+        self.operation = operation
+        self.command = command
+        self.start = time.perf_counter()
+        self.duration = 0.0
+        self.bytes_out = 0
+        self.bytes_in = 0
+        self.retries = 0
+        self.sleep_time = 0.0
+        self.depth = depth
+        self.thread = threading.current_thread().ident
+        self.error = None
+
+    def as_dict(self):
+        """ Returns the span as a dictionary
+        """
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+def add_hook(hook):
+    """ Registers a callable which receives every finished `Span`
+
+    :param hook: A callable taking a single Span argument
+    :type hook: callable
+    """
+    if hook not in _hooks:
+        _hooks.append(hook)
+
+
+def remove_hook(hook):
+    """ Unregisters a hook previously passed to `add_hook`
+    """
+    if hook in _hooks:
+        _hooks.remove(hook)
+
+
+def enabled():
+    """ Returns True if any hooks are registered
+    """
+    return bool(_hooks)
+
+
+def _stack():
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+def _size(value):
+    if isinstance(value, (str, bytes, bytearray)):
+        return len(value)
+    if isinstance(value, int) and not isinstance(value, bool):
+        return 1
+    return 0
+
+
+def traced(operation):
+    """ Decorator which emits a span for each call of a driver method
+
+    The first positional argument of the method (if any) is recorded as the
+    command, except for 'read' operations which have no command.  For the
+    'write' and 'query' operations its length is counted as bytes sent, and
+    for the 'read' and 'query' operations the length of the return value is
+    counted as bytes received.
+
+    :param operation: The name of the traced operation (e.g. 'write')
+    :type operation: str
+    """
+    counts_out = operation in ('write', 'query')
+    counts_in = operation in ('read', 'query')
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            if not _hooks:
+                return func(self, *args, **kwargs)
+            if operation == 'read':
+                command = ''
+            else:
+                command = args[0] if args else kwargs.get('command', '')
+            stack = _stack()
+            span = Span(type(self).__name__, operation, command, len(stack))
+            if counts_out:
+                span.bytes_out = _size(command)
+            stack.append(span)
+            try:
+                out = func(self, *args, **kwargs)
+            except Exception as e:
+                span.error = repr(e)
+                raise
+            else:
+                if counts_in:
+                    span.bytes_in = _size(out)
+            finally:
+                span.duration = time.perf_counter() - span.start
+                stack.pop()
+                _emit(span)
+            return out
+        return wrapper
+    return decorator
+
+
+def traced_steps(operation):
+    """ Decorator which emits a span for each run of a generator of steps
+
+    The decorated method is a generator which does its I/O itself and yields
+    the length of each pause instead of sleeping (e.g.
+    `VisaUsbInstrument._set_with_check_steps`).  The span covers the whole
+    run, including the pauses, which are counted as sleep time.  It is the
+    innermost active span only while a step runs, so the pauses may be taken
+    with `asyncio.sleep` and the steps run on any thread.  The command is
+    recorded as by `traced`.
+
+    :param operation: The name of the traced operation (e.g. 'set')
+    :type operation: str
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            steps = func(self, *args, **kwargs)
+            if not _hooks:
+                return (yield from steps)
+            command = args[0] if args else kwargs.get('command', '')
+            span = Span(type(self).__name__, operation, command, len(_stack()))
+            try:
+                while True:
+                    stack = _stack()
+                    stack.append(span)
+                    try:
+                        pause = next(steps)
+                    finally:
+                        stack.remove(span)
+                    span.sleep_time += pause
+                    yield pause
+            except StopIteration as e:
+                return e.value
+            except Exception as e:
+                span.error = repr(e)
+                raise
+            finally:
+                span.duration = time.perf_counter() - span.start
+                _emit(span)
+        return wrapper
+    return decorator
+
+
+def _emit(span):
+    for hook in list(_hooks):
+        try:
+            hook(span)
+        except Exception:
+            logger.exception('Tracing hook {0!r} failed'.format(hook))
+
+
+def sleep(seconds):
+    """ Sleeps like `time.sleep` and charges the time to the active spans
+
+    The drivers import this function in place of `time.sleep` so that the
+    time they spend waiting shows up in their spans.
+    """
+    if _hooks:
+        for span in _stack():
+            span.sleep_time += seconds
+    time.sleep(seconds)
+
+
+def note_retry():
+    """ Counts a retry against the innermost active span
+    """
+    if _hooks:
+        stack = _stack()
+        if stack:
+            stack[-1].retries += 1
+
+
+class TracedObject(object):
+    """ Wraps an object so that calls to its methods are traced
+
+    This is used for COM objects whose methods cannot be decorated.  Each
+    method call produces a span with operation `operation` and the method
+    name as the command.
+    """
+    def __init__(self, target, name, operation='com'):
+        """ The constructor for the TracedObject class
+
+        :param target: The object to wrap
+        :param name: The instrument name recorded in the spans
+        :param operation: The operation name recorded in the spans
+        :type name: str
+        :type operation: str
+        """
+        self.__dict__['_target'] = target
+        self.__dict__['_name'] = name
+        self.__dict__['_operation'] = operation
+        self.__dict__['_methods'] = {}
+
+    def __getattr__(self, attr):
+        value = getattr(self._target, attr)
+        if not callable(value):
+            return value
+        method = self._methods.get(attr)
+        if method is None:
+            def method(*args, **kwargs):
+                if not _hooks:
+                    return getattr(self._target, attr)(*args, **kwargs)
+                stack = _stack()
+                span = Span(self._name, self._operation, attr, len(stack))
+                stack.append(span)
+                try:
+                    return getattr(self._target, attr)(*args, **kwargs)
+                except Exception as e:
+                    span.error = repr(e)
+                    raise
+                finally:
+                    span.duration = time.perf_counter() - span.start
+                    stack.pop()
+                    _emit(span)
+            self._methods[attr] = method
+        return method
+
+    def __setattr__(self, attr, value):
+        setattr(self._target, attr, value)
+
+
+###############################################################################
+# Collectors
+###############################################################################
+class LatencyHistogram(object):
+    """ A log-linear latency histogram in the style of HdrHistogram
+
+    Values are recorded in integer nanoseconds.  Each power of two is split
+    into 2**`sub_bucket_bits` linear sub-buckets, so the relative error of
+    the reported percentiles is below 2**-`sub_bucket_bits`.
+    """
+    def __init__(self, sub_bucket_bits=5):
+        """ The constructor for the LatencyHistogram class
+
+        :param sub_bucket_bits: log2 of the number of sub-buckets per octave
+        :type sub_bucket_bits: int
+        """
+        self.sub_bucket_bits = sub_bucket_bits
+        self.counts = {}
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def _bucket(self, value):
+        shift = max(value.bit_length() - self.sub_bucket_bits - 1, 0)
+        return shift, value >> shift
+
+    def record(self, seconds):
+        """ Records a latency value given in seconds
+        """
+        value = max(int(seconds * 1e9), 0)
+        key = self._bucket(value)
+        self.counts[key] = self.counts.get(key, 0) + 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def percentile(self, p):
+        """ Returns the latency in seconds below which `p` percent fall
+
+        :param p: The percentile, 0-100
+        :type p: float
+        :return: latency in seconds
+        :rtype: float
+        """
+        if not self.count:
+            return 0.0
+        target = max(p / 100.0 * self.count, 1)
+        seen = 0
+        for shift, sub in sorted(self.counts):
+            seen += self.counts[(shift, sub)]
+            if seen >= target:
+                # Report the upper edge of the bucket, clipped to the max
+                return min(((sub + 1) << shift) - 1, self.max) * 1e-9
+        return self.max * 1e-9
+
+    def mean(self):
+        """ Returns the mean latency in seconds
+        """
+        return self.total / self.count * 1e-9 if self.count else 0.0
+
+    def as_dict(self):
+        """ Returns summary statistics of the histogram in seconds
+        """
+        return {'count': self.count,
+                'min': (self.min or 0) * 1e-9,
+                'mean': self.mean(),
+                'p50': self.percentile(50),
+                'p90': self.percentile(90),
+                'p99': self.percentile(99),
+                'max': (self.max or 0) * 1e-9}
+
+
+def command_prefix(command):
+    """ Returns the header of a command, e.g. 'SOURCE1:FREQUENCY?'
+
+    :param command: The command passed to the traced method
+    :return: The command without its arguments
+    :rtype: str
+    """
+    if isinstance(command, (bytes, bytearray)):
+        # Raw writes carrying binary data
+        command = bytes(command[:64]).decode('latin_1')
+    elif not isinstance(command, str):
+        return str(command)
+    return command.strip().split(' ', 1)[0]
+
+
+class HistogramCollector(object):
+    """ A hook which keeps a latency histogram per (operation, prefix)
+
+    Only spans at the top level of a call stack are recorded by default, so
+    a `query` is counted once rather than also as a `write` and a `read`.
+    """
+    def __init__(self, prefix=command_prefix, top_level_only=True,
+                 sub_bucket_bits=5):
+        """ The constructor for the HistogramCollector class
+
+        :param prefix: A function mapping a command to its histogram key
+        :param top_level_only: If True, nested spans are ignored
+        :param sub_bucket_bits: Passed to each LatencyHistogram
+        :type prefix: callable
+        :type top_level_only: bool
+        :type sub_bucket_bits: int
+        """
+        self.prefix = prefix
+        self.top_level_only = top_level_only
+        self.sub_bucket_bits = sub_bucket_bits
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, span):
+        if self.top_level_only and span.depth:
+            return
+        key = (span.instrument, span.operation, self.prefix(span.command))
+        with self._lock:
+            hist = self.histograms.get(key)
+            if hist is None:
+                hist = self.histograms[key] = LatencyHistogram(
+                    self.sub_bucket_bits)
+            hist.record(span.duration)
+
+    def reset(self):
+        """ Discards all of the recorded histograms
+        """
+        with self._lock:
+            self.histograms.clear()
+
+    def summary(self):
+        """ Returns a text table of the recorded latencies in milliseconds
+        """
+        lines = ['{0:52s}{1:>8s}{2:>10s}{3:>10s}{4:>10s}{5:>10s}'.format(
+            'instrument/operation/command', 'count', 'p50', 'p90', 'p99',
+            'max')]
+        for key in sorted(self.histograms, key=str):
+            stats = self.histograms[key].as_dict()
+            lines.append('{0:52s}{1:>8d}{2:>10.3f}{3:>10.3f}{4:>10.3f}'
+                         '{5:>10.3f}'.format('/'.join(key)[:52],
+                                             stats['count'],
+                                             stats['p50'] * 1e3,
+                                             stats['p90'] * 1e3,
+                                             stats['p99'] * 1e3,
+                                             stats['max'] * 1e3))
+        return '\n'.join(lines)
+
+
+class ChromeTraceCollector(object):
+    """ A hook which stores spans as Chrome trace-event records
+
+    At most `max_events` events are kept; older events are discarded once
+    the limit is reached.
+    """
+    def __init__(self, max_events=1000000):
+        """ The constructor for the ChromeTraceCollector class
+
+        :param max_events: The maximum number of events to keep
+        :type max_events: int
+        """
+        self.max_events = max_events
+        self.events = collections.deque(maxlen=max_events)
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def __call__(self, span):
+        event = {'name': '{0} {1}'.format(span.operation,
+                                          command_prefix(span.command)),
+                 'cat': span.instrument,
+                 'ph': 'X',
+                 'ts': span.start * 1e6,
+                 'dur': span.duration * 1e6,
+                 'pid': self._pid,
+                 'tid': span.thread,
+                 'args': {'command': str(span.command),
+                          'bytes_out': span.bytes_out,
+                          'bytes_in': span.bytes_in,
+                          'retries': span.retries,
+                          'sleep_time': span.sleep_time}}
+        if span.error is not None:
+            event['args']['error'] = span.error
+        with self._lock:
+            if len(self.events) == self.max_events:
+                self.dropped += 1
+            self.events.append(event)
+
+    def export(self, filename):
+        """ Writes the collected events to a Chrome trace JSON file
+
+        :param filename: The path of the file to write
+        :type filename: str
+        """
+        with self._lock:
+            events = list(self.events)
+        with open(filename, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
@@ -8,9 +8,12 @@ National Instruments and is freely available online.
 """
 
 import logging
-from time import time, sleep
+from time import time
 from difflib import get_close_matches
 import visa
+from labchat import tracing
+from labchat.pacing import Pacer
+from labchat.tracing import sleep
 
 __email__ = "chrisark7@gmail.com"
 __status__ = "Development"
@@ -28,7 +31,8 @@ class VisaUsbInstrument(object):
     USB-based instruments and is intended primarily as a superclass for more
     detailed instrument-specific implementations.
     """
-    def __init__(self, device_id=0, timeout=0.5):
+    def __init__(self, device_id=0, timeout=0.5, resource_manager=None,
+                 min_gap=0):
         """ The constructor for the VisaUsbInstrument class
 
         This function searches the devices connected to the computer and
@@ -38,15 +42,30 @@ class VisaUsbInstrument(object):
 
         The list of devices connected to the computer will be printed to the log.
 
+        The `resource_manager` argument can be used to supply an object other
+        than `visa.ResourceManager()` to find and open the device, such as the
+        `SimResourceManager` in the `labchat.simulator` module.
+
+        Instruments which need time between commands can be given a
+        `min_gap`, the minimum time between the end of one transfer and the
+        next command (see `labchat.pacing.Pacer`).
+
         :param device_id: Integer or string which describes the device to connect to
         :param timeout: The timeout value to use with the instrument in seconds
+        :param resource_manager: The resource manager used to open the device
+        :param min_gap: The minimum time between transfers in seconds
         :type device_id: int or str
         :type timeout: int or float
+        :type resource_manager: visa.ResourceManager
+        :type min_gap: float
         :return: An instance of the VisaUsbInstrument class
         :rtype: VisaUsbInstrument
         """
         # Get list of devices connected to the computer
-        rm = visa.ResourceManager()
+        if resource_manager is None:
+            rm = visa.ResourceManager()
+        else:
+            rm = resource_manager
         devices = rm.list_resources()
         # Check device list
         if not devices:
@@ -83,6 +102,7 @@ class VisaUsbInstrument(object):
         self.resource_manager = rm
         self.is_open = False
         self.device = None
+        self.pacer = Pacer(min_gap)
 
     ###########################################################################
     # Helper Functions
@@ -147,6 +167,7 @@ class VisaUsbInstrument(object):
         self.device.flush(mask=64)
         self.device.flush(mask=128)
 
+    @tracing.traced('write')
     def write(self, command):
         """ Writes a command to the instrument
 
@@ -157,38 +178,60 @@ class VisaUsbInstrument(object):
         """
         if not self.is_open:
             raise IOError('Communication to the instrument is closed')
+        self.pacer.wait()
         try:
             out = self.device.write(command)
         except visa.VisaIOError:
             raise ValueError('Command timed out; most likely it is not a valid '
                              'command')
+        finally:
+            self.pacer.mark()
+        return out
+
+    @tracing.traced('write')
+    def write_raw(self, message):
+        """ Writes raw bytes, such as a command with binary data, to the instrument
+
+        No termination is added to the message.
+
+        :param message: The bytes to send
+        :type message: bytes
+        :return: the output of the write command
+        :rtype: int
+        """
+        if not self.is_open:
+            raise IOError('Communication to the instrument is closed')
+        self.pacer.wait()
+        try:
+            out = self.device.write_raw(message)
+        except visa.VisaIOError:
+            raise ValueError('Write timed out; most likely it is not a valid '
+                             'command')
+        finally:
+            self.pacer.mark()
         return out
 
+    @tracing.traced('read')
     def read(self):
         """ Reads the most recent output from the instrument
 
-        :param timeout: The timeout length in seconds
-        :type timeout: float
+        The read returns as soon as the terminator arrives and waits for it
+        for up to 100 ms longer than the timeout.
+
         :return: The output of the read command
         :rtype: str
         """
-        pause_between_tries = 100e-3
+        read_grace = 100e-3
         if not self.is_open:
             raise IOError('Communication to instrument is closed')
-        try:
-            out = self.device.read()
-        except visa.VisaIOError:
-            logger.debug('Instrument did not return anything, sleeping for '
-                         '{0} seconds and trying again'.format(pause_between_tries))
-            sleep(pause_between_tries)
-            try:
-                out = self.device.read()
-            except visa.VisaIOError:
-                out = ''
-                logger.warning('Instrument did not return anything when trying '
-                               'to read')
+        out = self.pacer.read(self.device, self.timeout*1e-3 + read_grace)
+        if out is None:
+            out = ''
+            logger.warning('Instrument did not return anything when trying '
+                           'to read')
         return out.rstrip()
 
+    @tracing.traced('query')
     def query(self, command):
         """ Queries a value from the instrument
 
@@ -235,6 +278,18 @@ class VisaUsbInstrument(object):
         :return: True or False
         :rtype: bool
         """
+        return self._run_steps(self._set_with_check_steps(command, query, result,
+                                                          transform, timeout))
+
+    @tracing.traced_steps('set')
+    def _set_with_check_steps(self, command, query, result, transform=None, timeout=5):
+        """ The steps of `_set_with_check` as a generator
+
+        The generator does the I/O of `_set_with_check` itself, yields the
+        length in seconds of each pause instead of sleeping, and returns the
+        result of the check.  `_run_steps` runs it with blocking sleeps, and
+        the asyncio wrappers in `labchat.aio` run it with `asyncio.sleep`.
+        """
         pause_between_loops = 100e-3
         pause_between_set_and_query = 25e-3
         set_bool = False
@@ -242,11 +297,12 @@ class VisaUsbInstrument(object):
         while not set_bool:
             # Set and query
             self.write(command)
-            sleep(pause_between_set_and_query)
+            yield pause_between_set_and_query
             out = self.query(query)
             # Try the query command again if out is an empty string
             if not out:
-                sleep(pause_between_loops)
+                yield pause_between_loops
+                tracing.note_retry()
                 out = self.query(query)
             # Transform the result
             if transform is not None:
@@ -257,4 +313,20 @@ class VisaUsbInstrument(object):
             elif time() - t0 > timeout:
                 return False
             else:
-                sleep(pause_between_loops)
+                yield pause_between_loops
+                tracing.note_retry()
+
+    @staticmethod
+    def _run_steps(steps):
+        """ Runs a generator of steps, sleeping for each pause it yields
+
+        :param steps: A generator such as `_set_with_check_steps`
+        :type steps: generator
+        :return: The return value of the generator
+        """
+        while True:
+            try:
+                pause = next(steps)
+            except StopIteration as e:
+                return e.value
+            sleep(pause)
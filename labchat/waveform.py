@@ -0,0 +1,100 @@
+""" Preparation of arbitrary waveform data for the function generators
+
+The arbitrary waveform memories of the function generators hold signed
+integer DAC codes.  The functions in this module scale a NumPy array of
+samples to the DAC range of a generator, convert it to the byte layout
+expected by the instrument and wrap it in an IEEE 488.2 definite-length
+binary block, all without Python-level loops over the samples.  `digest`
+gives a content hash of the quantized data which the drivers use to avoid
+uploading a waveform that is already in instrument memory.
+"""
+
+import hashlib
+import logging
+import numpy as np
+
+__email__ = "chrisark7@gmail.com"
+__status__ = "Development"
+
+logger = logging.getLogger(__name__)
+
+
+def normalize(data):
+    """ Scales the data linearly to span -1 to 1
+
+    A constant array is mapped to zeros.
+
+    :param data: The waveform samples
+    :type data: np.ndarray
+    :return: The scaled samples
+    :rtype: np.ndarray
+    """
+    data = np.asarray(data, dtype=float)
+    low, high = data.min(), data.max()
+    if high == low:
+        return np.zeros_like(data)
+    return (data - low) * (2 / (high - low)) - 1
+
+
+def quantize(data, full_scale, dtype, min_length=2, max_length=None, scale=True):
+    """ Converts waveform samples to DAC codes
+
+    If `scale` is True the data is first scaled with `normalize`, otherwise
+    it must already lie between -1 and 1.  The samples are then multiplied by
+    `full_scale` and rounded to the nearest code.
+
+    :param data: The waveform samples
+    :param full_scale: The DAC code corresponding to a sample of 1
+    :param dtype: The NumPy dtype of the codes, including the byte order (e.g. '>i2')
+    :param min_length: The minimum number of samples accepted by the instrument
+    :param max_length: The maximum number of samples accepted by the instrument
+    :param scale: Whether to scale the data to the full DAC range
+    :type data: np.ndarray
+    :type full_scale: int
+    :type dtype: str or np.dtype
+    :type min_length: int
+    :type max_length: int
+    :type scale: bool
+    :return: The DAC codes
+    :rtype: np.ndarray
+    """
+    data = np.asarray(data, dtype=float)
+    if data.ndim != 1:
+        raise ValueError('waveform data should be a 1d array')
+    if len(data) < min_length:
+        raise ValueError('waveform data should have at least {0} '
+                         'samples'.format(min_length))
+    if max_length is not None and len(data) > max_length:
+        raise ValueError('waveform data should have at most {0} '
+                         'samples'.format(max_length))
+    if not np.all(np.isfinite(data)):
+        raise ValueError('waveform data should be finite')
+    if scale:
+        data = normalize(data)
+    elif np.any(np.abs(data) > 1):
+        raise ValueError('waveform data should be between -1 and 1 when it is '
+                         'not scaled')
+    return np.rint(data * full_scale).astype(dtype)
+
+
+def digest(codes):
+    """ Returns a content hash of quantized waveform data
+
+    :param codes: The DAC codes from `quantize`
+    :type codes: np.ndarray
+    :return: A hexadecimal SHA-1 digest
+    :rtype: str
+    """
+    return hashlib.sha1(np.ascontiguousarray(codes).tobytes()).hexdigest()
+
+
+def binary_block(payload):
+    """ Wraps bytes in an IEEE 488.2 definite-length block
+
+    :param payload: The data of the block
+    :type payload: bytes
+    :return: '#', the number of length digits, the length and the data
+    :rtype: bytes
+    """
+    length = str(len(payload))
+    return '#{0}{1}'.format(len(length), length).encode('ascii') + payload
@@ -0,0 +1,205 @@
+""" Serialized access to an instrument through a dedicated worker thread
+
+None of the drivers are safe to share between threads: interleaved `write`
+and `read` calls from two threads corrupt `query` results, and methods such
+as `Scope.read` modify the device timeout.  An `InstrumentWorker` owns a
+driver instance and runs every call to it on a single I/O thread, taken from
+a priority queue, and returns a `concurrent.futures.Future` to the caller.
+Calls with the same priority run in the order they were submitted, while
+urgent calls jump ahead of the calls still waiting in the queue (a call that
+has already started is never interrupted).
+
+Example::
+
+    relay = InstrumentWorker(Relay('ASRL1::INSTR'))
+    relay.call('open').result()
+    # from a monitoring thread
+    state = relay.proxy.get_state(1).result()
+    # from the control thread, ahead of any queued monitoring calls
+    relay.urgent.turn_off(1).result()
+
+The futures can be awaited from asyncio with `asyncio.wrap_future`.
+"""
+
+import itertools
+import logging
+import queue
+import threading
+from concurrent.futures import Executor, Future
+
+__email__ = "chrisark7@gmail.com"
+__status__ = "Development"
+
+logger = logging.getLogger(__name__)
+
+# Priorities; lower numbers run first
+URGENT = 0
+NORMAL = 10
+BACKGROUND = 20
+
+
+###############################################################################
+# Worker
+###############################################################################
+class _WorkItem(object):
+    __slots__ = ('future', 'fn', 'args', 'kwargs')
+
+    def __init__(self, future, fn, args, kwargs):
+        self.future = future
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+
+    def run(self):
+        if not self.future.set_running_or_notify_cancel():
+            return
+        try:
+            result = self.fn(*self.args, **self.kwargs)
+        except BaseException as e:
+            self.future.set_exception(e)
+        else:
+            self.future.set_result(result)
+
+
+class InstrumentWorker(Executor):
+    """ An executor which runs all calls to one instrument on one thread
+
+    Any callable may be submitted, but the `call` method and the `proxy`,
+    `urgent` and `background` attributes provide shortcuts for calling the
+    methods of the instrument itself.
+    """
+    def __init__(self, instrument, name=None):
+        """ The constructor for the InstrumentWorker class
+
+        The worker thread is started immediately.  It is a daemon thread so
+        that an unclosed worker does not keep the interpreter alive.
+
+        :param instrument: The driver instance to serialize access to
+        :param name: The name of the worker thread
+        :type name: str
+        """
+        self.instrument = instrument
+        self._queue = queue.PriorityQueue()
+        self._counter = itertools.count()
+        self._shutdown = False
+        self._shutdown_lock = threading.Lock()
+        if name is None:
+            name = 'labchat-worker-{0}'.format(type(instrument).__name__)
+        self._thread = threading.Thread(target=self._run, name=name,
+                                        daemon=True)
+        self._thread.start()
+        self.proxy = _FutureProxy(self, NORMAL)
+        self.urgent = _FutureProxy(self, URGENT)
+        self.background = _FutureProxy(self, BACKGROUND)
+
+    def __repr__(self):
+        return '{0}({1!r})'.format(type(self).__name__, self.instrument)
+
+    def _run(self):
+        while True:
+            priority, count, item = self._queue.get()
+            if item is None:
+                break
+            item.run()
+            # Drop the reference so that the result can be garbage collected
+            del item
+
+    def submit(self, fn, *args, **kwargs):
+        """ Schedules `fn(*args, **kwargs)` with normal priority
+
+        :param fn: The callable to run on the worker thread
+        :return: A future for the result of the call
+        :rtype: concurrent.futures.Future
+        """
+        return self.submit_priority(NORMAL, fn, *args, **kwargs)
+
+    def submit_priority(self, priority, fn, *args, **kwargs):
+        """ Schedules `fn(*args, **kwargs)` with the given priority
+
+        Calls with lower priority numbers run first; see the URGENT, NORMAL
+        and BACKGROUND constants.  If this method is called from the worker
+        thread itself (i.e. from within a submitted call) the call is run
+        immediately, since waiting on it would deadlock the worker.
+
+        :param priority: The priority of the call
+        :param fn: The callable to run on the worker thread
+        :type priority: int
+        :return: A future for the result of the call
+        :rtype: concurrent.futures.Future
+        """
+        future = Future()
+        item = _WorkItem(future, fn, args, kwargs)
+        if threading.current_thread() is self._thread:
+            item.run()
+            return future
+        with self._shutdown_lock:
+            if self._shutdown:
+                raise RuntimeError('cannot schedule new calls after shutdown')
+            self._queue.put((priority, next(self._counter), item))
+        return future
+
+    def call(self, method, *args, **kwargs):
+        """ Schedules a call of one of the instrument's methods
+
+        The keyword argument `priority` sets the priority of the call, all
+        other arguments are passed to the method.
+
+        :param method: The name of the instrument method
+        :type method: str
+        :return: A future for the result of the call
+        :rtype: concurrent.futures.Future
+        """
+        priority = kwargs.pop('priority', NORMAL)
+        return self.submit_priority(priority, getattr(self.instrument, method),
+                                    *args, **kwargs)
+
+    def pending(self):
+        """ Returns the approximate number of calls waiting in the queue
+        """
+        return self._queue.qsize()
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        """ Stops the worker once the calls already in the queue have run
+
+        :param wait: If True, block until the worker thread has exited
+        :param cancel_futures: If True, cancel the calls still in the queue
+        :type wait: bool
+        :type cancel_futures: bool
+        """
+        with self._shutdown_lock:
+            if self._shutdown:
+                return
+            self._shutdown = True
+            if cancel_futures:
+                while True:
+                    try:
+                        item = self._queue.get_nowait()[2]
+                    except queue.Empty:
+                        break
+                    if item is not None:
+                        item.future.cancel()
+            # The sentinel sorts after every real call
+            self._queue.put((float('inf'), next(self._counter), None))
+        if wait and threading.current_thread() is not self._thread:
+            self._thread.join()
+
+
+class _FutureProxy(object):
+    """ Exposes the instrument's methods as functions returning futures
+    """
+    def __init__(self, worker, priority):
+        self._worker = worker
+        self._priority = priority
+
+    def __getattr__(self, attr):
+        method = getattr(self._worker.instrument, attr)
+        if not callable(method):
+            raise AttributeError('{0} is not a method of the '
+                                 'instrument'.format(attr))
+        worker, priority = self._worker, self._priority
+
+        def submit(*args, **kwargs):
+            return worker.submit_priority(priority, method, *args, **kwargs)
+        submit.__name__ = attr
+        submit.__doc__ = method.__doc__
+        return submit
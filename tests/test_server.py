@@ -0,0 +1,61 @@
+""" Tests for the read cache of labchat.server.InstrumentServer
+"""
+
+import os
+import tempfile
+import threading
+import time
+import unittest
+from labchat.server import InstrumentServer
+
+
+class FakeInstrument(object):
+    """ An instrument with one value whose reads take a little while
+    """
+    def __init__(self):
+        self.v = 0
+        self.started = threading.Event()
+
+    def get_v(self):
+        self.started.set()
+        value = self.v
+        time.sleep(0.2)
+        return value
+
+    def set_v(self, value):
+        self.v = value
+
+
+class TestReadCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.instrument = FakeInstrument()
+        self.server = InstrumentServer(
+            os.path.join(self.directory, 'labchat.sock'),
+            {'fake': self.instrument}, cache_ttl=5)
+
+    def tearDown(self):
+        self.server.server_close()
+        os.rmdir(self.directory)
+
+    def test_read_write_read(self):
+        """ A read queued before a write is not served after the write """
+        results = []
+        reader = threading.Thread(target=lambda: results.append(
+            self.server.dispatch('fake', 'get_v', (), {})))
+        reader.start()
+        self.assertTrue(self.instrument.started.wait(1))
+        self.server.dispatch('fake', 'set_v', (42,), {})
+        self.assertEqual(self.server.dispatch('fake', 'get_v', (), {}), 42)
+        reader.join()
+        self.assertEqual(results, [0])
+        self.assertEqual(self.server.dispatch('fake', 'get_v', (), {}), 42)
+
+    def test_read_is_cached(self):
+        self.assertEqual(self.server.dispatch('fake', 'get_v', (), {}), 0)
+        self.instrument.v = 1
+        self.assertEqual(self.server.dispatch('fake', 'get_v', (), {}), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()